@@ -34,24 +34,46 @@ import os
 import logging
 import asyncio
 import json
+import hashlib
+import hmac
+import sqlite3
 import random
 import re
-from typing import Optional, Dict, List, Any, Tuple
-from collections import deque
+import bisect
+import heapq
+import itertools
+import threading
+import time
+from typing import Optional, Dict, List, Any, Tuple, Iterator, AsyncIterator, Sequence
+from collections import deque, OrderedDict
 from pathlib import Path
+from contextlib import aclosing, asynccontextmanager
 from datetime import datetime, timedelta
 from datetime import time as datetime_time
 from zoneinfo import ZoneInfo
 
 import httpx
 from dotenv import load_dotenv
+from config import settings as _app_settings
 try:
     from supabase import create_client as _supabase_create_client, Client as _SupabaseClient
     _SUPABASE_AVAILABLE = True
 except ImportError:
     _SUPABASE_AVAILABLE = False
+try:
+    import h2  # noqa: F401 — يفعّل HTTP/2 في httpx
+    _HTTP2_AVAILABLE = True
+except ImportError:
+    _HTTP2_AVAILABLE = False
+try:
+    import pyarrow as _pa
+    import pyarrow.parquet as _pq
+    _PARQUET_AVAILABLE = True
+except ImportError:
+    _PARQUET_AVAILABLE = False
 from telegram import Update, BotCommand, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.constants import ParseMode
+from telegram.error import RetryAfter, Forbidden, TelegramError
 from telegram.ext import (
     ApplicationBuilder,
     CommandHandler,
@@ -77,16 +99,30 @@ SUPABASE_URL: str = os.getenv("SUPABASE_URL", "")
 SUPABASE_KEY: str = os.getenv("SUPABASE_KEY", "")
 
 # ── Webhook ──────────────────────────────────────────────────
-# يقرأ WEBHOOK_URL أو WEBHOOK_BASE_URL (كلاهما مقبول)
+# BOT_MODE=polling: عملية مستقلة (python bot.py)
+# BOT_MODE=webhook: البوت يعمل داخل تطبيق FastAPI (main.py) ويستقبل التحديثات على WEBHOOK_PATH
+# يُقرأ من config.settings كما في main.py و gunicorn.conf.py و start.sh — مصدر واحد لا يختلفان عليه
+BOT_MODE: str = _app_settings.bot_mode
+# يقرأ WEBHOOK_URL أو WEBHOOK_BASE_URL (كلاهما مقبول) — العنوان العام للموقع
 _raw_webhook = os.getenv("WEBHOOK_URL", "") or os.getenv("WEBHOOK_BASE_URL", "")
 WEBHOOK_URL: str  = _raw_webhook.rstrip("/")
 WEBHOOK_PORT: int = int(os.getenv("PORT", "10000"))  # Render يستخدم 10000 افتراضياً
-_tok_for_path   = os.getenv("TELEGRAM_TOKEN", "token")
-WEBHOOK_PATH: str = f"/webhook/{_tok_for_path}"
+WEBHOOK_PATH: str = "/api/telegram/webhook"
+# يرسله Telegram في ترويسة X-Telegram-Bot-Api-Secret-Token — افتراضياً مشتق من التوكن
+WEBHOOK_SECRET: str = os.getenv("WEBHOOK_SECRET", "") or hashlib.sha256(
+    f"nibras-webhook:{os.getenv('TELEGRAM_TOKEN', '')}".encode()
+).hexdigest()[:48]
 
 # ── Rate Limiting ────────────────────────────────────────────
 RATE_LIMIT_WINDOW: int = 60   # ثانية
 RATE_LIMIT_MAX:    int = 20   # أقصى رسائل في الدقيقة
+RATE_LIMIT_BUTTON_MAX: int = int(os.getenv("RATE_LIMIT_BUTTON_MAX", "60"))  # ضغطات أزرار في الدقيقة
+RATE_LIMIT_AI_MAX:     int = int(os.getenv("RATE_LIMIT_AI_MAX", "8"))       # طلبات AI في الدقيقة
+RATE_LIMIT_MAX_KEYS:   int = 50_000  # أقصى عدد مستخدمين يُتتبَّعون لكل فئة (LRU)
+# فارغ = عدادات في الذاكرة (عملية واحدة) | مسار ملف SQLite = عدادات مشتركة بين كل العمليات على نفس الجهاز
+RATE_LIMIT_DB_PATH:    str = os.getenv("RATE_LIMIT_DB_PATH", "")
+# أقصى انتظار لقفل SQLite — الفحص يجري على حلقة الأحداث، فعند التزاحم نسمح فوراً
+RATE_LIMIT_DB_BUSY_TIMEOUT: float = 0.005
 
 
 # تهيئة عميل Supabase (None إذا لم تكن متغيرات البيئة مضبوطة)
@@ -105,38 +141,255 @@ else:
 _maintenance_mode: bool = False
 
 # ── Rate Limiting (حماية من الإرسال الزائد) ─────────────────
-from collections import defaultdict
-_rate_limit_store: Dict[int, List[float]] = defaultdict(list)
+class GCRALimiter:
+    """
+    محدِّد معدل بخوارزمية GCRA (مكافئة لدلو الرموز) — O(1) لكل طلب
+    يُخزَّن لكل مستخدم رقم واحد فقط (وقت الوصول النظري TAT)، والمخزن
+    محدود بـ max_keys بسياسة LRU، والمفاتيح الخاملة تُحذف عند التنظيف
+    """
+
+    def __init__(self, limit: int, period: float, burst: Optional[int] = None, max_keys: int = RATE_LIMIT_MAX_KEYS) -> None:
+        self.limit    = limit
+        self.period   = period
+        self.interval = period / limit                     # فاصل الإصدار
+        self.tolerance = self.interval * ((burst or limit) - 1)
+        self.max_keys = max_keys
+        self._tat: "OrderedDict[int, float]" = OrderedDict()
+        self.allowed = self.throttled = 0
+
+    def __len__(self) -> int:
+        return len(self._tat)
+
+    def allow(self, key: int) -> bool:
+        now = time.monotonic()
+        tat = max(self._tat.get(key, now), now)
+        if tat - now > self.tolerance:
+            self.throttled += 1
+            return False
+        self._tat[key] = tat + self.interval
+        self._tat.move_to_end(key)
+        if len(self._tat) > self.max_keys:
+            self.sweep(now)
+            while len(self._tat) > self.max_keys:
+                self._tat.popitem(last=False)
+        self.allowed += 1
+        return True
+
+    def sweep(self, now: Optional[float] = None) -> int:
+        """حذف المستخدمين الذين امتلأ دلوهم (لا فرق بينهم وبين مستخدم جديد)"""
+        now = time.monotonic() if now is None else now
+        idle = [k for k, tat in self._tat.items() if tat <= now]
+        for k in idle:
+            del self._tat[k]
+        return len(idle)
+
+
+class SQLiteWindowLimiter:
+    """
+    محدِّد معدل بعدّاد النافذة المنزلقة (sliding window counter) في SQLite مشترك
+    ─────────────────────────────────────────────────────────────────────────
+    لعدة عمليات (workers) على نفس الجهاز: التقدير = عدد النافذة السابقة × الجزء
+    المتبقي منها + عدد النافذة الحالية. القراءة والزيادة داخل BEGIN IMMEDIATE
+    فهي ذرّية بين العمليات. عند تعذّر القفل خلال RATE_LIMIT_DB_BUSY_TIMEOUT
+    (بضعة أجزاء من الثانية) يُسمح بالطلب (fail-open) — لا يتوقف البوت عند التزاحم.
+
+    burst يحاكي سماحية GCRALimiter: نافذة قصيرة ثانية (burst طلب لكل
+    burst × period/limit ثانية) بجانب الأساسية، فيبقى المعدل المستمر نفسه
+    ولا يُسمح بـ limit طلب دفعة واحدة — نفس الإعداد يتصرف بالمثل في الخلفيتين.
+    """
+
+    SWEEP_EVERY = 1000   # حذف النوافذ القديمة كل N طلب
+
+    def __init__(
+        self, conn: sqlite3.Connection, tier: str, limit: int, period: float, burst: Optional[int] = None,
+    ) -> None:
+        self.conn   = conn
+        self.tier   = tier
+        self.limit  = limit
+        self.period = period
+        # (اسم النافذة في الجدول, الحد, طولها)
+        self._windows: List[Tuple[str, int, float]] = [(tier, limit, period)]
+        if burst and burst < limit:
+            self._windows.append((f"{tier}:burst", burst, period / limit * burst))
+        self.allowed = self.throttled = self.failed_open = 0
+
+    def __len__(self) -> int:
+        window = int(time.time() // self.period)
+        row = self.conn.execute(
+            "SELECT COUNT(DISTINCT key) FROM rate_windows WHERE tier = ? AND window >= ?",
+            (self.tier, window - 1),
+        ).fetchone()
+        return row[0]
+
+    def _estimate(self, tier: str, period: float, key: int, now: float) -> Tuple[float, int]:
+        """(التقدير في النافذة المنزلقة, رقم النافذة الحالية)"""
+        window = int(now // period)
+        weight = 1 - (now % period) / period
+        counts = dict(self.conn.execute(
+            "SELECT window, count FROM rate_windows WHERE tier = ? AND key = ? AND window IN (?, ?)",
+            (tier, key, window - 1, window),
+        ).fetchall())
+        return counts.get(window - 1, 0) * weight + counts.get(window, 0), window
+
+    def allow(self, key: int) -> bool:
+        now = time.time()
+        try:
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                hits = []
+                allowed = True
+                for tier, limit, period in self._windows:
+                    estimate, window = self._estimate(tier, period, key, now)
+                    if estimate >= limit:
+                        allowed = False
+                        break
+                    hits.append((tier, key, window))
+                if allowed:
+                    self.conn.executemany(
+                        "INSERT INTO rate_windows (tier, key, window, count) VALUES (?, ?, ?, 1) "
+                        "ON CONFLICT (tier, key, window) DO UPDATE SET count = count + 1",
+                        hits,
+                    )
+            finally:
+                self.conn.execute("COMMIT")
+        except sqlite3.Error as exc:
+            logger.debug(f"rate limit db error: {exc}")
+            self.failed_open += 1
+            if self.conn.in_transaction:
+                try:
+                    self.conn.execute("ROLLBACK")
+                except sqlite3.Error:
+                    pass
+            return True
+        if not allowed:
+            self.throttled += 1
+            return False
+        self.allowed += 1
+        if self.allowed % self.SWEEP_EVERY == 0:
+            self.sweep()
+        return True
 
-def check_rate_limit(user_id: int) -> bool:
+    def sweep(self, now: Optional[float] = None) -> int:
+        now = time.time() if now is None else now
+        try:
+            return sum(
+                self.conn.execute(
+                    "DELETE FROM rate_windows WHERE tier = ? AND window < ?", (tier, int(now // period) - 1)
+                ).rowcount
+                for tier, _, period in self._windows
+            )
+        except sqlite3.Error:
+            return 0
+
+
+def _open_rate_limit_db(path: str) -> sqlite3.Connection:
+    # مهلة مريحة للتهيئة (قد تتزامن عدة عمليات عند الإقلاع) ثم مهلة قصيرة للفحوص
+    conn = sqlite3.connect(path, timeout=5.0, isolation_level=None, check_same_thread=False)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS rate_windows ("
+        " tier TEXT NOT NULL, key INTEGER NOT NULL, window INTEGER NOT NULL, count INTEGER NOT NULL,"
+        " PRIMARY KEY (tier, key, window)) WITHOUT ROWID"
+    )
+    conn.execute(f"PRAGMA busy_timeout = {max(1, int(RATE_LIMIT_DB_BUSY_TIMEOUT * 1000))}")
+    return conn
+
+
+# فئات التحديد — message: الرسائل | button: الأزرار | ai: طلبات الذكاء الاصطناعي
+if RATE_LIMIT_DB_PATH:
+    _rate_limit_db = _open_rate_limit_db(RATE_LIMIT_DB_PATH)
+    _rate_limiters: Dict[str, Any] = {
+        "message": SQLiteWindowLimiter(_rate_limit_db, "message", RATE_LIMIT_MAX,        RATE_LIMIT_WINDOW),
+        "button":  SQLiteWindowLimiter(_rate_limit_db, "button",  RATE_LIMIT_BUTTON_MAX, RATE_LIMIT_WINDOW),
+        "ai":      SQLiteWindowLimiter(_rate_limit_db, "ai",      RATE_LIMIT_AI_MAX,     RATE_LIMIT_WINDOW, burst=3),
+    }
+else:
+    _rate_limiters = {
+        "message": GCRALimiter(RATE_LIMIT_MAX,        RATE_LIMIT_WINDOW),
+        "button":  GCRALimiter(RATE_LIMIT_BUTTON_MAX, RATE_LIMIT_WINDOW),
+        "ai":      GCRALimiter(RATE_LIMIT_AI_MAX,     RATE_LIMIT_WINDOW, burst=3),
+    }
+
+def check_rate_limit(user_id: int, tier: str = "message") -> bool:
     """True = مسموح | False = تجاوز الحد"""
-    import time
-    now     = time.time()
-    window  = _rate_limit_store[user_id]
-    # احذف الطلبات القديمة خارج النافذة
-    _rate_limit_store[user_id] = [t for t in window if now - t < RATE_LIMIT_WINDOW]
-    if len(_rate_limit_store[user_id]) >= RATE_LIMIT_MAX:
-        return False
-    _rate_limit_store[user_id].append(now)
-    return True
+    return _rate_limiters[tier].allow(user_id)
 
 
 # ── Cache للأحاديث (يُخزن النصوص المُنسَّقة مؤقتاً) ─────────
-_hadith_cache: Dict[str, Any] = {}
-_cache_hits: int = 0
-
-def cache_get(key: str) -> Optional[Any]:
-    return _hadith_cache.get(key)
-
-def cache_set(key: str, value: Any) -> None:
-    global _hadith_cache
-    # حد أقصى 500 عنصر لتفادي استهلاك الذاكرة
-    if len(_hadith_cache) >= 500:
-        # احذف أقدم 100 عنصر
-        keys = list(_hadith_cache.keys())[:100]
-        for k in keys:
-            del _hadith_cache[k]
-    _hadith_cache[key] = value
+class LRUCache:
+    """
+    كاش محدود الحجم بسياسة LRU مع مدة صلاحية اختيارية (TTL)
+    يحتفظ بعدادات hits / misses / evictions / expired لعرضها في /admin_cache
+    """
+
+    def __init__(self, maxsize: int, ttl: Optional[float] = None) -> None:
+        self.maxsize = maxsize
+        self.ttl     = ttl
+        self._data: "OrderedDict[Any, Tuple[float, Any]]" = OrderedDict()
+        self.hits = self.misses = self.evictions = self.expired = 0
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def get(self, key: Any) -> Optional[Any]:
+        entry = self._data.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        stored_at, value = entry
+        if self.ttl is not None and time.monotonic() - stored_at > self.ttl:
+            del self._data[key]
+            self.expired += 1
+            self.misses  += 1
+            return None
+        self._data.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def set(self, key: Any, value: Any) -> None:
+        self._data[key] = (time.monotonic(), value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+            self.evictions += 1
+
+    def clear(self) -> int:
+        size = len(self._data)
+        self._data.clear()
+        self.hits = self.misses = self.evictions = self.expired = 0
+        return size
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "size":      len(self._data),
+            "maxsize":   self.maxsize,
+            "hits":      self.hits,
+            "misses":    self.misses,
+            "evictions": self.evictions,
+            "expired":   self.expired,
+            "hit_rate":  self.hits / lookups if lookups else 0.0,
+        }
+
+
+# مساحات الكاش — لكل نوع حجم ومدة مستقلة
+_caches: Dict[str, LRUCache] = {
+    "search":   LRUCache(maxsize=500, ttl=6 * 3600),  # نتائج البحث
+    "display":  LRUCache(maxsize=128),                # نص عرض الحديث (بدون الأزرار)
+    "narrator": LRUCache(maxsize=64),                 # بطاقات الرواة
+    "english":  LRUCache(maxsize=128),                # العرض الإنجليزي
+    "share":    LRUCache(maxsize=128),                # نص المشاركة
+    "list":     LRUCache(maxsize=8),                  # فهرس الأحاديث
+    "keyboard": LRUCache(maxsize=256),                # أزرار الحديث (4 حالات لكل حديث، كائنات مجمّدة)
+    "quiz":     LRUCache(maxsize=256),                # أسئلة الاختبار المولّدة من البذرة
+}
+
+def cache_get(namespace: str, key: Any) -> Optional[Any]:
+    return _caches[namespace].get(key)
+
+def cache_set(namespace: str, key: Any, value: Any) -> None:
+    _caches[namespace].set(key, value)
 
 _maintenance_message: str = "🔧 البوت في وضع الصيانة حالياً، يرجى المحاولة لاحقاً."
 
@@ -148,14 +401,34 @@ MONETAG_ENABLED:  bool = os.getenv("MONETAG_ENABLED", "True").strip().lower() ==
 MONETAG_DIRECT_LINK: str = os.getenv("MONETAG_DIRECT_LINK", "https://omg10.com/4/10632325")
 # عرض إعلان كل N تفاعل (0 = معطّل)
 MONETAG_INTERVAL: int  = 8
-# تتبع آخر مرة ظهر فيها إعلان لكل مستخدم {user_id: interaction_count_at_last_ad}
-_monetag_last_shown: Dict[int, int] = {}
 
 DEFAULT_REMINDER_TIME = "08:00"
 DEFAULT_TIMEZONE = "Asia/Riyadh"
 
 MAX_CONVERSATION_HISTORY = 8
+# ميزانية توكنات سجل المحادثة في كل طلب AI (تقديرية) — الأقدم يُقتطع/يُلخَّص
+AI_HISTORY_TOKEN_BUDGET: int = int(os.getenv("AI_HISTORY_TOKEN_BUDGET", "900"))
 REQUEST_TIMEOUT = 30.0
+# مهلات مزوّدي AI (ثوانٍ) — الاتصال قصير، القراءة تشمل زمن توليد الرد
+AI_CONNECT_TIMEOUT:    float = 5.0
+GOOGLE_TIMEOUT:        float = float(os.getenv("GOOGLE_TIMEOUT", "20"))
+OPENROUTER_TIMEOUT:    float = float(os.getenv("OPENROUTER_TIMEOUT", str(REQUEST_TIMEOUT)))
+AI_MAX_CONNECTIONS:    int   = 20
+AI_MAX_KEEPALIVE:      int   = 10
+# طلبات AI المتزامنة نحو المزوّدين — الزائد ينتظر في طابور (ويُبلَّغ المستخدم بترتيبه)
+AI_MAX_CONCURRENT:     int   = int(os.getenv("AI_MAX_CONCURRENT", "6"))
+AI_MAX_QUEUE:          int   = int(os.getenv("AI_MAX_QUEUE", "200"))
+
+# ── كاش شروحات AI الثابتة (شرح مبسط / مقارن لكل حديث) ─────────
+AI_CACHE_ENABLED: bool  = os.getenv("AI_CACHE_ENABLED", "True").strip().lower() == "true"
+AI_CACHE_PREWARM: bool  = os.getenv("AI_CACHE_PREWARM", "True").strip().lower() == "true"
+AI_CACHE_TTL:     float = float(os.getenv("AI_CACHE_TTL_DAYS", "30")) * 86400
+AI_PROMPT_VERSION: int  = 1   # ارفعه عند تعديل _PROMPTS أو _EXPLAIN_PROMPTS لإبطال الكاش
+
+# ── الجلسات المؤقتة (اختبار، بطاقات، ملاحظات، سياق AI) ──────
+# SESSION_DB_PATH فارغ = في الذاكرة فقط | مسار ملف = تبقى الجلسات بعد إعادة التشغيل
+SESSION_DB_PATH:   str = os.getenv("SESSION_DB_PATH", "")
+SESSION_MAX_BYTES: int = int(os.getenv("SESSION_MAX_BYTES", str(16 * 1024 * 1024)))
 
 HADITH_FILE_PATH = Path("nawawi40_structured.json")
 USER_DATA_PATH = Path("user_data")
@@ -195,7 +468,8 @@ def validate_configuration() -> None:
 class HadithDatabase:
     """إدارة بيانات الأحاديث — تستخرج كل حقول JSON الثرية"""
 
-    def __init__(self, file_path: Path) -> None:
+    def __init__(self, file_path: Path, records: Optional[List[Dict[str, Any]]] = None) -> None:
+        """records: سجلات خام مقروءة مسبقاً (لقطة main.py في وضع Webhook) بدل قراءة الملف"""
         self.file_path = file_path
         self.hadiths: List[Dict[str, Any]] = []
         self._index: Dict[int, Dict[str, Any]] = {}
@@ -203,7 +477,10 @@ class HadithDatabase:
         self._topics_index: Dict[str, List[int]] = {}
         # فهرس الموضوعات الفردية: topic → [hadith_ids]
         self._topic_tags_index: Dict[str, List[int]] = {}
-        self._load_data()
+        if records is not None:
+            self._index_records(records)
+        else:
+            self._load_data()
 
     def _load_data(self) -> None:
         if not self.file_path.exists():
@@ -212,23 +489,26 @@ class HadithDatabase:
         try:
             with open(self.file_path, "r", encoding="utf-8") as f:
                 raw = json.load(f)
-            for h in raw.get("hadiths", []):
-                hadith = self._normalise(h)
-                self.hadiths.append(hadith)
-                self._index[hadith["id"]] = hadith
-                # بناء فهرس التصنيفات
-                cat = hadith.get("category_arabic", "")
-                if cat:
-                    self._topics_index.setdefault(cat, []).append(hadith["id"])
-                # بناء فهرس الموضوعات الفردية
-                for tag in hadith.get("topics_arabic", []):
-                    self._topic_tags_index.setdefault(tag, []).append(hadith["id"])
-            logger.info(f"✅ تم تحميل {len(self.hadiths)} حديث | {len(self._topics_index)} تصنيف")
+            self._index_records(raw.get("hadiths", []))
         except json.JSONDecodeError as exc:
             logger.error(f"❌ خطأ في JSON: {exc}")
         except OSError as exc:
             logger.error(f"❌ خطأ في القراءة: {exc}")
 
+    def _index_records(self, records: List[Dict[str, Any]]) -> None:
+        for h in records:
+            hadith = self._normalise(h)
+            self.hadiths.append(hadith)
+            self._index[hadith["id"]] = hadith
+            # بناء فهرس التصنيفات
+            cat = hadith.get("category_arabic", "")
+            if cat:
+                self._topics_index.setdefault(cat, []).append(hadith["id"])
+            # بناء فهرس الموضوعات الفردية
+            for tag in hadith.get("topics_arabic", []):
+                self._topic_tags_index.setdefault(tag, []).append(hadith["id"])
+        logger.info(f"✅ تم تحميل {len(self.hadiths)} حديث | {len(self._topics_index)} تصنيف")
+
     @staticmethod
     def _normalise(h: Dict[str, Any]) -> Dict[str, Any]:
         """تحويل سجل خام إلى صيغة داخلية موحّدة — يستخرج كل الحقول"""
@@ -356,8 +636,8 @@ class HadithDatabase:
         words_norm = kw_norm.split()
 
         # cache key
-        cache_key = f"search:{kw}:{limit}"
-        cached = cache_get(cache_key)
+        cache_key = (kw, limit)
+        cached = cache_get("search", cache_key)
         if cached is not None:
             return cached
 
@@ -406,7 +686,7 @@ class HadithDatabase:
 
         scored.sort(key=lambda x: x[0], reverse=True)
         result = [h for _, h in scored[:limit]]
-        cache_set(cache_key, result)
+        cache_set("search", cache_key, result)
         return result
 
     def get_related(self, hadith_id: int, limit: int = 3) -> List[Dict[str, Any]]:
@@ -495,11 +775,167 @@ _USER_DEFAULTS: Dict[str, Any] = {
 }
 
 
+class UserActivityIndex:
+    """
+    فهارس ثانوية مرتبة لأوامر المشرف (/admin_top و /admin_inactive)
+    ─────────────────────────────────────────────────────────────────
+    - قائمة مرتبة (قراءات ↓، تفاعلات ↓) → أعلى k في O(k)
+    - دلاء حسب تاريخ آخر نشاط {date_iso: [uids]} → غير النشطين بدون مسح الكل
+    تُبنى مرة واحدة من get_all_users ثم تُحدَّث مع كل _save.
+
+    يُحدَّث من حلقة الأحداث (_save) ومن خيوط to_thread (save_many)، لذا كل
+    قراءة وتعديل تحت _lock — bisect ثم del بموضع قد يحذف عنصراً خاطئاً لو تداخلا.
+    insort على list كلفته O(N) (إزاحة الذاكرة) لكل حفظ متغيّر؛ مقبول حتى عشرات
+    الآلاف من المستخدمين (memmove لبضع مئات KB)، وبعدها يلزم هيكل شجري.
+    """
+
+    _NEVER = ""   # مفتاح دلو من لم يتفاعل أبداً (يُرتَّب أولاً)
+
+    def __init__(self) -> None:
+        self.built = False
+        # uid → (reads, interactions, streak, last_active, banned)
+        self._summary: Dict[int, Tuple[int, int, int, str, bool]] = {}
+        self._ranked: List[Tuple[int, int, int]] = []      # (-reads, -inter, uid)
+        self._buckets: Dict[str, List[int]] = {}           # last_active → uids مرتبة
+        self._banned = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _summarise(data: Dict[str, Any]) -> Tuple[int, int, int, str, bool]:
+        return (
+            len(data.get("read_hadiths", [])),
+            data.get("interaction_count", 0),
+            data.get("streak_count", 0),
+            (data.get("streak_last_date") or UserActivityIndex._NEVER)[:10],
+            bool(data.get("banned", False)),
+        )
+
+    def build(self, users: List[Tuple[int, Dict[str, Any]]]) -> None:
+        summaries = [(uid, self._summarise(data)) for uid, data in users]
+        with self._lock:
+            self._summary.clear()
+            self._ranked.clear()
+            self._buckets.clear()
+            self._banned = 0
+            for uid, s in summaries:
+                self._insert(uid, s)
+            self.built = True
+
+    def update(self, user_id: int, data: Dict[str, Any]) -> None:
+        if not self.built:
+            return
+        new = self._summarise(data)
+        with self._lock:
+            old = self._summary.get(user_id)
+            if old == new:
+                return
+            if old is not None:
+                self._remove(user_id, old)
+            self._insert(user_id, new)
+
+    # _insert/_remove تُستدعى والقفل ممسوك
+    def _insert(self, uid: int, s: Tuple[int, int, int, str, bool]) -> None:
+        self._summary[uid] = s
+        bisect.insort(self._ranked, (-s[0], -s[1], uid))
+        if not s[4]:   # المحظورون لا يظهرون في قائمة غير النشطين
+            bisect.insort(self._buckets.setdefault(s[3], []), uid)
+        else:
+            self._banned += 1
+
+    def _remove(self, uid: int, s: Tuple[int, int, int, str, bool]) -> None:
+        key = (-s[0], -s[1], uid)
+        i = bisect.bisect_left(self._ranked, key)
+        if i < len(self._ranked) and self._ranked[i] == key:
+            del self._ranked[i]
+        if s[4]:
+            self._banned -= 1
+            return
+        bucket = self._buckets.get(s[3], [])
+        j = bisect.bisect_left(bucket, uid)
+        if j < len(bucket) and bucket[j] == uid:
+            del bucket[j]
+        if not bucket:
+            self._buckets.pop(s[3], None)
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._summary)
+
+    def recipients(self) -> int:
+        """عدد غير المحظورين — مستلمو البث"""
+        with self._lock:
+            return len(self._summary) - self._banned
+
+    def top(self, k: int = 10) -> List[Tuple[int, Tuple[int, int, int, str, bool]]]:
+        """أنشط k مستخدمين — (uid, summary)"""
+        with self._lock:
+            return [(uid, self._summary[uid]) for _, _, uid in self._ranked[:k]]
+
+    def inactive(
+        self,
+        min_days: int = 7,
+        offset: int = 0,
+        limit: int = 15,
+        today: Optional[str] = None,
+    ) -> Tuple[List[Tuple[int, int, Tuple[int, int, int, str, bool]]], int, Optional[int]]:
+        """
+        غير النشطين منذ min_days يوماً على الأقل، الأقدم أولاً.
+        يُعيد (الصفحة [(uid, days, summary)], الإجمالي, المؤشر التالي أو None).
+        الكلفة تتناسب مع عدد الدلاء (الأيام) وحجم الصفحة، لا مع عدد المستخدمين.
+        """
+        from datetime import timezone as dt_tz
+        today_d = (
+            datetime.fromisoformat(today).date() if today
+            else datetime.now(dt_tz.utc).date()
+        )
+        cutoff = (today_d - timedelta(days=min_days)).isoformat()
+
+        with self._lock:
+            return self._inactive_page(today_d, cutoff, offset, limit)
+
+    def _inactive_page(
+        self, today_d, cutoff: str, offset: int, limit: int,
+    ) -> Tuple[List[Tuple[int, int, Tuple[int, int, int, str, bool]]], int, Optional[int]]:
+        page: List[Tuple[int, int, Tuple[int, int, int, str, bool]]] = []
+        total = 0
+        skip  = offset
+        for key in sorted(self._buckets):
+            if key and key > cutoff:
+                break
+            bucket = self._buckets[key]
+            total += len(bucket)
+            if len(page) >= limit:
+                continue
+            if skip >= len(bucket):
+                skip -= len(bucket)
+                continue
+            try:
+                days = (today_d - datetime.fromisoformat(key).date()).days if key else 999
+            except ValueError:
+                days = 999
+            for uid in bucket[skip:]:
+                if len(page) >= limit:
+                    break
+                page.append((uid, days, self._summary[uid]))
+            skip = 0
+
+        next_cursor = offset + len(page)
+        return page, total, (next_cursor if next_cursor < total else None)
+
+
 class UserDataManager:
     """إدارة بيانات المستخدمين مع دعم كامل للميزات الجديدة"""
 
     def __init__(self, data_dir: Path) -> None:
         self.data_dir = data_dir
+        self.activity_index = UserActivityIndex()
+        self.reminder_scheduler = ReminderScheduler()
+
+    def get_activity_index(self) -> UserActivityIndex:
+        """يبني الفهرس عند أول طلب (قراءة كاملة واحدة) ثم يُعيده"""
+        if not self.activity_index.built:
+            self.activity_index.build(self.get_all_users())
+        return self.activity_index
 
     def _get_path(self, user_id: int) -> Path:
         return self.data_dir / f"user_{user_id}.json"
@@ -519,6 +955,9 @@ class UserDataManager:
                 logger.warning(f"Supabase load failed for {user_id}, falling back to file: {exc}")
 
         # ── احتياطي: ملف محلي ──
+        return self._load_file(user_id)
+
+    def _load_file(self, user_id: int) -> Dict[str, Any]:
         path = self._get_path(user_id)
         if not path.exists():
             return dict(_USER_DEFAULTS)
@@ -547,6 +986,7 @@ class UserDataManager:
                         json.dump(data, f, ensure_ascii=False, indent=2)
                 except Exception:
                     pass
+                self.activity_index.update(user_id, data)
                 return True
             except Exception as exc:
                 logger.warning(f"Supabase save failed for {user_id}, falling back to file: {exc}")
@@ -555,6 +995,7 @@ class UserDataManager:
         try:
             with open(self._get_path(user_id), "w", encoding="utf-8") as f:
                 json.dump(data, f, ensure_ascii=False, indent=2)
+            self.activity_index.update(user_id, data)
             return True
         except Exception as exc:
             logger.error(f"خطأ في حفظ بيانات {user_id}: {exc}")
@@ -565,6 +1006,52 @@ class UserDataManager:
         data.update(fields)
         return self._save(user_id, data)
 
+    def load_many(self, user_ids: List[int], chunk_size: int = 500) -> Dict[int, Dict[str, Any]]:
+        """تحميل عدة مستخدمين باستعلام واحد لكل دفعة بدل _load لكل مستخدم"""
+        result: Dict[int, Dict[str, Any]] = {}
+        if _supabase_client and user_ids:
+            try:
+                for start in range(0, len(user_ids), chunk_size):
+                    chunk = user_ids[start:start + chunk_size]
+                    res = _supabase_client.table("bot_users").select("user_id, data").in_("user_id", chunk).execute()
+                    for row in res.data or []:
+                        data = row.get("data") or {}
+                        for key, default in _USER_DEFAULTS.items():
+                            if key not in data:
+                                data[key] = default
+                        result[int(row["user_id"])] = data
+            except Exception as exc:
+                logger.warning(f"Supabase batch load failed, falling back to files: {exc}")
+        for uid in user_ids:
+            if uid not in result:
+                result[uid] = self._load_file(uid)
+        return result
+
+    def save_many(self, items: Dict[int, Dict[str, Any]], chunk_size: int = 500) -> int:
+        """حفظ عدة مستخدمين بعملية upsert واحدة لكل دفعة — يُرجع عدد المحفوظين"""
+        rows = list(items.items())
+        if _supabase_client and rows:
+            try:
+                for start in range(0, len(rows), chunk_size):
+                    _supabase_client.table("bot_users").upsert(
+                        [{"user_id": uid, "data": data} for uid, data in rows[start:start + chunk_size]],
+                        on_conflict="user_id"
+                    ).execute()
+            except Exception as exc:
+                logger.warning(f"Supabase batch save failed, falling back to files: {exc}")
+                return sum(self._save(uid, data) for uid, data in rows)
+        saved = 0
+        for uid, data in rows:
+            try:
+                with open(self._get_path(uid), "w", encoding="utf-8") as f:
+                    json.dump(data, f, ensure_ascii=False, indent=2)
+                saved += 1
+            except Exception as exc:
+                if not _supabase_client:
+                    logger.error(f"خطأ في حفظ بيانات {uid}: {exc}")
+            self.activity_index.update(uid, data)
+        return len(rows) if _supabase_client else saved
+
     # ── الأحاديث المقروءة ─────────────────────────────────────────
 
     def mark_as_read(self, user_id: int, hadith_id: int) -> bool:
@@ -695,20 +1182,28 @@ class UserDataManager:
 
     # ── التذكير اليومي ────────────────────────────────────────────
 
+    def _update_reminder_fields(self, user_id: int, **fields) -> bool:
+        """تحديث حقول التذكير ومزامنة جدولة التذكيرات فوراً"""
+        data = self._load(user_id)
+        data.update(fields)
+        ok = self._save(user_id, data)
+        self.reminder_scheduler.sync(user_id, self._reminder_settings_of(data))
+        return ok
+
     def enable_reminder(self, user_id: int, time_str: str, timezone: str = DEFAULT_TIMEZONE) -> bool:
-        return self._update_field(user_id, reminder_enabled=True, reminder_time=time_str, reminder_timezone=timezone)
+        return self._update_reminder_fields(user_id, reminder_enabled=True, reminder_time=time_str, reminder_timezone=timezone)
 
     def enable_evening_reminder(self, user_id: int, time_str: str) -> bool:
-        return self._update_field(user_id, reminder_time_evening=time_str)
+        return self._update_reminder_fields(user_id, reminder_time_evening=time_str)
 
     def disable_evening_reminder(self, user_id: int) -> bool:
-        return self._update_field(user_id, reminder_time_evening=None)
+        return self._update_reminder_fields(user_id, reminder_time_evening=None)
 
     def disable_reminder(self, user_id: int) -> bool:
-        return self._update_field(user_id, reminder_enabled=False)
+        return self._update_reminder_fields(user_id, reminder_enabled=False)
 
-    def get_reminder_settings(self, user_id: int) -> Dict[str, Any]:
-        data = self._load(user_id)
+    @staticmethod
+    def _reminder_settings_of(data: Dict[str, Any]) -> Dict[str, Any]:
         return {
             "enabled":         data.get("reminder_enabled", False),
             "time":            data.get("reminder_time", DEFAULT_REMINDER_TIME),
@@ -718,6 +1213,9 @@ class UserDataManager:
             "last_evening":    data.get("last_reminder_evening"),
         }
 
+    def get_reminder_settings(self, user_id: int) -> Dict[str, Any]:
+        return self._reminder_settings_of(self._load(user_id))
+
     def update_last_reminder_sent(self, user_id: int, evening: bool = False) -> bool:
         from datetime import timezone as dt_tz
         now_utc = datetime.now(dt_tz.utc).isoformat()  # دائماً UTC مع timezone
@@ -755,6 +1253,50 @@ class UserDataManager:
                 logger.error(f"خطأ في قراءة {path}: {exc}")
         return users
 
+    def iter_users(self, page_size: int = 500, after_id: Optional[int] = None) -> Iterator[Tuple[int, Dict[str, Any]]]:
+        """
+        تمرير المستخدمين صفحةً صفحة مرتبين بـ user_id — لا يحمل أكثر من page_size في الذاكرة
+        after_id: البدء بعد هذا المعرّف (مؤشر الاستئناف)
+        """
+        # ── من Supabase ──
+        if _supabase_client:
+            start = 0
+            try:
+                while True:
+                    query = _supabase_client.table("bot_users").select("user_id, data")
+                    if after_id is not None:
+                        query = query.gt("user_id", after_id)
+                    res = query.order("user_id").range(start, start + page_size - 1).execute()
+                    rows = res.data or []
+                    for row in rows:
+                        data = row.get("data", {})
+                        for key, default in _USER_DEFAULTS.items():
+                            if key not in data:
+                                data[key] = default
+                        yield row["user_id"], data
+                    if len(rows) < page_size:
+                        return
+                    start += page_size
+            except Exception as exc:
+                if start:
+                    raise
+                logger.warning(f"Supabase iter_users failed, falling back: {exc}")
+
+        # ── احتياطي: ملفات محلية ──
+        uids = []
+        for path in self.data_dir.glob("user_*.json"):
+            try:
+                uids.append(int(path.stem.split("_")[1]))
+            except ValueError:
+                logger.error(f"اسم ملف غير صالح: {path}")
+        uids.sort()
+        start = bisect.bisect_right(uids, after_id) if after_id is not None else 0
+        for uid in uids[start:]:
+            try:
+                yield uid, self._load(uid)
+            except Exception as exc:
+                logger.error(f"خطأ في قراءة بيانات {uid}: {exc}")
+
     def is_banned(self, user_id: int) -> bool:
         return self._load(user_id).get("banned", False)
 
@@ -767,17 +1309,11 @@ class UserDataManager:
     def get_all_users_with_reminders(self) -> List[Tuple[int, Dict[str, Any]]]:
         """يقرأ من Supabase أولاً، ثم الملفات احتياطياً"""
         all_users = self.get_all_users()  # يقرأ من Supabase أو الملفات
-        users = []
-        for uid, data in all_users:
-            if data.get("reminder_enabled"):
-                users.append((uid, {
-                    "time":         data.get("reminder_time", DEFAULT_REMINDER_TIME),
-                    "time_evening": data.get("reminder_time_evening"),
-                    "timezone":     data.get("reminder_timezone", DEFAULT_TIMEZONE),
-                    "last_sent":    data.get("last_reminder_sent"),
-                    "last_evening": data.get("last_reminder_evening"),
-                }))
-        return users
+        return [
+            (uid, self._reminder_settings_of(data))
+            for uid, data in all_users
+            if data.get("reminder_enabled")
+        ]
 
     # ── السلسلة اليومية ───────────────────────────────────────────
 
@@ -870,87 +1406,258 @@ class UserDataManager:
 # 5. أنظمة الحالة
 # ═══════════════════════════════════════════════════════════════════
 
+class SessionStore:
+    """
+    مخزن موحّد لحالة الجلسات المؤقتة لكل مستخدم
+    ─────────────────────────────────────────────
+    - انتهاء الصلاحية بعد خمول (TTL) حسب نوع الجلسة
+    - سقف عام للذاكرة (حجم JSON تقديري) — يُحذف الأقدم استخداماً عند تجاوزه
+    - حفظ اختياري في ملف SQLite محلي (SESSION_DB_PATH) لتبقى بعد إعادة التشغيل؛
+      وقت الاستخدام في get() يُكتب على دفعات (كل TOUCH_FLUSH_EVERY ثانية وعند
+      الإيقاف) فلا تنتهي بعد إعادة التشغيل جلسةٌ كانت نشطة
+    القيم يجب أن تكون قابلة للتحويل إلى JSON؛ بعد تعديل قيمة يجب استدعاء set().
+    """
+
+    TTL: Dict[str, float] = {
+        "quiz":          2 * 3600,
+        "flashcard":     2 * 3600,
+        "note":          30 * 60,
+        "feedback":      30 * 60,
+        "conversation":  6 * 3600,
+        "active_hadith": 6 * 3600,
+        "monetag":       24 * 3600,
+    }
+    SWEEP_EVERY = 256   # تنظيف المنتهية كل N عملية كتابة
+    TOUCH_FLUSH_EVERY = 30.0   # ثوانٍ بين حفظ أوقات الاستخدام المعلّقة
+
+    def __init__(self, max_bytes: int = SESSION_MAX_BYTES, db_path: str = SESSION_DB_PATH) -> None:
+        self.max_bytes = max_bytes
+        # (ns, user_id) → (آخر استخدام, الحجم, القيمة)
+        self._data: "OrderedDict[Tuple[str, int], Tuple[float, int, Any]]" = OrderedDict()
+        self._bytes = 0
+        self._writes = 0
+        self._touched: Dict[Tuple[str, int], float] = {}   # أوقات استخدام لم تُحفظ بعد
+        self._last_flush = time.time()
+        self.evictions = self.expired = 0
+        self._db: Optional[sqlite3.Connection] = None
+        if db_path:
+            try:
+                self._db = sqlite3.connect(db_path, isolation_level=None, check_same_thread=False)
+                self._db.execute("PRAGMA journal_mode=WAL")
+                self._db.execute("PRAGMA synchronous=NORMAL")
+                self._db.execute(
+                    "CREATE TABLE IF NOT EXISTS sessions ("
+                    "ns TEXT NOT NULL, user_id INTEGER NOT NULL, touched REAL NOT NULL, "
+                    "value TEXT NOT NULL, PRIMARY KEY (ns, user_id))"
+                )
+                self._load_persisted()
+            except sqlite3.Error as exc:
+                logger.warning(f"⚠️ تعذّر فتح ملف الجلسات {db_path}، ستبقى في الذاكرة فقط: {exc}")
+                self._db = None
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    @property
+    def total_bytes(self) -> int:
+        return self._bytes
+
+    def _load_persisted(self) -> None:
+        now  = time.time()
+        rows = self._db.execute("SELECT ns, user_id, touched, value FROM sessions ORDER BY touched").fetchall()
+        dead = []
+        for ns, uid, touched, raw in rows:
+            if now - touched > self.TTL.get(ns, 3600):
+                dead.append((ns, uid))
+                continue
+            self._data[(ns, uid)] = (touched, len(raw), json.loads(raw))
+            self._bytes += len(raw)
+        self._db.executemany("DELETE FROM sessions WHERE ns = ? AND user_id = ?", dead)
+        logger.info(f"💾 استُعيدت {len(self._data)} جلسة من {len(rows)}")
+
+    def _persist(self, key: Tuple[str, int], touched: float, raw: Optional[str]) -> None:
+        if not self._db:
+            return
+        try:
+            if raw is None:
+                self._db.execute("DELETE FROM sessions WHERE ns = ? AND user_id = ?", key)
+            else:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO sessions (ns, user_id, touched, value) VALUES (?, ?, ?, ?)",
+                    (key[0], key[1], touched, raw),
+                )
+        except sqlite3.Error as exc:
+            logger.debug(f"Session persist error: {exc}")
+
+    def flush(self) -> int:
+        """حفظ أوقات الاستخدام المعلّقة دفعة واحدة — يُعيد عددها"""
+        pending, self._touched = self._touched, {}
+        self._last_flush = time.time()
+        if not self._db or not pending:
+            return 0
+        try:
+            self._db.executemany(
+                "UPDATE sessions SET touched = ? WHERE ns = ? AND user_id = ?",
+                [(t, ns, uid) for (ns, uid), t in pending.items()],
+            )
+        except sqlite3.Error as exc:
+            logger.debug(f"Session flush error: {exc}")
+        return len(pending)
+
+    def _drop(self, key: Tuple[str, int]) -> Optional[Tuple[float, int, Any]]:
+        self._touched.pop(key, None)
+        entry = self._data.pop(key, None)
+        if entry:
+            self._bytes -= entry[1]
+            self._persist(key, 0.0, None)
+        return entry
+
+    def get(self, ns: str, user_id: int, default: Any = None) -> Any:
+        key   = (ns, user_id)
+        entry = self._data.get(key)
+        if entry is None:
+            return default
+        touched, size, value = entry
+        now = time.time()
+        if now - touched > self.TTL.get(ns, 3600):
+            self._drop(key)
+            self.expired += 1
+            return default
+        self._data[key] = (now, size, value)
+        self._data.move_to_end(key)
+        if self._db:
+            self._touched[key] = now
+            if now - self._last_flush >= self.TOUCH_FLUSH_EVERY:
+                self.flush()
+        return value
+
+    def set(self, ns: str, user_id: int, value: Any) -> None:
+        key = (ns, user_id)
+        raw = json.dumps(value, ensure_ascii=False, separators=(",", ":"))
+        now = time.time()
+        old = self._data.get(key)
+        if old:
+            self._bytes -= old[1]
+        self._data[key] = (now, len(raw), value)
+        self._data.move_to_end(key)
+        self._bytes += len(raw)
+        self._touched.pop(key, None)
+        self._persist(key, now, raw)
+        while self._bytes > self.max_bytes and len(self._data) > 1:
+            oldest = next(iter(self._data))
+            self._drop(oldest)
+            self.evictions += 1
+        self._writes += 1
+        if self._writes % self.SWEEP_EVERY == 0:
+            self.sweep()
+
+    def pop(self, ns: str, user_id: int, default: Any = None) -> Any:
+        value = self.get(ns, user_id, default)
+        self._drop((ns, user_id))
+        return value
+
+    def contains(self, ns: str, user_id: int) -> bool:
+        return self.get(ns, user_id) is not None
+
+    def sweep(self) -> int:
+        now  = time.time()
+        dead = [k for k, (t, _, _) in self._data.items() if now - t > self.TTL.get(k[0], 3600)]
+        for k in dead:
+            self._drop(k)
+        self.expired += len(dead)
+        return len(dead)
+
+    def stats(self) -> Dict[str, Tuple[int, int]]:
+        """ns → (عدد الجلسات, البايتات التقديرية)"""
+        out: Dict[str, Tuple[int, int]] = {ns: (0, 0) for ns in self.TTL}
+        for (ns, _), (_, size, _) in self._data.items():
+            count, total = out.get(ns, (0, 0))
+            out[ns] = (count + 1, total + size)
+        return out
+
+
+_session_store = SessionStore()
+
+
 class ConversationMemory:
     """ذاكرة المحادثات — تحتفظ بسياق الحديث الأخير لتحسين AI"""
 
-    def __init__(self, max_history: int = MAX_CONVERSATION_HISTORY) -> None:
-        self._sessions: Dict[int, deque] = {}
-        self._active_hadith: Dict[int, int] = {}   # user_id → hadith_id المناقَش
+    def __init__(self, max_history: int = MAX_CONVERSATION_HISTORY, store: SessionStore = _session_store) -> None:
+        self.store       = store
         self.max_history = max_history
 
-    def get(self, user_id: int) -> deque:
-        if user_id not in self._sessions:
-            self._sessions[user_id] = deque(maxlen=self.max_history)
-        return self._sessions[user_id]
+    def get(self, user_id: int) -> List[Dict[str, str]]:
+        # التخزين المضغوط: [role, content] بدل dict لكل رسالة
+        return [{"role": role, "content": content} for role, content in self.store.get("conversation", user_id, [])]
 
     def add_message(self, user_id: int, role: str, content: str) -> None:
-        self.get(user_id).append({"role": role, "content": content})
+        history = self.store.get("conversation", user_id, [])
+        history.append([role, content])
+        self.store.set("conversation", user_id, history[-self.max_history:])
 
     def set_active_hadith(self, user_id: int, hadith_id: int) -> None:
-        self._active_hadith[user_id] = hadith_id
+        self.store.set("active_hadith", user_id, hadith_id)
 
     def get_active_hadith(self, user_id: int) -> Optional[int]:
-        return self._active_hadith.get(user_id)
+        return self.store.get("active_hadith", user_id)
 
     def clear(self, user_id: int) -> None:
-        if user_id in self._sessions:
-            self._sessions[user_id].clear()
-        self._active_hadith.pop(user_id, None)
+        self.store.pop("conversation", user_id)
+        self.store.pop("active_hadith", user_id)
 
 
 class FeedbackSystem:
-    _waiting: Dict[int, bool] = {}
-
     @classmethod
     def start(cls, user_id: int) -> None:
-        cls._waiting[user_id] = True
+        _session_store.set("feedback", user_id, True)
 
     @classmethod
     def stop(cls, user_id: int) -> None:
-        cls._waiting.pop(user_id, None)
+        _session_store.pop("feedback", user_id)
 
     @classmethod
     def is_active(cls, user_id: int) -> bool:
-        return cls._waiting.get(user_id, False)
+        return _session_store.get("feedback", user_id, False)
 
 
 class NoteSystem:
-    _waiting: Dict[int, int] = {}
-
     @classmethod
     def start(cls, user_id: int, hadith_id: int) -> None:
-        cls._waiting[user_id] = hadith_id
+        _session_store.set("note", user_id, hadith_id)
 
     @classmethod
     def stop(cls, user_id: int) -> None:
-        cls._waiting.pop(user_id, None)
+        _session_store.pop("note", user_id)
 
     @classmethod
     def is_active(cls, user_id: int) -> bool:
-        return user_id in cls._waiting
+        return _session_store.contains("note", user_id)
 
     @classmethod
     def get_hadith_id(cls, user_id: int) -> Optional[int]:
-        return cls._waiting.get(user_id)
+        return _session_store.get("note", user_id)
 
 
 class FlashcardSystem:
     """حالة جلسة بطاقات الحفظ"""
-    _sessions: Dict[int, Dict[str, Any]] = {}
 
     @classmethod
     def start(cls, user_id: int, hadith_ids: List[int]) -> None:
         random.shuffle(hadith_ids)
-        cls._sessions[user_id] = {
+        _session_store.set("flashcard", user_id, {
             "queue":   hadith_ids,
             "index":   0,
             "correct": 0,
             "total":   len(hadith_ids),
-        }
+        })
+
+    @classmethod
+    def get_session(cls, user_id: int) -> Dict[str, Any]:
+        return _session_store.get("flashcard", user_id, {})
 
     @classmethod
     def get_current(cls, user_id: int) -> Optional[int]:
-        s = cls._sessions.get(user_id)
+        s = _session_store.get("flashcard", user_id)
         if not s or s["index"] >= len(s["queue"]):
             return None
         return s["queue"][s["index"]]
@@ -958,25 +1665,26 @@ class FlashcardSystem:
     @classmethod
     def advance(cls, user_id: int, knew_it: bool) -> bool:
         """يُقدّم للبطاقة التالية — يُعيد True إذا انتهت الجلسة"""
-        s = cls._sessions.get(user_id)
+        s = _session_store.get("flashcard", user_id)
         if not s:
             return True
         if knew_it:
             s["correct"] += 1
         s["index"] += 1
+        _session_store.set("flashcard", user_id, s)
         return s["index"] >= len(s["queue"])
 
     @classmethod
     def get_result(cls, user_id: int) -> Optional[Dict[str, Any]]:
-        return cls._sessions.pop(user_id, None)
+        return _session_store.pop("flashcard", user_id)
 
     @classmethod
     def is_active(cls, user_id: int) -> bool:
-        return user_id in cls._sessions
+        return _session_store.contains("flashcard", user_id)
 
     @classmethod
     def cancel(cls, user_id: int) -> None:
-        cls._sessions.pop(user_id, None)
+        _session_store.pop("flashcard", user_id)
 
 
 # ═══════════════════════════════════════════════════════════════════
@@ -1086,9 +1794,9 @@ class MonetagSystem:
         """هل حان وقت إعلان التفاعل الدوري؟"""
         if MONETAG_INTERVAL <= 0:
             return False
-        last = _monetag_last_shown.get(user_id, 0)
+        last = _session_store.get("monetag", user_id, 0)
         if current_interactions - last >= MONETAG_INTERVAL:
-            _monetag_last_shown[user_id] = current_interactions
+            _session_store.set("monetag", user_id, current_interactions)
             return True
         return False
 
@@ -1142,6 +1850,384 @@ class ReminderSystem:
         )
 
 
+class ReminderScheduler:
+    """
+    جدولة التذكيرات بكومة صغرى (min-heap) مرتبة بوقت الإطلاق التالي (UTC)
+    ─────────────────────────────────────────────────────────────────────
+    - مُدخل واحد لكل (مستخدم، نوع) حيث النوع "morning" أو "evening"
+    - تُبنى عند الإقلاع وتُحدَّث عند تغيير إعدادات التذكير (sync)
+    - pop_due يُعيد المستحقين فقط ويُعيد جدولتهم لليوم التالي مباشرة،
+      فلا يتكرر الإرسال داخل نافذة ±WINDOW نفسها
+    - الإرسال الفاشل مؤقتاً يُعاد عبر retry بعد RETRY_DELAY ما دامت النافذة مفتوحة
+    الحذف كسول: المُدخلات القديمة في الكومة تُتجاهل عند السحب.
+    """
+
+    WINDOW = timedelta(minutes=5)
+    RETRY_DELAY = timedelta(minutes=1)
+
+    def __init__(self) -> None:
+        self._heap: List[Tuple[float, int, str]] = []
+        # (uid, kind) → (fire_ts, time_str, timezone)
+        self._entries: Dict[Tuple[int, str], Tuple[float, str, str]] = {}
+        # (uid, kind) → موعد التذكير الأصلي لمُدخلات إعادة المحاولة
+        self._retries: Dict[Tuple[int, str], float] = {}
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    @classmethod
+    def next_fire(
+        cls,
+        time_str: str,
+        timezone_str: str,
+        now: datetime,
+        last_sent: Optional[str] = None,
+    ) -> Optional[datetime]:
+        """أقرب وقت إطلاق (UTC) لم تمضِ نافذته ولم يُرسَل في يومه المحلي"""
+        rem_time = ReminderSystem.parse_time(time_str or "")
+        if not rem_time:
+            return None
+        try:
+            tz = ZoneInfo(timezone_str)
+        except Exception:
+            tz, timezone_str = ZoneInfo(DEFAULT_TIMEZONE), DEFAULT_TIMEZONE
+        today     = now.astimezone(tz).date()
+        sent_today = not ReminderSystem.should_send(last_sent, timezone_str)
+        for offset in range(3):
+            if offset == 0 and sent_today:
+                continue
+            fire = datetime.combine(today + timedelta(days=offset), rem_time, tzinfo=tz)
+            fire = fire.astimezone(now.tzinfo)
+            if fire + cls.WINDOW >= now:
+                return fire
+        return None
+
+    def _push(self, uid: int, kind: str, time_str: str, tz_str: str, fire: Optional[datetime]) -> None:
+        if fire is None:
+            self._entries.pop((uid, kind), None)
+            return
+        ts = fire.timestamp()
+        self._entries[(uid, kind)] = (ts, time_str, tz_str)
+        heapq.heappush(self._heap, (ts, uid, kind))
+        # ضغط الكومة إذا تراكمت المُدخلات الملغاة
+        if len(self._heap) > 2 * len(self._entries) + 64:
+            self._heap = [(ts, u, k) for (u, k), (ts, _, _) in self._entries.items()]
+            heapq.heapify(self._heap)
+
+    def sync(self, user_id: int, settings: Dict[str, Any], now: Optional[datetime] = None) -> None:
+        """مزامنة مُدخلات المستخدم مع إعداداته (صيغة get_reminder_settings)"""
+        from datetime import timezone as dt_tz
+        now = now or datetime.now(dt_tz.utc)
+        if not settings.get("enabled", True):
+            self.unschedule(user_id)
+            return
+        tz_str = settings.get("timezone", DEFAULT_TIMEZONE)
+        self._retries.pop((user_id, "morning"), None)
+        self._retries.pop((user_id, "evening"), None)
+        for kind, time_key, last_key in (
+            ("morning", "time",         "last_sent"),
+            ("evening", "time_evening", "last_evening"),
+        ):
+            time_str = settings.get(time_key)
+            fire = self.next_fire(time_str, tz_str, now, settings.get(last_key)) if time_str else None
+            self._push(user_id, kind, time_str, tz_str, fire)
+
+    def unschedule(self, user_id: int) -> None:
+        for kind in ("morning", "evening"):
+            self._entries.pop((user_id, kind), None)
+            self._retries.pop((user_id, kind), None)
+
+    def rebuild(self, users: List[Tuple[int, Dict[str, Any]]]) -> None:
+        self._heap.clear()
+        self._entries.clear()
+        self._retries.clear()
+        for uid, settings in users:
+            self.sync(uid, settings)
+        logger.info(f"⏰ جدولة التذكير: {len(self._entries)} تذكير لـ {len(users)} مستخدم")
+
+    def seconds_until_next(self, now: datetime, max_wait: float = 30.0) -> float:
+        while self._heap:
+            ts, uid, kind = self._heap[0]
+            entry = self._entries.get((uid, kind))
+            if entry and entry[0] == ts:
+                return min(max(ts - now.timestamp(), 0.0), max_wait)
+            heapq.heappop(self._heap)  # مُدخل ملغى
+        return max_wait
+
+    def pop_due(self, now: datetime) -> List[Tuple[int, str, float]]:
+        """المستحقون الآن [(uid, kind, fire_ts)] — مع إعادة جدولتهم لليوم التالي"""
+        due: List[Tuple[int, str, float]] = []
+        now_ts = now.timestamp()
+        while self._heap and self._heap[0][0] <= now_ts:
+            ts, uid, kind = heapq.heappop(self._heap)
+            entry = self._entries.get((uid, kind))
+            if not entry or entry[0] != ts:
+                continue
+            _, time_str, tz_str = entry
+            fire_ts = self._retries.pop((uid, kind), ts)
+            if fire_ts + self.WINDOW.total_seconds() >= now_ts:
+                due.append((uid, kind, fire_ts))
+            # last_sent = الآن → الإطلاق التالي في اليوم المحلي القادم
+            self._push(uid, kind, time_str, tz_str,
+                       self.next_fire(time_str, tz_str, now, now.isoformat()))
+        return due
+
+    def retry(self, uid: int, kind: str, fire_ts: float, now: datetime) -> bool:
+        """إعادة تذكير فشل إرساله بعد RETRY_DELAY إن بقي داخل نافذة موعده الأصلي"""
+        entry = self._entries.get((uid, kind))
+        retry_at = now + self.RETRY_DELAY
+        if not entry or retry_at.timestamp() > fire_ts + self.WINDOW.total_seconds():
+            return False
+        _, time_str, tz_str = entry
+        self._push(uid, kind, time_str, tz_str, retry_at)
+        self._retries[(uid, kind)] = fire_ts
+        return True
+
+
+class TelegramRateLimiter:
+    """
+    محدِّد معدل الإرسال إلى Telegram (مشترك بين التذكيرات والبث)
+    ─────────────────────────────────────────────────────────────
+    - دلو رموز عام: ~30 رسالة/ثانية مع دفعة أولية بنفس الحجم
+    - فاصل أدنى بين رسالتين لنفس المحادثة (ثانية واحدة)
+    - عند 429 يتوقف الإرسال كله حتى انقضاء retry_after
+    """
+
+    def __init__(self, rate: float = 30.0, burst: int = 30, per_chat_interval: float = 1.0) -> None:
+        self.rate              = rate
+        self.burst             = burst
+        self.per_chat_interval = per_chat_interval
+        self._tokens       = float(burst)
+        self._updated      = time.monotonic()
+        self._paused_until = 0.0
+        self._chat_next: Dict[int, float] = {}
+        self._lock = asyncio.Lock()
+        self.throttled = 0   # عدد استجابات 429
+
+    def pause(self, seconds: float) -> None:
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+
+    async def acquire(self, chat_id: int) -> None:
+        now     = time.monotonic()
+        chat_at = max(self._chat_next.get(chat_id, 0.0), now)
+        self._chat_next[chat_id] = chat_at + self.per_chat_interval
+        if len(self._chat_next) > 10_000:
+            self._chat_next = {c: t for c, t in self._chat_next.items() if t > now}
+        if chat_at > now:
+            await asyncio.sleep(chat_at - now)
+
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self._tokens  = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                wait = self._paused_until - now
+                if wait <= 0 and self._tokens < 1:
+                    wait = (1 - self._tokens) / self.rate
+                if wait <= 0:
+                    break
+                await asyncio.sleep(wait)
+            self._tokens -= 1
+
+    async def send(self, bot, chat_id: int, text: str, max_retries: int = 3, **kwargs) -> str:
+        """إرسال مع احترام الحدود — يُرجع sent أو blocked أو failed"""
+        for _ in range(max_retries + 1):
+            await self.acquire(chat_id)
+            try:
+                await bot.send_message(chat_id=chat_id, text=text, **kwargs)
+                return "sent"
+            except RetryAfter as exc:
+                delay = exc.retry_after
+                delay = delay.total_seconds() if isinstance(delay, timedelta) else float(delay)
+                self.throttled += 1
+                self.pause(delay + 0.5)
+                logger.warning(f"⏳ Telegram 429 — توقف {delay:.0f}ث")
+            except Forbidden:
+                return "blocked"
+            except TelegramError as exc:
+                logger.warning(f"فشل الإرسال إلى {chat_id}: {exc}")
+                return "failed"
+        return "failed"
+
+
+_telegram_limiter = TelegramRateLimiter()
+
+
+class BroadcastManager:
+    """
+    مهام البث الجماعي (/admin_broadcast و /admin_announce)
+    ─────────────────────────────────────────────────────
+    - مهمة واحدة في كل مرة، محفوظة في ملف JSON مع مؤشر (آخر user_id عولج)
+    - الإرسال عبر TelegramRateLimiter (~30 رسالة/ث + احترام retry_after)
+    - يُحدَّث المؤشر بعد كل دفعة، ومعه من أُرسل إليهم داخل الدفعة الجارية
+      (batch_done) كل CHECKPOINT_EVERY ثانية، فالاستئناف بعد توقف مفاجئ
+      لا يعيد الإرسال إلا لما أُرسل في آخر ثانية على الأكثر
+    - تحديث رسالة الحالة لدى المشرف كل PROGRESS_EVERY ثانية
+    """
+
+    BATCH          = 30     # رسائل تُرسل بالتوازي قبل حفظ المؤشر
+    PAGE           = 300    # مستخدمون يُقرؤون في كل صفحة
+    PROGRESS_EVERY = 5.0    # ثوانٍ بين تحديثات رسالة الحالة
+    CHECKPOINT_EVERY = 1.0  # ثوانٍ بين حفظ batch_done أثناء الدفعة
+
+    def __init__(self, user_data_mgr, path: Path, limiter: TelegramRateLimiter = _telegram_limiter) -> None:
+        self.user_data = user_data_mgr
+        self.path      = path
+        self.limiter   = limiter
+        self._task: Optional[asyncio.Task] = None
+        self._last_checkpoint = 0.0
+
+    # ── الحفظ ──
+
+    def load_job(self) -> Optional[Dict[str, Any]]:
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+        except Exception as exc:
+            logger.error(f"خطأ في قراءة مهمة البث: {exc}")
+            return None
+
+    def _persist(self, job: Dict[str, Any]) -> None:
+        job["updated_at"] = datetime.now().isoformat()
+        tmp = self.path.with_suffix(".tmp")
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(job, f, ensure_ascii=False)
+        os.replace(tmp, self.path)
+
+    def _checkpoint(self, job: Dict[str, Any], done: set, force: bool = False) -> None:
+        """حفظ المؤشر ومن أُرسل إليهم من الدفعة الجارية (بحد أقصى مرة كل CHECKPOINT_EVERY)"""
+        now = time.monotonic()
+        if not force and now - self._last_checkpoint < self.CHECKPOINT_EVERY:
+            return
+        self._last_checkpoint = now
+        job["batch_done"] = sorted(done)
+        self._persist(job)
+
+    def discard(self) -> None:
+        self.path.unlink(missing_ok=True)
+
+    # ── المستلمون ──
+
+    @staticmethod
+    def is_recipient(data: Dict[str, Any]) -> bool:
+        return not data.get("banned")
+
+    def count_recipients(self) -> int:
+        """عدد المستلمين بنفس مرشِّح _run من فهرس النشاط — ليصل التقدم إلى 100%"""
+        return self.user_data.get_activity_index().recipients()
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    def pending_job(self) -> Optional[Dict[str, Any]]:
+        """مهمة متوقفة لم تكتمل (ليست قيد التشغيل الآن)"""
+        job = self.load_job()
+        if job and job.get("status") in ("running", "failed") and not self.running:
+            return job
+        return None
+
+    # ── التشغيل ──
+
+    def start(self, bot, text: str, kind: str, chat_id: int, status_message_id: int, total: int) -> Dict[str, Any]:
+        job = {
+            "id":                datetime.now().strftime("%Y%m%d%H%M%S"),
+            "kind":              kind,
+            "text":              text,
+            "cursor":            None,
+            "sent": 0, "blocked": 0, "failed": 0,
+            "total":             total,
+            "status":            "running",
+            "chat_id":           chat_id,
+            "status_message_id": status_message_id,
+            "started_at":        datetime.now().isoformat(),
+        }
+        self._persist(job)
+        self._task = asyncio.create_task(self._run(bot, job))
+        return job
+
+    def resume(self, bot, status_message_id: Optional[int] = None) -> Optional[Dict[str, Any]]:
+        job = self.pending_job()
+        if not job:
+            return None
+        job["status"] = "running"
+        if status_message_id:
+            job["status_message_id"] = status_message_id
+        self._task = asyncio.create_task(self._run(bot, job))
+        return job
+
+    @staticmethod
+    def format_progress(job: Dict[str, Any]) -> str:
+        done  = job["sent"] + job["blocked"] + job["failed"]
+        title = {
+            "running":  "📤 *جاري الإرسال...*",
+            "done":     "✅ *اكتمل الإرسال*",
+            "failed":   "⚠️ *توقف البث بسبب خطأ* — استخدم `/admin_broadcast_resume`",
+        }.get(job["status"], "📤 *البث*")
+        return (
+            f"{title}\n\n"
+            f"📨 أُرسلت: {job['sent']}\n"
+            f"🚫 حجبوا البوت: {job['blocked']}\n"
+            f"❌ فشل: {job['failed']}\n"
+            f"📊 التقدم: {done}/{job['total']}"
+        )
+
+    async def _edit_status(self, bot, job: Dict[str, Any]) -> None:
+        try:
+            await bot.edit_message_text(
+                chat_id=job["chat_id"],
+                message_id=job["status_message_id"],
+                text=self.format_progress(job),
+                parse_mode=ParseMode.MARKDOWN,
+            )
+        except TelegramError as exc:
+            logger.debug(f"تعذّر تحديث رسالة حالة البث: {exc}")
+
+    async def _send_one(self, bot, job: Dict[str, Any], uid: int, done: set) -> None:
+        status = await self.limiter.send(bot, uid, job["text"], parse_mode=ParseMode.MARKDOWN)
+        job[status] += 1
+        done.add(uid)
+        self._checkpoint(job, done)
+
+    async def _run(self, bot, job: Dict[str, Any]) -> None:
+        logger.info(f"📢 بث {job['id']} يبدأ بعد المؤشر {job['cursor']}")
+        last_edit = 0.0
+        # من أُرسل إليهم من الدفعة التي قُطعت عند الإيقاف — لا يُعاد الإرسال لهم
+        done: set = set(job.get("batch_done", []))
+        # مُكرِّر واحد للبث كله: يُسرد المجلد/يُستعلم مرة ثم يُقرأ صفحةً صفحة
+        users = self.user_data.iter_users(page_size=self.PAGE, after_id=job["cursor"])
+        try:
+            while True:
+                page = await asyncio.to_thread(lambda: list(itertools.islice(users, self.PAGE)))
+                if not page:
+                    break
+                for start in range(0, len(page), self.BATCH):
+                    batch = page[start:start + self.BATCH]
+                    await asyncio.gather(*(
+                        self._send_one(bot, job, uid, done)
+                        for uid, data in batch if self.is_recipient(data) and uid not in done
+                    ))
+                    done.clear()
+                    job["cursor"] = batch[-1][0]
+                    self._checkpoint(job, done, force=True)
+                    if time.monotonic() - last_edit >= self.PROGRESS_EVERY:
+                        last_edit = time.monotonic()
+                        await self._edit_status(bot, job)
+            job["status"] = "done"
+        except asyncio.CancelledError:
+            # تبقى المهمة "running" في الملف ليُستأنف بها لاحقاً
+            self._checkpoint(job, done, force=True)
+            raise
+        except Exception as exc:
+            logger.error(f"خطأ في البث {job['id']}: {exc}")
+            job["status"] = "failed"
+        self._checkpoint(job, done, force=True)
+        await self._edit_status(bot, job)
+        logger.info(f"📢 بث {job['id']}: {job['status']} | {job['sent']} أُرسل | {job['blocked']} محظور | {job['failed']} فشل")
+
+
 class SmartQuestionSystem:
     _KEYWORD_QUESTIONS: Dict[str, str] = {
         "نية":   "ما أهمية النية في الأعمال؟",
@@ -1201,6 +2287,25 @@ class MessageFormatter:
             text = text.replace(ch, '\\' + ch)
         return text
 
+    @classmethod
+    def prerender(cls, hadiths: List[Dict[str, Any]]) -> None:
+        """
+        تجهيز كل النصوص الثابتة لكل حديث مرة واحدة عند الإقلاع (عرض، إنجليزي،
+        راوي، مشاركة، فهرس) مع حالات الأزرار الأربع (مفضلة × ملاحظة) — عند الطلب
+        يُختار فقط ما يخص المستخدم
+        """
+        for hadith in hadiths:
+            cls.build_hadith_display(hadith)
+            for is_favorite, has_note in itertools.product((False, True), repeat=2):
+                cls.build_hadith_keyboard(hadith["id"], is_favorite, has_note)
+            cls.build_share_text(hadith)
+            if hadith.get("english_text"):
+                cls.build_english_display(hadith)
+            if hadith.get("narrator_full"):
+                cls.build_narrator_card(hadith["narrator_full"])
+        cls.build_hadith_list(hadiths)
+        logger.info(f"🧾 تم تجهيز نصوص {len(hadiths)} حديث مسبقاً")
+
     @classmethod
     def format_response(cls, text: str) -> str:
         match = cls._SUGGESTION_RE.search(text)
@@ -1218,13 +2323,27 @@ class MessageFormatter:
         )
 
     @staticmethod
-    def build_hadith_display(
-        hadith: Dict[str, Any],
-        include_actions: bool = False,
-        is_favorite: bool = False,
-        has_note: bool = False,
-    ) -> Tuple[str, Optional[InlineKeyboardMarkup]]:
-        """بناء عرض الحديث — يستخدم الفصل بين مقدمة الراوي ونص الحديث"""
+    def split_message(text: str, limit: int = 4096) -> List[str]:
+        """تقسيم نص طويل لأجزاء ≤ limit عند حدود الفقرات، ثم الأسطر، ثم المسافات"""
+        parts: List[str] = []
+        while len(text) > limit:
+            window = text[:limit]
+            cut = window.rfind("\n\n")
+            if cut < limit // 2:
+                cut = window.rfind("\n")
+            if cut < limit // 2:
+                cut = window.rfind(" ")
+            if cut <= 0:
+                cut = limit
+            parts.append(text[:cut].rstrip())
+            text = text[cut:].lstrip()
+        if text or not parts:
+            parts.append(text)
+        return parts
+
+    @staticmethod
+    def _render_hadith_body(hadith: Dict[str, Any]) -> str:
+        """نص عرض الحديث الثابت — يُخزَّن في كاش display"""
         hid = hadith["id"]
 
         # ── شارة الحديث القدسي ──
@@ -1273,44 +2392,81 @@ class MessageFormatter:
             topics_str = " · ".join(MessageFormatter.esc(str(t)) for t in hadith["topics_arabic"][:5])
             lines.append(f"\n🏷️ *المواضيع:* {topics_str}")
 
-        text = "\n".join(lines)
+        return "\n".join(lines)
+
+    @staticmethod
+    def build_hadith_display(
+        hadith: Dict[str, Any],
+        include_actions: bool = False,
+        is_favorite: bool = False,
+        has_note: bool = False,
+    ) -> Tuple[str, Optional[InlineKeyboardMarkup]]:
+        """بناء عرض الحديث — يستخدم الفصل بين مقدمة الراوي ونص الحديث"""
+        hid = hadith["id"]
+        text = cache_get("display", hid)
+        if text is None:
+            text = MessageFormatter._render_hadith_body(hadith)
+            cache_set("display", hid, text)
         keyboard = None
 
         if include_actions:
-            fav_label  = f"{'⭐' if is_favorite else '☆'} مفضلة"
-            note_label = f"📝 {'تعديل' if has_note else 'إضافة'} ملاحظة"
-            buttons = [
-                [
-                    InlineKeyboardButton(fav_label,  callback_data=f"fav_{hid}"),
-                    InlineKeyboardButton(note_label, callback_data=f"note_{hid}"),
-                ],
-                [
-                    InlineKeyboardButton("👤 بطاقة الراوي",  callback_data=f"narrator_{hid}"),
-                    InlineKeyboardButton("🔗 أحاديث مرتبطة", callback_data=f"related_{hid}"),
-                ],
-                [
-                    InlineKeyboardButton("💬 شرح مبسط",      callback_data=f"simple_{hid}"),
-                    InlineKeyboardButton("📖 شروحات متعددة", callback_data=f"compare_{hid}"),
-                ],
-                [
-                    InlineKeyboardButton("🌍 الترجمة",        callback_data=f"english_{hid}"),
-                    InlineKeyboardButton("📤 مشاركة",         callback_data=f"share_{hid}"),
-                ],
-                [
-                    InlineKeyboardButton("🃏 بطاقة حفظ",      callback_data=f"flashcard_{hid}"),
-                    InlineKeyboardButton("🤔 أعرف؟",           callback_data=f"selftest_{hid}"),
-                ],
-                [
-                    InlineKeyboardButton("💬 تواصل معنا",     callback_data="feedback_start"),
-                ],
-            ]
-            keyboard = InlineKeyboardMarkup(buttons)
+            keyboard = MessageFormatter.build_hadith_keyboard(hid, is_favorite, has_note)
 
         return text, keyboard
 
+    @staticmethod
+    def build_hadith_keyboard(hid: int, is_favorite: bool = False, has_note: bool = False) -> InlineKeyboardMarkup:
+        """أزرار الحديث — الجزء الوحيد الذي يختلف من مستخدم لآخر"""
+        cache_key = (hid, is_favorite, has_note)
+        keyboard = cache_get("keyboard", cache_key)
+        if keyboard is None:
+            keyboard = MessageFormatter._render_hadith_keyboard(hid, is_favorite, has_note)
+            cache_set("keyboard", cache_key, keyboard)
+        return keyboard
+
+    @staticmethod
+    def _render_hadith_keyboard(hid: int, is_favorite: bool, has_note: bool) -> InlineKeyboardMarkup:
+        fav_label  = f"{'⭐' if is_favorite else '☆'} مفضلة"
+        note_label = f"📝 {'تعديل' if has_note else 'إضافة'} ملاحظة"
+        buttons = [
+            [
+                InlineKeyboardButton(fav_label,  callback_data=f"fav_{hid}"),
+                InlineKeyboardButton(note_label, callback_data=f"note_{hid}"),
+            ],
+            [
+                InlineKeyboardButton("👤 بطاقة الراوي",  callback_data=f"narrator_{hid}"),
+                InlineKeyboardButton("🔗 أحاديث مرتبطة", callback_data=f"related_{hid}"),
+            ],
+            [
+                InlineKeyboardButton("💬 شرح مبسط",      callback_data=f"simple_{hid}"),
+                InlineKeyboardButton("📖 شروحات متعددة", callback_data=f"compare_{hid}"),
+            ],
+            [
+                InlineKeyboardButton("🌍 الترجمة",        callback_data=f"english_{hid}"),
+                InlineKeyboardButton("📤 مشاركة",         callback_data=f"share_{hid}"),
+            ],
+            [
+                InlineKeyboardButton("🃏 بطاقة حفظ",      callback_data=f"flashcard_{hid}"),
+                InlineKeyboardButton("🤔 أعرف؟",           callback_data=f"selftest_{hid}"),
+            ],
+            [
+                InlineKeyboardButton("💬 تواصل معنا",     callback_data="feedback_start"),
+            ],
+        ]
+        return InlineKeyboardMarkup(buttons)
+
     @staticmethod
     def build_narrator_card(narrator: Dict[str, Any]) -> str:
         """بناء بطاقة الراوي التفاعلية"""
+        cache_key = narrator.get("arabic", "")
+        card = cache_get("narrator", cache_key)
+        if card is None:
+            card = MessageFormatter._render_narrator_card(narrator)
+            cache_set("narrator", cache_key, card)
+        return card
+
+    @staticmethod
+    def _render_narrator_card(narrator: Dict[str, Any]) -> str:
         name    = narrator.get("arabic", "")
         kunya   = narrator.get("kunya_arabic", "")
         title   = narrator.get("title_arabic", "")
@@ -1340,7 +2496,9 @@ class MessageFormatter:
             lines.append(f"📅 *الوفاة:* {' / '.join(death_parts)}")
 
         if count:
-            lines.append(f"📜 *عدد مروياته:* {count:,} حديث")
+            # رقم أو نص مركّب مثل «281 (أبو ذر) + 157 (معاذ)»
+            count_str = f"{count:,}" if isinstance(count, int) else str(count)
+            lines.append(f"📜 *عدد مروياته:* {count_str} حديث")
 
         badges_parts = []
         if companion:
@@ -1358,6 +2516,14 @@ class MessageFormatter:
     @staticmethod
     def build_english_display(hadith: Dict[str, Any]) -> str:
         """بناء العرض الإنجليزي للحديث"""
+        text = cache_get("english", hadith["id"])
+        if text is None:
+            text = MessageFormatter._render_english_display(hadith)
+            cache_set("english", hadith["id"], text)
+        return text
+
+    @staticmethod
+    def _render_english_display(hadith: Dict[str, Any]) -> str:
         lines = [
             f"🌍 *English — Hadith #{hadith['id']}*",
             f"*{MessageFormatter.esc(hadith['title'])}*",
@@ -1376,6 +2542,14 @@ class MessageFormatter:
     @staticmethod
     def build_share_text(hadith: Dict[str, Any]) -> str:
         """بناء نص الحديث الجاهز للمشاركة — بدون Markdown لتجنب أخطاء التنسيق"""
+        text = cache_get("share", hadith["id"])
+        if text is None:
+            text = MessageFormatter._render_share_text(hadith)
+            cache_set("share", hadith["id"], text)
+        return text
+
+    @staticmethod
+    def _render_share_text(hadith: Dict[str, Any]) -> str:
         body = hadith.get("hadith_text_only") or hadith.get("text", "")
         narrator = hadith.get("narrator", "")
         # إذا كان narrator dict، خذ النص العربي
@@ -1398,11 +2572,17 @@ class MessageFormatter:
 
     @staticmethod
     def build_hadith_list(hadiths: List[Dict[str, Any]]) -> str:
+        cache_key = tuple(h["id"] for h in hadiths)
+        text = cache_get("list", cache_key)
+        if text is not None:
+            return text
         lines = ["📚 *فهرس الأربعين النووية:*", ""]
         for h in hadiths:
             badge = " ✨" if h.get("hadith_type") == "qudsi" else ""
             lines.append(f"الحديث {h['id']}: {h['title']}{badge}")
-        return "\n".join(lines)
+        text = "\n".join(lines)
+        cache_set("list", cache_key, text)
+        return text
 
     @staticmethod
     def build_search_results(results: List[Dict[str, Any]], keyword: str) -> str:
@@ -1560,68 +2740,74 @@ class MessageFormatter:
 # ═══════════════════════════════════════════════════════════════════
 
 class QuizSystem:
-    active_quizzes: Dict[int, Dict[str, Any]] = {}
+    """
+    الاختبارات — الجلسة المخزَّنة مضغوطة: بذرة التوليد + التقدم فقط
+    الأسئلة تُعاد توليدها حتمياً من البذرة (مع كاش "quiz")
+    """
+    hadith_db: Optional[HadithDatabase] = None   # يُضبط عند الإقلاع
     _TYPE_EMOJI = {"narrator": "👤", "title": "📖", "completion": "✍️", "source": "📚"}
 
     @classmethod
-    def generate_quiz(cls, hadith_db: HadithDatabase, question_count: int = 5) -> List[Dict[str, Any]]:
+    def generate_quiz(cls, hadith_db: HadithDatabase, question_count: int = 5, seed: Optional[int] = None) -> List[Dict[str, Any]]:
+        rng           = random.Random(seed)
         all_hadiths   = hadith_db.get_all()
         question_count = min(question_count, len(all_hadiths))
-        selected      = random.sample(all_hadiths, question_count)
+        selected      = rng.sample(all_hadiths, question_count)
         questions: List[Dict[str, Any]] = []
         types = ["narrator", "title", "completion", "source"]
         for hadith in selected:
-            q_type   = random.choice(types)
-            question = cls._make_question(q_type, hadith, all_hadiths)
+            q_type   = rng.choice(types)
+            question = cls._make_question(q_type, hadith, all_hadiths, rng)
             if not cls._is_valid(question):
-                question = cls._make_narrator_q(hadith, all_hadiths)
+                question = cls._make_narrator_q(hadith, all_hadiths, rng)
             if cls._is_valid(question):
                 questions.append(question)
         return questions
 
     @classmethod
-    def _make_question(cls, q_type: str, hadith: Dict[str, Any], all_hadiths: List[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+    def _make_question(cls, q_type: str, hadith: Dict[str, Any], all_hadiths: List[Dict[str, Any]], rng: Any = random) -> Optional[Dict[str, Any]]:
         if q_type == "narrator":
-            return cls._make_narrator_q(hadith, all_hadiths)
+            return cls._make_narrator_q(hadith, all_hadiths, rng)
         elif q_type == "title":
-            return cls._make_title_q(hadith, all_hadiths)
+            return cls._make_title_q(hadith, all_hadiths, rng)
         elif q_type == "completion":
-            return cls._make_completion_q(hadith, all_hadiths)
+            return cls._make_completion_q(hadith, all_hadiths, rng)
         else:
-            return cls._make_source_q(hadith, all_hadiths)
+            return cls._make_source_q(hadith, all_hadiths, rng)
 
     @staticmethod
-    def _build_options(correct: str, pool: List[str], count: int = 3) -> List[str]:
-        others = [x for x in set(pool) if x != correct]
-        random.shuffle(others)
+    def _build_options(correct: str, pool: List[str], count: int = 3, rng: Any = random) -> List[str]:
+        # sorted: ترتيب ثابت بين العمليات حتى يُعاد توليد نفس الخيارات من البذرة
+        others = sorted({x for x in pool if x != correct})
+        rng.shuffle(others)
         opts = [correct] + others[:count]
-        random.shuffle(opts)
+        rng.shuffle(opts)
         return opts
 
     @classmethod
-    def _make_narrator_q(cls, h: Dict[str, Any], all_h: List[Dict[str, Any]]) -> Dict[str, Any]:
+    def _make_narrator_q(cls, h: Dict[str, Any], all_h: List[Dict[str, Any]], rng: Any = random) -> Dict[str, Any]:
         correct = h["narrator"]
         pool = [x["narrator"] for x in all_h] + [
             "أبو هريرة", "عمر بن الخطاب", "عائشة",
             "أنس بن مالك", "ابن عباس", "أبو سعيد الخدري",
         ]
         return {"hadith_id": h["id"], "question": f"من راوي الحديث: *{MessageFormatter.esc(h['title'])}*؟",
-                "options": cls._build_options(correct, pool), "correct_answer": correct, "type": "narrator"}
+                "options": cls._build_options(correct, pool, rng=rng), "correct_answer": correct, "type": "narrator"}
 
     @classmethod
-    def _make_title_q(cls, h: Dict[str, Any], all_h: List[Dict[str, Any]]) -> Dict[str, Any]:
+    def _make_title_q(cls, h: Dict[str, Any], all_h: List[Dict[str, Any]], rng: Any = random) -> Dict[str, Any]:
         correct = h["title"]
         pool    = [x["title"] for x in all_h]
         preview = h["text"][:80] + ("..." if len(h["text"]) > 80 else "")
         return {"hadith_id": h["id"], "question": f"ما عنوان الحديث الذي يبدأ بـ:\n«{MessageFormatter.esc(preview)}»",
-                "options": cls._build_options(correct, pool), "correct_answer": correct, "type": "title"}
+                "options": cls._build_options(correct, pool, rng=rng), "correct_answer": correct, "type": "title"}
 
     @classmethod
-    def _make_completion_q(cls, h: Dict[str, Any], all_h: List[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+    def _make_completion_q(cls, h: Dict[str, Any], all_h: List[Dict[str, Any]], rng: Any = random) -> Optional[Dict[str, Any]]:
         words = h["text"].split()
         if len(words) < 15:
             return None
-        cut        = random.randint(len(words) // 3, len(words) // 2)
+        cut        = rng.randint(len(words) // 3, len(words) // 2)
         first_part = " ".join(words[:cut])
         correct    = " ".join(words[cut:cut + 5])
         pool: List[str] = []
@@ -1631,7 +2817,7 @@ class QuizSystem:
             ow = other["text"].split()
             if len(ow) < 5:
                 continue
-            si    = random.randint(0, len(ow) - 5)
+            si    = rng.randint(0, len(ow) - 5)
             chunk = " ".join(ow[si:si + 5])
             if chunk != correct:
                 pool.append(chunk)
@@ -1639,17 +2825,17 @@ class QuizSystem:
                 break
         pool.extend(["والله أعلم بذلك", "وهو على كل شيء قدير", "إن الله غفور رحيم"])
         return {"hadith_id": h["id"], "question": f"أكمل الحديث:\n«{MessageFormatter.esc(first_part)}... »",
-                "options": cls._build_options(correct, pool), "correct_answer": correct, "type": "completion"}
+                "options": cls._build_options(correct, pool, rng=rng), "correct_answer": correct, "type": "completion"}
 
     @classmethod
-    def _make_source_q(cls, h: Dict[str, Any], all_h: List[Dict[str, Any]]) -> Dict[str, Any]:
+    def _make_source_q(cls, h: Dict[str, Any], all_h: List[Dict[str, Any]], rng: Any = random) -> Dict[str, Any]:
         correct = h["source"]
         pool = [x["source"] for x in all_h] + [
             "صحيح البخاري", "صحيح مسلم", "سنن أبي داود",
             "سنن الترمذي", "سنن النسائي", "سنن ابن ماجه",
         ]
         return {"hadith_id": h["id"], "question": f"ما مصدر الحديث: *{MessageFormatter.esc(h['title'])}*؟",
-                "options": cls._build_options(correct, pool), "correct_answer": correct, "type": "source"}
+                "options": cls._build_options(correct, pool, rng=rng), "correct_answer": correct, "type": "source"}
 
     @staticmethod
     def _is_valid(q: Optional[Dict[str, Any]]) -> bool:
@@ -1664,51 +2850,82 @@ class QuizSystem:
         return True
 
     @classmethod
-    def start(cls, user_id: int, questions: List[Dict[str, Any]]) -> None:
-        cls.active_quizzes[user_id] = {"questions": questions, "current_index": 0, "score": 0, "answers": []}
+    def _questions(cls, quiz: Dict[str, Any]) -> List[Dict[str, Any]]:
+        key = (quiz["seed"], quiz["n"])
+        questions = cache_get("quiz", key)
+        if questions is None:
+            questions = cls.generate_quiz(cls.hadith_db, quiz["n"], seed=quiz["seed"])
+            cache_set("quiz", key, questions)
+        return questions
+
+    @classmethod
+    def start(cls, user_id: int, question_count: int = 5) -> bool:
+        """بدء اختبار جديد — False إذا تعذّر توليد الأسئلة"""
+        quiz = {"seed": random.getrandbits(32), "n": question_count, "current_index": 0, "score": 0, "answers": []}
+        if not cls._questions(quiz):
+            return False
+        _session_store.set("quiz", user_id, quiz)
+        return True
 
     @classmethod
     def get_current_question(cls, user_id: int) -> Optional[Dict[str, Any]]:
-        quiz = cls.active_quizzes.get(user_id)
+        quiz = _session_store.get("quiz", user_id)
         if not quiz:
             return None
+        questions = cls._questions(quiz)
         idx = quiz["current_index"]
-        return quiz["questions"][idx] if idx < len(quiz["questions"]) else None
+        return questions[idx] if idx < len(questions) else None
+
+    @classmethod
+    def progress(cls, user_id: int) -> Tuple[int, int]:
+        """(رقم السؤال الحالي, عدد الأسئلة)"""
+        quiz = _session_store.get("quiz", user_id)
+        if not quiz:
+            return 0, 0
+        return quiz["current_index"] + 1, len(cls._questions(quiz))
 
     @classmethod
     def submit_answer(cls, user_id: int, answer: str) -> Tuple[bool, Optional[str]]:
-        quiz = cls.active_quizzes.get(user_id)
+        quiz = _session_store.get("quiz", user_id)
         if not quiz:
             return False, None
-        question   = quiz["questions"][quiz["current_index"]]
+        question   = cls._questions(quiz)[quiz["current_index"]]
         is_correct = answer == question.get("correct_answer")
         if is_correct:
             quiz["score"] += 1
-        quiz["answers"].append({
-            "question_id":    quiz["current_index"],
-            "user_answer":    answer,
-            "correct_answer": question.get("correct_answer"),
-            "is_correct":     is_correct,
-        })
+        # يُخزَّن رقم الخيار المختار فقط (-1 = إجابة خارج الخيارات)
+        options = question.get("options", [])
+        quiz["answers"].append(options.index(answer) if answer in options else -1)
         quiz["current_index"] += 1
+        _session_store.set("quiz", user_id, quiz)
         return is_correct, question.get("correct_answer")
 
     @classmethod
     def get_result(cls, user_id: int) -> Optional[Dict[str, Any]]:
-        quiz = cls.active_quizzes.pop(user_id, None)
+        quiz = _session_store.pop("quiz", user_id)
         if not quiz:
             return None
-        total = len(quiz["questions"])
+        questions = cls._questions(quiz)
+        total = len(questions)
         score = quiz["score"]
-        return {"score": score, "total": total, "percentage": round((score / total) * 100, 2) if total else 0, "answers": quiz["answers"]}
+        answers = [
+            {
+                "question_id":    i,
+                "user_answer":    questions[i]["options"][choice] if choice >= 0 else None,
+                "correct_answer": questions[i].get("correct_answer"),
+                "is_correct":     choice >= 0 and questions[i]["options"][choice] == questions[i].get("correct_answer"),
+            }
+            for i, choice in enumerate(quiz["answers"])
+        ]
+        return {"score": score, "total": total, "percentage": round((score / total) * 100, 2) if total else 0, "answers": answers}
 
     @classmethod
     def is_active(cls, user_id: int) -> bool:
-        return user_id in cls.active_quizzes
+        return _session_store.contains("quiz", user_id)
 
     @classmethod
     def cancel(cls, user_id: int) -> None:
-        cls.active_quizzes.pop(user_id, None)
+        _session_store.pop("quiz", user_id)
 
     @staticmethod
     def build_result_text(result: Dict[str, Any]) -> str:
@@ -1731,14 +2948,466 @@ class QuizSystem:
         )
 
 
-# ═══════════════════════════════════════════════════════════════════
-# 9. الذكاء الاصطناعي (محسّن بسياق الحديث)
-# ═══════════════════════════════════════════════════════════════════
+# ═══════════════════════════════════════════════════════════════════
+# 9. الذكاء الاصطناعي (محسّن بسياق الحديث)
+# ═══════════════════════════════════════════════════════════════════
+
+class ProviderRouter:
+    """
+    توجيه طلبات AI بين المزوّدين مع طلبات "تحوّط" (hedged requests)
+    ─────────────────────────────────────────────────────────────────
+    - يتتبع لكل مزوّد متوسطاً متحركاً أُسّياً (EWMA) للزمن ونسبة الأخطاء
+    - يبدأ بالمزوّد الأصح؛ إن لم يرد خلال p95 زمنه يُطلق الثاني بالتوازي
+      ويأخذ أول رد ناجح ويلغي الآخر
+    - إن فشل الأول قبل مهلة التحوط يُطلق الثاني فوراً
+    - الطلب الملغى ليس عينة زمن: زمنه حدّ أدنى فقط، فلا يرفع تقديره إلا إن
+      تجاوزه (وإلا لجعل التحوّط المزوّد الأبطأ يبدو أسرع)
+    - مزوّد بلا عينات يُقدَّر بـ DEFAULT_HEDGE لا بصفر، فلا يتقدّم على مزوّد معروف
+    المزوّدون دوال async(messages) → str، فيمكن تجربته بمزوّدين وهميين.
+    """
+
+    ALPHA            = 0.2
+    DEFAULT_HEDGE    = 4.0    # ثوانٍ قبل توفر عينات كافية
+    MIN_HEDGE        = 0.5
+    MAX_HEDGE        = 15.0
+    MIN_SAMPLES      = 5
+
+    def __init__(self, providers: Dict[str, Any]) -> None:
+        self.providers = providers
+        self._stats: Dict[str, Dict[str, Any]] = {
+            name: {"latency": None, "errors": 0.0, "samples": deque(maxlen=100), "calls": 0, "wins": 0}
+            for name in providers
+        }
+        self.hedged = 0
+
+    def record(self, name: str, ok: bool, latency: Optional[float] = None) -> None:
+        st = self._stats[name]
+        st["calls"]  += 1
+        st["errors"]  = (1 - self.ALPHA) * st["errors"] + self.ALPHA * (0.0 if ok else 1.0)
+        if ok and latency is not None:
+            self._observe_latency(name, latency)
+
+    def _observe_latency(self, name: str, latency: float) -> None:
+        st = self._stats[name]
+        st["samples"].append(latency)
+        st["latency"] = latency if st["latency"] is None else (1 - self.ALPHA) * st["latency"] + self.ALPHA * latency
+
+    def _censor_latency(self, name: str, elapsed: float) -> None:
+        """طلب أُلغي بعد elapsed — يُحتسب max(elapsed, التقدير) فلا يخفض التقدير أبداً"""
+        st = self._stats[name]
+        if st["latency"] is not None and elapsed > st["latency"]:
+            st["latency"] = (1 - self.ALPHA) * st["latency"] + self.ALPHA * elapsed
+
+    def order(self) -> List[str]:
+        """المزوّدون من الأصح للأسوأ — الزمن مضروباً في عقوبة الأخطاء"""
+        def score(name: str) -> float:
+            st = self._stats[name]
+            latency = self.DEFAULT_HEDGE if st["latency"] is None else st["latency"]
+            return latency * (1 + 4 * st["errors"]) + 10 * st["errors"]
+        return sorted(self.providers, key=score)
+
+    def hedge_delay(self, name: str) -> float:
+        samples = sorted(self._stats[name]["samples"])
+        if len(samples) < self.MIN_SAMPLES:
+            return self.DEFAULT_HEDGE
+        p95 = samples[min(len(samples) - 1, int(len(samples) * 0.95))]
+        return min(max(p95, self.MIN_HEDGE), self.MAX_HEDGE)
+
+    async def call(self, messages: List[Dict[str, str]]) -> Optional[Tuple[str, str]]:
+        """(المزوّد، الرد) لأول رد ناجح — None إذا فشل الجميع"""
+        queue   = self.order()
+        running: Dict[asyncio.Task, Tuple[str, float]] = {}
+
+        def launch() -> None:
+            name = queue.pop(0)
+            running[asyncio.create_task(self.providers[name](messages))] = (name, time.monotonic())
+
+        launch()
+        try:
+            while running:
+                primary = next(iter(running.values()))[0]
+                timeout = self.hedge_delay(primary) if queue and len(running) == 1 else None
+                done, _ = await asyncio.wait(running, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    self.hedged += 1
+                    launch()   # الأول بطيء — أطلق التالي بالتوازي
+                    continue
+                for task in done:
+                    name, started = running.pop(task)
+                    if task.exception() is None:
+                        self.record(name, True, time.monotonic() - started)
+                        self._stats[name]["wins"] += 1
+                        return name, task.result()
+                    self.record(name, False)
+                    logger.warning(f"⚠️ فشل مزوّد AI {name}: {task.exception()}")
+                if not running and queue:
+                    launch()
+            return None
+        finally:
+            # الخاسر أُلغي — زمنه حتى الآن حدّ أدنى لزمنه الحقيقي، لا عينة
+            for task, (name, started) in running.items():
+                task.cancel()
+                self._censor_latency(name, time.monotonic() - started)
+
+    def stats(self) -> Dict[str, Dict[str, Any]]:
+        return {
+            name: {
+                "latency": st["latency"] or 0.0,
+                "errors":  st["errors"],
+                "calls":   st["calls"],
+                "wins":    st["wins"],
+                "hedge":   self.hedge_delay(name),
+            }
+            for name, st in self._stats.items()
+        }
+
+
+class AIRequestScheduler:
+    """
+    جدولة طلبات AI
+    ───────────────
+    - حد أعلى عام للطلبات المتزامنة نحو المزوّدين (AI_MAX_CONCURRENT)
+    - طلب واحد جارٍ لكل مستخدم — الطلب الثاني يُرفض بدل فتح اتصال آخر
+    - طابور FIFO (طلب واحد لكل مستخدم = عدالة) مع إبلاغ المنتظر بترتيبه
+    - الطلبات الخلفية (تسخين الكاش) لا تُخدم إلا إذا خلا طابور المستخدمين
+    - الطلبات المتطابقة الجارية (نفس الشرح لنفس الحديث) تُدمج في طلب واحد
+    """
+
+    POSITION_POLL = 3.0   # ثوانٍ بين تحديثات الترتيب للمنتظر
+
+    def __init__(self, max_concurrent: int = AI_MAX_CONCURRENT, max_queue: int = AI_MAX_QUEUE) -> None:
+        self.max_concurrent = max_concurrent
+        self.max_queue      = max_queue
+        self._active        = 0
+        self._queue:      deque = deque()   # (user_id, future)
+        self._background: deque = deque()
+        self._users: set = set()
+        self._inflight: Dict[Any, list] = {}   # key → [task, عدد المنتظرين]
+        self.wait_samples: deque = deque(maxlen=500)
+        self.served   = 0
+        self.rejected = 0
+        self.merged   = 0
+
+    def busy(self, user_id: int) -> bool:
+        return user_id in self._users
+
+    def full(self) -> bool:
+        """الطابور ممتلئ — slot سيرفض أي طلب مستخدم جديد"""
+        return len(self._queue) >= self.max_queue
+
+    def position(self, user_id: int) -> int:
+        """ترتيب المستخدم في الطابور (1 = التالي) — 0 إن لم يكن منتظراً"""
+        for i, (uid, _) in enumerate(self._queue, 1):
+            if uid == user_id:
+                return i
+        return 0
+
+    @asynccontextmanager
+    async def slot(self, user_id: int, on_wait=None, background: bool = False) -> AsyncIterator[bool]:
+        """
+        يحجز مكاناً للطلب طوال كتلة with — يُعيد False إذا رُفض
+        (للمستخدم طلب جارٍ أو الطابور ممتلئ). on_wait(position) تُستدعى أثناء الانتظار.
+        """
+        if not background and (self.busy(user_id) or self.full()):
+            self.rejected += 1
+            yield False
+            return
+        if not background:
+            self._users.add(user_id)
+        started = time.monotonic()
+        try:
+            if self._active < self.max_concurrent and not self._queue and (not background or not self._background):
+                self._active += 1
+            else:
+                await self._wait_turn(user_id, on_wait, background)
+            self.wait_samples.append(time.monotonic() - started)
+            self.served += 1
+            try:
+                yield True
+            finally:
+                self._release()
+        finally:
+            self._users.discard(user_id)
+
+    async def _wait_turn(self, user_id: int, on_wait, background: bool) -> None:
+        fut   = asyncio.get_running_loop().create_future()
+        queue = self._background if background else self._queue
+        queue.append((user_id, fut))
+        last  = 0
+        try:
+            while True:
+                pos = self.position(user_id)
+                if on_wait and pos and pos != last:
+                    last = pos
+                    try:
+                        await on_wait(pos)
+                    except Exception as exc:
+                        logger.debug(f"on_wait error: {exc}")
+                try:
+                    await asyncio.wait_for(asyncio.shield(fut), self.POSITION_POLL if on_wait else None)
+                    return
+                except asyncio.TimeoutError:
+                    continue
+        except BaseException:
+            if fut.done() and not fut.cancelled():
+                self._release()   # المكان سُلّم لنا قبل الإلغاء مباشرة — مرّره للتالي
+            else:
+                fut.cancel()
+                try:
+                    queue.remove((user_id, fut))
+                except ValueError:
+                    pass
+            raise
+
+    def _release(self) -> None:
+        """تسليم المكان مباشرة لأول منتظر (المستخدمون قبل الخلفية)"""
+        while self._queue or self._background:
+            _, fut = (self._queue or self._background).popleft()
+            if not fut.done():
+                fut.set_result(None)
+                return
+        self._active -= 1
+
+    async def single_flight(self, key: Any, factory) -> Any:
+        """
+        إذا كان طلب بنفس المفتاح جارياً ننتظر نتيجته بدل طلب جديد.
+        الطلب يعمل في مهمة مستقلة: إلغاء أحد المنتظرين (ولو أولهم) لا يمسّ
+        الباقين، ولا تُلغى المهمة إلا إذا انصرف كل المنتظرين.
+        """
+        entry = self._inflight.get(key)
+        if entry is None:
+            entry = self._inflight[key] = [asyncio.create_task(factory()), 0]
+
+            def _done(_task: asyncio.Task) -> None:
+                if self._inflight.get(key) is entry:
+                    del self._inflight[key]
+
+            entry[0].add_done_callback(_done)
+        else:
+            self.merged += 1
+        task = entry[0]
+        entry[1] += 1
+        try:
+            return await asyncio.shield(task)
+        except asyncio.CancelledError:
+            if entry[1] == 1:
+                task.cancel()   # آخر المنتظرين — لا أحد يحتاج النتيجة
+            raise
+        finally:
+            entry[1] -= 1
+
+    def stats(self) -> Dict[str, Any]:
+        waits = sorted(self.wait_samples)
+        return {
+            "active":     self._active,
+            "limit":      self.max_concurrent,
+            "queued":     len(self._queue),
+            "background": len(self._background),
+            "served":     self.served,
+            "rejected":   self.rejected,
+            "merged":     self.merged,
+            "wait_p50":   waits[len(waits) // 2] if waits else 0.0,
+            "wait_p95":   waits[min(len(waits) - 1, int(len(waits) * 0.95))] if waits else 0.0,
+        }
+
+
+_ARABIC_RE = re.compile(r"[\u0600-\u06FF\u0750-\u077F\uFB50-\uFDFF\uFE70-\uFEFF]")
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    تقدير تقريبي لعدد التوكنات بلا tokenizer
+    النص العربي (خاصة المشكول) يُقسَّم أكثر: ~2.5 حرف/توكن مقابل ~4 للاتينية
+    """
+    if not text:
+        return 0
+    latin  = len(_ARABIC_RE.sub("", text))
+    arabic = len(text) - latin
+    return int(arabic / 2.5 + latin / 4) + 1
+
+
+class ContextBuilder:
+    """
+    بناء رسائل AI ضمن ميزانية توكنات
+    ─────────────────────────────────
+    - رسالة النظام والسؤال الحالي كاملة دائماً
+    - السجل من الأحدث للأقدم حتى نفاد الميزانية؛ أول دور لا يتسع يُقتطع
+    - الأدوار الأقدم تُختصر في سطر واحد (أسئلة المستخدم السابقة)
+    - نص الحديث المناقَش يُرسل مرة واحدة: يُحذف من السجل، ولا يُضاف
+      للنظام إذا كان السؤال نفسه يتضمنه (طلبات الشرح)
+    """
+
+    MESSAGE_OVERHEAD = 4     # توكنات الدور والفواصل لكل رسالة
+    HADITH_SNIPPET   = 400
+    SUMMARY_SNIPPET  = 60
+    SUMMARY_QUESTIONS = 4
+    MIN_TRUNCATED    = 40    # لا نُبقي دوراً مقتطعاً أقصر من هذا (توكنات)
+
+    def __init__(self, history_budget: int = AI_HISTORY_TOKEN_BUDGET) -> None:
+        self.history_budget = history_budget
+        self.built          = 0
+        self.tokens_full    = 0   # ما كان سيُرسل بلا ميزانية
+        self.tokens_sent    = 0
+
+    def build(
+        self,
+        system_prompt: str,
+        history: List[Dict[str, str]],
+        msg: str,
+        active_hadith: Optional[Dict[str, Any]] = None,
+    ) -> List[Dict[str, str]]:
+        self.tokens_full += (
+            estimate_tokens(system_prompt) + estimate_tokens(msg) + 2 * self.MESSAGE_OVERHEAD
+            + sum(estimate_tokens(m["content"]) + self.MESSAGE_OVERHEAD for m in history)
+            + (estimate_tokens(self._hadith_block(active_hadith)) if active_hadith else 0)
+        )
+        full_text = active_hadith["text"] if active_hadith else ""
+        if active_hadith and full_text not in msg:
+            system_prompt += self._hadith_block(active_hadith)
+        if full_text:
+            ref     = f"«نص الحديث {active_hadith['id']}»"
+            history = [{**m, "content": m["content"].replace(full_text, ref)} for m in history]
+
+        kept: List[Dict[str, str]] = []
+        budget = self.history_budget
+        cut    = len(history)
+        for i in range(len(history) - 1, -1, -1):
+            m    = history[i]
+            cost = estimate_tokens(m["content"]) + self.MESSAGE_OVERHEAD
+            if cost <= budget:
+                kept.append(m)
+                budget -= cost
+                cut = i
+                continue
+            if budget >= self.MIN_TRUNCATED + self.MESSAGE_OVERHEAD:
+                kept.append({**m, "content": self._truncate(m["content"], budget - self.MESSAGE_OVERHEAD)})
+                budget = 0
+                cut = i
+            break
+        kept.reverse()
+
+        system_prompt += self._summarize(history[:cut])
+
+        messages = [{"role": "system", "content": system_prompt}, *kept, {"role": "user", "content": msg}]
+        self.built       += 1
+        self.tokens_sent += sum(estimate_tokens(m["content"]) + self.MESSAGE_OVERHEAD for m in messages)
+        return messages
+
+    def _hadith_block(self, hadith: Dict[str, Any]) -> str:
+        return (
+            f"\n\n📌 الحديث المناقَش حالياً:\n"
+            f"الرقم: {hadith['id']} — {hadith['title']}\n"
+            f"الراوي: {hadith['narrator']}\n"
+            f"النص: {hadith['text'][:self.HADITH_SNIPPET]}"
+        )
+
+    @staticmethod
+    def _truncate(text: str, tokens: int) -> str:
+        """آخر جزء من النص بحدود الميزانية (نهاية الرد أقرب للسؤال التالي)"""
+        chars = int(tokens * 2.5)
+        if len(text) <= chars:
+            return text
+        tail = text[-chars:]
+        space = tail.find(" ")
+        return "…" + (tail[space + 1:] if 0 <= space < 30 else tail)
+
+    def _summarize(self, dropped: List[Dict[str, str]]) -> str:
+        """سطر واحد بأسئلة المستخدم التي خرجت من الميزانية — بدل حذفها كلياً"""
+        questions = [
+            m["content"][:self.SUMMARY_SNIPPET].replace("\n", " ")
+            for m in dropped if m["role"] == "user"
+        ][-self.SUMMARY_QUESTIONS:]
+        if not questions:
+            return ""
+        return "\n\n🗂️ أسئلة سابقة للمستخدم في هذه المحادثة: " + " | ".join(questions)
+
+    def stats(self) -> Dict[str, float]:
+        return {
+            "built":    self.built,
+            "avg_sent": self.tokens_sent / self.built if self.built else 0.0,
+            "saved":    1 - self.tokens_sent / self.tokens_full if self.tokens_full else 0.0,
+        }
+
+
+class AIResponseCache:
+    """
+    كاش دائم (SQLite محلي) لردود AI الثابتة — المفتاح (mode, hadith_id, prompt_version, model)
+    نقرة ثانية على "شرح مبسط" لنفس الحديث = صفر زمن انتظار وصفر توكنات
+    model هو النموذج الذي أنتج الرد فعلاً؛ البحث يقبل أي نموذج من المزوّدين المفعّلين
+    """
+
+    def __init__(self, path: Path, ttl: float = AI_CACHE_TTL) -> None:
+        self.ttl = ttl
+        self.hits = self.misses = 0
+        self._db: Optional[sqlite3.Connection] = None
+        try:
+            self._db = sqlite3.connect(str(path), isolation_level=None, check_same_thread=False)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS ai_cache ("
+                "mode TEXT NOT NULL, hadith_id INTEGER NOT NULL, prompt_version INTEGER NOT NULL, "
+                "model TEXT NOT NULL, response TEXT NOT NULL, created REAL NOT NULL, "
+                "PRIMARY KEY (mode, hadith_id, prompt_version, model))"
+            )
+        except sqlite3.Error as exc:
+            logger.warning(f"⚠️ كاش AI غير متاح ({path}): {exc}")
+            self._db = None
+
+    def __len__(self) -> int:
+        if not self._db:
+            return 0
+        return self._db.execute("SELECT COUNT(*) FROM ai_cache").fetchone()[0]
+
+    def _lookup(self, mode: str, hadith_id: int, models: Sequence[str]) -> Optional[str]:
+        if not self._db or not models:
+            return None
+        row = self._db.execute(
+            "SELECT response, created FROM ai_cache "
+            "WHERE mode = ? AND hadith_id = ? AND prompt_version = ? "
+            f"AND model IN ({', '.join('?' * len(models))}) ORDER BY created DESC LIMIT 1",
+            (mode, hadith_id, AI_PROMPT_VERSION, *models),
+        ).fetchone()
+        if not row or time.time() - row[1] > self.ttl:
+            return None
+        return row[0]
+
+    def get(self, mode: str, hadith_id: int, models: Sequence[str]) -> Optional[str]:
+        response = self._lookup(mode, hadith_id, models)
+        if response is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return response
+
+    def has(self, mode: str, hadith_id: int, models: Sequence[str]) -> bool:
+        """مثل get لكن دون احتساب hit/miss (للتعبئة المسبقة)"""
+        return self._lookup(mode, hadith_id, models) is not None
+
+    def set(self, mode: str, hadith_id: int, model: str, response: str) -> None:
+        if not self._db:
+            return
+        try:
+            self._db.execute(
+                "INSERT OR REPLACE INTO ai_cache (mode, hadith_id, prompt_version, model, response, created) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (mode, hadith_id, AI_PROMPT_VERSION, model, response, time.time()),
+            )
+        except sqlite3.Error as exc:
+            logger.debug(f"AI cache write error: {exc}")
+
+    def clear(self) -> int:
+        size = len(self)
+        if self._db:
+            self._db.execute("DELETE FROM ai_cache")
+        self.hits = self.misses = 0
+        return size
+
 
 class NibrasAI:
     OPENROUTER_URL   = "https://openrouter.ai/api/v1/chat/completions"
     OPENROUTER_MODEL = "google/gemini-2.0-flash-001"
     GOOGLE_URL       = "https://generativelanguage.googleapis.com/v1beta/models/gemini-pro:generateContent"
+    GOOGLE_STREAM_URL = "https://generativelanguage.googleapis.com/v1beta/models/gemini-pro:streamGenerateContent"
 
     _PROMPTS = {
         "normal": (
@@ -1759,10 +3428,61 @@ class NibrasAI:
         ),
     }
 
-    def __init__(self, openrouter_key: str, google_key: Optional[str], memory: ConversationMemory) -> None:
+    _RATE_LIMITED_REPLY = (
+        "⏳ *طلبات شرح كثيرة في وقت قصير*\n\n"
+        "يرجى الانتظار دقيقة ثم المحاولة مجدداً."
+    )
+    _BUSY_REPLY = (
+        "⏳ *سؤالك السابق ما زال قيد المعالجة*\n\n"
+        "انتظر حتى يكتمل الرد ثم أرسل طلبك التالي."
+    )
+    _QUEUE_FULL_REPLY = (
+        "⏳ *الطلبات كثيرة جداً الآن*\n\n"
+        "قائمة الانتظار ممتلئة، يرجى المحاولة بعد دقيقة."
+    )
+
+    # طلبات الشرح الثابتة لكل حديث — نتائجها تُخزَّن في AIResponseCache
+    _EXPLAIN_PROMPTS = {
+        "simple":  "اشرح الحديث التالي بطريقة بسيطة للأطفال والمبتدئين:\n\n{text}",
+        "compare": "قدم شرحاً مقارناً متعمقاً للحديث التالي:\n\n{text}",
+    }
+
+    def __init__(
+        self,
+        openrouter_key: str,
+        google_key: Optional[str],
+        memory: ConversationMemory,
+        response_cache: Optional[AIResponseCache] = None,
+        scheduler: Optional[AIRequestScheduler] = None,
+        transport: Optional[httpx.AsyncBaseTransport] = None,
+    ) -> None:
         self.openrouter_key = openrouter_key
         self.google_key     = google_key
         self.memory         = memory
+        self.response_cache = response_cache
+        self.scheduler      = scheduler or AIRequestScheduler()
+        self.context        = ContextBuilder()
+        self.ttft_samples: deque = deque(maxlen=500)   # زمن أول توكن (ثوانٍ) للردود المتدفقة
+        providers: Dict[str, Any] = {}
+        if google_key:
+            providers["google"] = self._call_google
+        providers["openrouter"] = self._call_openrouter
+        self.router = ProviderRouter(providers)
+        self._streamers = {"google": self._stream_google, "openrouter": self._stream_openrouter}
+        # عميل HTTP واحد طويل العمر: keep-alive + HTTP/2 (إن توفر h2) بدل اتصال TLS جديد لكل سؤال
+        self._client = httpx.AsyncClient(
+            http2=_HTTP2_AVAILABLE,
+            limits=httpx.Limits(
+                max_connections=AI_MAX_CONNECTIONS,
+                max_keepalive_connections=AI_MAX_KEEPALIVE,
+                keepalive_expiry=60.0,
+            ),
+            timeout=httpx.Timeout(REQUEST_TIMEOUT, connect=AI_CONNECT_TIMEOUT),
+            transport=transport,   # للاختبارات (httpx.MockTransport)
+        )
+
+    async def aclose(self) -> None:
+        await self._client.aclose()
 
     async def generate_response(
         self,
@@ -1771,61 +3491,257 @@ class NibrasAI:
         additional_context: str = "",
         mode: str = "normal",
         active_hadith: Optional[Dict[str, Any]] = None,
+        on_wait=None,
     ) -> str:
+        if self.scheduler.busy(user_id):
+            return self._BUSY_REPLY
+        if self.scheduler.full():
+            return self._QUEUE_FULL_REPLY
+        if not is_admin(user_id) and not check_rate_limit(user_id, "ai"):
+            return self._RATE_LIMITED_REPLY
+        messages = self._build_messages(user_id, user_message, additional_context, mode, active_hadith)
+        result = await self._complete(messages, user_id, on_wait)
+        if result is None:
+            return self._fallback()
+        _, text = result
+        self._store(user_id, user_message, text)
+        return text
+
+    async def stream_response(
+        self,
+        user_id: int,
+        user_message: str,
+        additional_context: str = "",
+        mode: str = "normal",
+        active_hadith: Optional[Dict[str, Any]] = None,
+        on_wait=None,
+    ) -> AsyncIterator[str]:
+        """
+        مثل generate_response لكن يُعيد الرد قطعةً قطعة فور وصولها
+        المزوّد الأصح أولاً — التبديل ممكن فقط قبل أول قطعة
+        """
+        if self.scheduler.busy(user_id):
+            yield self._BUSY_REPLY
+            return
+        if self.scheduler.full():
+            yield self._QUEUE_FULL_REPLY
+            return
+        if not is_admin(user_id) and not check_rate_limit(user_id, "ai"):
+            yield self._RATE_LIMITED_REPLY
+            return
         messages = self._build_messages(user_id, user_message, additional_context, mode, active_hadith)
+        parts: List[str] = []
+        async with self.scheduler.slot(user_id, on_wait) as admitted:
+            if not admitted:
+                yield self._QUEUE_FULL_REPLY
+                return
+            started = time.monotonic()
+            for name in self.router.order():
+                attempt = time.monotonic()
+                try:
+                    async for chunk in self._streamers[name](messages):
+                        if not parts:
+                            self.ttft_samples.append(time.monotonic() - started)
+                            self.router.record(name, True, time.monotonic() - attempt)
+                        parts.append(chunk)
+                        yield chunk
+                    break
+                except Exception as exc:
+                    logger.warning(f"⚠️ فشل البث من {name}: {exc}")
+                    if parts:
+                        break   # وصل جزء من الرد — لا نبدأ من جديد مع مزوّد آخر
+                    self.router.record(name, False)
+        if not parts:
+            yield self._fallback()
+            return
+        self._store(user_id, user_message, "".join(parts))
+
+    def ttft_stats(self) -> Dict[str, float]:
+        samples = sorted(self.ttft_samples)
+        if not samples:
+            return {"count": 0, "p50": 0.0, "p95": 0.0}
+        return {
+            "count": len(samples),
+            "p50":   samples[len(samples) // 2],
+            "p95":   samples[min(len(samples) - 1, int(len(samples) * 0.95))],
+        }
 
-        if self.google_key:
+    @staticmethod
+    async def _iter_sse(resp: httpx.Response) -> AsyncIterator[Dict[str, Any]]:
+        async for line in resp.aiter_lines():
+            if not line.startswith("data:"):
+                continue   # تعليقات keep-alive وأسطر فارغة
+            data = line[5:].strip()
+            if data == "[DONE]":
+                return
             try:
-                text = await self._call_google(messages)
-                self._store(user_id, user_message, text)
-                return text
-            except Exception as exc:
-                logger.warning(f"⚠️ فشل Google AI: {exc}")
+                yield json.loads(data)
+            except json.JSONDecodeError:
+                continue
 
-        try:
-            text = await self._call_openrouter(messages)
-            self._store(user_id, user_message, text)
-            return text
-        except Exception as exc:
-            logger.error(f"❌ فشلت جميع المحاولات: {exc}")
-            return self._fallback()
+    async def _stream_google(self, messages: List[Dict[str, str]]) -> AsyncIterator[str]:
+        prompt = "\n\n".join(f"{m['role']}: {m['content']}" for m in messages)
+        async with self._client.stream(
+            "POST",
+            self.GOOGLE_STREAM_URL,
+            params={"alt": "sse", "key": self.google_key},
+            json={"contents": [{"parts": [{"text": prompt}]}]},
+            timeout=httpx.Timeout(GOOGLE_TIMEOUT, connect=AI_CONNECT_TIMEOUT),
+        ) as resp:
+            resp.raise_for_status()
+            async for event in self._iter_sse(resp):
+                for cand in event.get("candidates", [])[:1]:
+                    for part in cand.get("content", {}).get("parts", []):
+                        if part.get("text"):
+                            yield part["text"]
+
+    async def _stream_openrouter(self, messages: List[Dict[str, str]]) -> AsyncIterator[str]:
+        headers = {"Authorization": f"Bearer {self.openrouter_key}", "Content-Type": "application/json"}
+        payload = {"model": self.OPENROUTER_MODEL, "messages": messages, "stream": True}
+        async with self._client.stream(
+            "POST",
+            self.OPENROUTER_URL,
+            headers=headers,
+            json=payload,
+            timeout=httpx.Timeout(OPENROUTER_TIMEOUT, connect=AI_CONNECT_TIMEOUT),
+        ) as resp:
+            resp.raise_for_status()
+            async for event in self._iter_sse(resp):
+                for choice in event.get("choices", [])[:1]:
+                    delta = (choice.get("delta") or {}).get("content")
+                    if delta:
+                        yield delta
+
+    async def explain_hadith(
+        self,
+        user_id: int,
+        hadith: Dict[str, Any],
+        mode: str = "simple",
+        bypass_cache: bool = False,
+        on_wait=None,
+    ) -> str:
+        """
+        شرح ثابت لحديث (simple / compare) — لا يعتمد على سجل المستخدم لذا يُخزَّن
+        ويُعاد لكل من يطلبه. bypass_cache=True يتجاهل الكاش ويُحدّثه.
+        طلبان متزامنان لنفس الشرح يشتركان في استدعاء واحد للمزوّد.
+        """
+        prompt = self._EXPLAIN_PROMPTS[mode].format(text=hadith["text"])
+        use_cache = self.response_cache is not None and AI_CACHE_ENABLED
+        text = None
+        if use_cache and not bypass_cache:
+            text = self.response_cache.get(mode, hadith["id"], self.model_tags)
+        if text is None:
+            if self.scheduler.busy(user_id):
+                return self._BUSY_REPLY
+            if self.scheduler.full():
+                return self._QUEUE_FULL_REPLY
+            if not is_admin(user_id) and not check_rate_limit(user_id, "ai"):
+                return self._RATE_LIMITED_REPLY
+            messages = self._build_messages(user_id, prompt, "", mode, hadith, with_history=False)
+            result = await self.scheduler.single_flight(
+                ("explain", mode, hadith["id"]),
+                lambda: self._complete(messages, user_id, on_wait),
+            )
+            if result is None:
+                return self._fallback()
+            model, text = result
+            if use_cache:
+                self.response_cache.set(mode, hadith["id"], model, text)
+        self._store(user_id, prompt, text)
+        return text
+
+    async def prewarm(self, hadiths: List[Dict[str, Any]], modes: Tuple[str, ...] = ("simple", "compare")) -> int:
+        """تعبئة كاش الشروحات في الخلفية لكل الأحاديث — يتخطى المخزَّن مسبقاً"""
+        if self.response_cache is None or not AI_CACHE_ENABLED:
+            return 0
+        filled = 0
+        for hadith in hadiths:
+            for mode in modes:
+                if self.response_cache.has(mode, hadith["id"], self.model_tags):
+                    continue
+                prompt = self._EXPLAIN_PROMPTS[mode].format(text=hadith["text"])
+                result = await self._complete(
+                    self._build_messages(0, prompt, "", mode, hadith, with_history=False), background=True,
+                )
+                if result is not None:
+                    self.response_cache.set(mode, hadith["id"], *result)
+                    filled += 1
+                await asyncio.sleep(1.0)   # لا نزاحم طلبات المستخدمين
+        logger.info(f"🔥 كاش الشروحات: أُضيف {filled} شرح")
+        return filled
+
+    def model_tag(self, provider: str) -> str:
+        """النموذج خلف المزوّد — جزء من مفتاح الكاش"""
+        return "google/gemini-pro" if provider == "google" else self.OPENROUTER_MODEL
+
+    @property
+    def model_tags(self) -> List[str]:
+        """نماذج كل المزوّدين المفعّلين — أي منها يصلح ردّاً من الكاش"""
+        return [self.model_tag(name) for name in self.router.providers]
+
+    async def _complete(
+        self,
+        messages: List[Dict[str, str]],
+        user_id: int = 0,
+        on_wait=None,
+        background: bool = False,
+    ) -> Optional[Tuple[str, str]]:
+        """
+        المزوّد الأصح أولاً مع تحوّط بالثاني — (النموذج الذي أجاب، الرد)
+        أو None إذا فشل الجميع أو رُفض الطلب
+        """
+        async with self.scheduler.slot(user_id, on_wait, background) as admitted:
+            if not admitted:
+                return None
+            result = await self.router.call(messages)
+        if result is None:
+            logger.error("❌ فشلت جميع المحاولات")
+            return None
+        provider, text = result
+        return self.model_tag(provider), text
 
     def _store(self, user_id: int, user_msg: str, ai_msg: str) -> None:
         self.memory.add_message(user_id, "user",      user_msg)
         self.memory.add_message(user_id, "assistant", ai_msg)
 
-    def _build_messages(self, user_id: int, msg: str, context: str, mode: str, active_hadith: Optional[Dict[str, Any]]) -> List[Dict[str, str]]:
+    def _build_messages(
+        self,
+        user_id: int,
+        msg: str,
+        context: str,
+        mode: str,
+        active_hadith: Optional[Dict[str, Any]],
+        with_history: bool = True,
+    ) -> List[Dict[str, str]]:
         prompt = self._PROMPTS.get(mode, self._PROMPTS["normal"])
         if context:
             prompt += f"\n\n{context}"
-        # ← تحسين السياق: أخبر AI بالحديث المناقَش
-        if active_hadith:
-            prompt += (
-                f"\n\n📌 الحديث المناقَش حالياً:\n"
-                f"الرقم: {active_hadith['id']} — {active_hadith['title']}\n"
-                f"الراوي: {active_hadith['narrator']}\n"
-                f"النص: {active_hadith['text'][:400]}"
-            )
-        messages = [{"role": "system", "content": prompt}]
-        messages.extend(self.memory.get(user_id))
-        messages.append({"role": "user", "content": msg})
-        return messages
+        # ← تحسين السياق: الحديث المناقَش + السجل ضمن ميزانية التوكنات
+        history = self.memory.get(user_id) if with_history else []
+        return self.context.build(prompt, history, msg, active_hadith)
 
     async def _call_google(self, messages: List[Dict[str, str]]) -> str:
         prompt = "\n\n".join(f"{m['role']}: {m['content']}" for m in messages)
         url    = f"{self.GOOGLE_URL}?key={self.google_key}"
-        async with httpx.AsyncClient(timeout=REQUEST_TIMEOUT) as client:
-            resp = await client.post(url, json={"contents": [{"parts": [{"text": prompt}]}]})
-            resp.raise_for_status()
-            return resp.json()["candidates"][0]["content"]["parts"][0]["text"]
+        resp = await self._client.post(
+            url,
+            json={"contents": [{"parts": [{"text": prompt}]}]},
+            timeout=httpx.Timeout(GOOGLE_TIMEOUT, connect=AI_CONNECT_TIMEOUT),
+        )
+        resp.raise_for_status()
+        return resp.json()["candidates"][0]["content"]["parts"][0]["text"]
 
     async def _call_openrouter(self, messages: List[Dict[str, str]]) -> str:
         headers = {"Authorization": f"Bearer {self.openrouter_key}", "Content-Type": "application/json"}
         payload = {"model": self.OPENROUTER_MODEL, "messages": messages}
-        async with httpx.AsyncClient(timeout=REQUEST_TIMEOUT) as client:
-            resp = await client.post(self.OPENROUTER_URL, headers=headers, json=payload)
-            resp.raise_for_status()
-            return resp.json()["choices"][0]["message"]["content"]
+        resp = await self._client.post(
+            self.OPENROUTER_URL,
+            headers=headers,
+            json=payload,
+            timeout=httpx.Timeout(OPENROUTER_TIMEOUT, connect=AI_CONNECT_TIMEOUT),
+        )
+        resp.raise_for_status()
+        return resp.json()["choices"][0]["message"]["content"]
 
     @staticmethod
     def _fallback() -> str:
@@ -1848,6 +3764,87 @@ class NibrasAI:
 # نظام المشرف
 # ═══════════════════════════════════════════════════════════════════
 
+# ── أعمدة التصدير (/admin_export) — الاسم → دالة استخراج ──────
+_EXPORT_COLUMNS: Dict[str, Any] = {
+    "user_id":           lambda uid, d: uid,
+    "read_hadiths":      lambda uid, d: len(d.get("read_hadiths", [])),
+    "interaction_count": lambda uid, d: d.get("interaction_count", 0),
+    "streak_count":      lambda uid, d: d.get("streak_count", 0),
+    "streak_best":       lambda uid, d: d.get("streak_best", 0),
+    "streak_last_date":  lambda uid, d: d.get("streak_last_date") or "",
+    "badges":            lambda uid, d: len(d.get("earned_badges", [])),
+    "favorites":         lambda uid, d: len(d.get("favorites", [])),
+    "notes":             lambda uid, d: len(d.get("notes", {})),
+    "quizzes_taken":     lambda uid, d: len(d.get("quiz_scores", [])),
+    "flashcard_count":   lambda uid, d: d.get("flashcard_count", 0),
+    "reminder_enabled":  lambda uid, d: bool(d.get("reminder_enabled", False)),
+    "reminder_timezone": lambda uid, d: d.get("reminder_timezone", DEFAULT_TIMEZONE),
+    "banned":            lambda uid, d: bool(d.get("banned", False)),
+}
+_EXPORT_DEFAULT_COLUMNS = [
+    "user_id", "read_hadiths", "interaction_count",
+    "streak_count", "badges", "reminder_enabled", "banned",
+]
+_EXPORT_PAGE_SIZE = 500
+
+
+def _write_user_export(
+    user_data_mgr: "UserDataManager",
+    path: Path,
+    columns: List[str],
+    fmt: str = "csv",
+    compress: bool = False,
+) -> int:
+    """
+    يكتب التصدير إلى ملف على القرص صفحةً صفحة ويُعيد عدد الصفوف.
+    fmt: csv | jsonl | parquet  —  compress: gzip (لا ينطبق على parquet)
+    """
+    import csv, gzip
+    getters = [_EXPORT_COLUMNS[c] for c in columns]
+    rows    = 0
+
+    if fmt == "parquet":
+        writer = None
+        batch: List[Dict[str, Any]] = []
+
+        def flush() -> None:
+            nonlocal writer, rows
+            table  = _pa.Table.from_pylist(batch)
+            writer = writer or _pq.ParquetWriter(str(path), table.schema, compression="zstd")
+            writer.write_table(table)
+            rows  += len(batch)
+            batch.clear()
+
+        try:
+            for uid, data in user_data_mgr.iter_users(_EXPORT_PAGE_SIZE):
+                batch.append({c: g(uid, data) for c, g in zip(columns, getters)})
+                if len(batch) >= _EXPORT_PAGE_SIZE:
+                    flush()
+            if batch:
+                flush()
+        finally:
+            if writer is not None:
+                writer.close()
+        return rows
+
+    opener = gzip.open if compress else open
+    # utf-8-sig ليفتح Excel الحروف العربية بشكل صحيح
+    encoding = "utf-8-sig" if fmt == "csv" else "utf-8"
+    with opener(path, "wt", encoding=encoding, newline="") as f:
+        if fmt == "jsonl":
+            for uid, data in user_data_mgr.iter_users(_EXPORT_PAGE_SIZE):
+                f.write(json.dumps({c: g(uid, data) for c, g in zip(columns, getters)}, ensure_ascii=False))
+                f.write("\n")
+                rows += 1
+        else:
+            writer = csv.writer(f)
+            writer.writerow(columns)
+            for uid, data in user_data_mgr.iter_users(_EXPORT_PAGE_SIZE):
+                writer.writerow([g(uid, data) for g in getters])
+                rows += 1
+    return rows
+
+
 def is_admin(user_id: int) -> bool:
     """تحقق أن المستخدم هو المشرف"""
     dev_id = os.getenv("DEVELOPER_TELEGRAM_ID", "")
@@ -1935,6 +3932,7 @@ class BotHandlers:
         self.user_data = user_data_mgr
         self.ai        = ai_engine
         self.fmt       = formatter
+        self.broadcasts = BroadcastManager(user_data_mgr, user_data_mgr.data_dir / "broadcast_job.json")
 
     # ════════════════════════════════════════════════════════════════
     # دوال مساعدة خاصة
@@ -2043,13 +4041,12 @@ class BotHandlers:
         # إرسال سياق الحديث المناقَش إلى AI
         active_hid    = self.ai.memory.get_active_hadith(user_id)
         active_hadith = self.db.get_by_id(active_hid) if active_hid else None
-        ai_response   = await self.ai.generate_response(user_id, text_input, active_hadith=active_hadith)
-        formatted     = self.fmt.format_response(ai_response)
-        if len(formatted) > 4096:
-            await status.edit_text(formatted[:4093] + "...", parse_mode=ParseMode.MARKDOWN)
-            await update.message.reply_text(formatted[4093:], parse_mode=ParseMode.MARKDOWN)
-        else:
-            await status.edit_text(formatted, parse_mode=ParseMode.MARKDOWN)
+        await self._stream_to_messages(
+            status,
+            self.ai.stream_response(
+                user_id, text_input, active_hadith=active_hadith, on_wait=self._queue_notifier(status),
+            ),
+        )
         self.user_data.increment_interaction(user_id)
         await self._send_support_if_due(user_id, context.bot)
 
@@ -2063,6 +4060,69 @@ class BotHandlers:
                 context_label="💡 *هل تعلم؟*",
             )
 
+    @staticmethod
+    def _queue_notifier(status):
+        """تحديث رسالة الحالة بترتيب المستخدم أثناء انتظار دوره عند AI"""
+        async def notify(position: int) -> None:
+            try:
+                await status.edit_text(f"⏳ الطلبات كثيرة الآن — ترتيبك في الانتظار: {position}")
+            except TelegramError as exc:
+                logger.debug(f"queue notify error: {exc}")
+        return notify
+
+    STREAM_EDIT_INTERVAL = 1.2   # ثوانٍ بين تعديلات الرسالة أثناء البث (حدود Telegram)
+
+    async def _stream_to_messages(self, status, chunks: AsyncIterator[str]) -> None:
+        """
+        عرض رد AI المتدفق بتعديل رسالة الحالة دورياً
+        - أثناء البث: نص خام بدون Markdown (الأجزاء غير المكتملة تكسر التنسيق)
+        - عند تجاوز 4096 حرفاً: تُثبَّت الرسالة وتبدأ رسالة جديدة عند حد فقرة
+        - في النهاية: تعديل أخير بالتنسيق الكامل، وحذف ما زاد من رسائل إن قلّ
+          عدد الأجزاء بعد التنسيق (حذف اقتراح السؤال مثلاً)
+        """
+        messages = [status]
+        shown: Dict[int, str] = {}
+        text = ""
+        last_edit = time.monotonic()
+
+        async def put(i: int, part: str, markdown: bool) -> None:
+            kwargs = {"parse_mode": ParseMode.MARKDOWN} if markdown else {}
+            try:
+                if i < len(messages):
+                    await messages[i].edit_text(part, **kwargs)
+                else:
+                    messages.append(await status.reply_text(part, **kwargs))
+                shown[i] = part
+            except TelegramError as exc:
+                if markdown and "not modified" not in str(exc).lower():
+                    await put(i, part, markdown=False)   # Markdown غير صالح في الرد — نص عادي
+                else:
+                    logger.debug(f"stream edit error: {exc}")
+
+        # aclosing: إذا انقطع العرض يُغلق المولّد فوراً فيُحرَّر مكانه عند AI
+        async with aclosing(chunks):
+            async for chunk in chunks:
+                text += chunk
+                if time.monotonic() - last_edit >= self.STREAM_EDIT_INTERVAL:
+                    last_edit = time.monotonic()
+                    for i, part in enumerate(self.fmt.split_message(text + " ▌")):
+                        if shown.get(i) != part:
+                            await put(i, part, markdown=False)
+
+        final = self.fmt.split_message(self.fmt.format_response(text))
+        for i, part in enumerate(final):
+            await put(i, part, markdown=True)
+        for extra in messages[len(final):]:
+            try:
+                await extra.delete()
+            except TelegramError as exc:
+                logger.debug(f"stream delete error: {exc}")
+                try:
+                    await extra.edit_text("…")
+                except TelegramError:
+                    pass
+        del messages[len(final):]
+
     def _build_plan_text(self, user_id: int, plan: List[int]) -> str:
         read      = set(self.user_data.get_read_hadiths(user_id))
         completed = sum(1 for h in plan if h in read)
@@ -2414,11 +4474,9 @@ class BotHandlers:
                     "⚠️ لديك اختبار نشط!\nأكمله أو استخدم /cancel_quiz لإلغائه."
                 )
                 return
-            questions = QuizSystem.generate_quiz(self.db, question_count=5)
-            if not questions:
+            if not QuizSystem.start(user_id, question_count=5):
                 await update.message.reply_text("❌ تعذّر توليد الاختبار، حاول مرة أخرى.")
                 return
-            QuizSystem.start(user_id, questions)
             await self._show_quiz_question(update.message, user_id)
         except Exception as exc:
             logger.error(f"خطأ في quiz: {exc}")
@@ -2599,15 +4657,17 @@ class BotHandlers:
             "ــــــــــــــــــ\n\n"
             "📊 `/admin_stats` — إحصائيات البوت\n"
             "🏆 `/admin_top` — أنشط 10 مستخدمين\n"
-            "😴 `/admin_inactive` — غير نشطين ≥7 أيام\n\n"
+            "😴 `/admin_inactive [cursor]` — غير نشطين ≥7 أيام\n\n"
             "📢 `/admin_broadcast [رسالة]` — رسالة جماعية\n"
-            "📣 `/admin_announce [رسالة]` — إعلان مميز\n\n"
+            "📣 `/admin_announce [رسالة]` — إعلان مميز\n"
+            "▶️ `/admin_broadcast_resume` — استئناف بث متوقف\n\n"
             "🚫 `/admin_ban [id]` — حظر مستخدم\n"
             "✅ `/admin_unban [id]` — رفع الحظر\n"
             "🔍 `/admin_user [id]` — بيانات مستخدم\n"
-            "📋 `/admin_export` — تصدير CSV\n\n"
+            "📋 `/admin_export [csv|jsonl|parquet] [gz]` — تصدير\n\n"
             "🔧 `/admin_maintenance on/off` — وضع الصيانة\n"
             "📦 `/admin_cache` — إحصائيات الكاش والأداء\n"
+            "🔄 `/admin_cache refresh [id] [simple|compare]` — إعادة توليد شرح AI\n"
             "❓ `/admin_help` — هذه القائمة\n"
         )
         await update.message.reply_text(text, parse_mode=ParseMode.MARKDOWN)
@@ -2672,41 +4732,48 @@ class BotHandlers:
             return
 
         message_text = " ".join(context.args)
-        users  = self.user_data.get_all_users()
-        total  = len(users)
-        status = await update.message.reply_text(f"📤 جاري الإرسال لـ {total} مستخدم...")
+        await self._start_broadcast(
+            update, context, kind="broadcast",
+            text=(
+                "📢 *رسالة من فريق نبراس*\n"
+                "ـــــ\n\n"
+                f"{MessageFormatter.esc(message_text)}"
+            ),
+        )
 
-        sent = failed = blocked = 0
-        for uid, data in users:
-            if data.get("banned"):
-                continue
-            try:
-                await context.bot.send_message(
-                    chat_id=uid,
-                    text=(
-                        "📢 *رسالة من فريق نبراس*\n"
-                        "ـــــ\n\n"
-                        f"{MessageFormatter.esc(message_text)}"
-                    ),
-                    parse_mode=ParseMode.MARKDOWN,
-                )
-                sent += 1
-                await asyncio.sleep(0.05)
-            except Exception as e:
-                err = str(e).lower()
-                if "blocked" in err or "forbidden" in err:
-                    blocked += 1
-                else:
-                    failed += 1
+    async def _start_broadcast(self, update: Update, context: ContextTypes.DEFAULT_TYPE, kind: str, text: str) -> None:
+        """بدء مهمة بث في الخلفية — ترفض إذا وُجدت مهمة جارية أو متوقفة"""
+        if self.broadcasts.running:
+            await update.message.reply_text("⏳ يوجد بث جارٍ حالياً، انتظر حتى يكتمل.")
+            return
+        if self.broadcasts.pending_job():
+            await update.message.reply_text(
+                "⚠️ يوجد بث سابق لم يكتمل.\n\n"
+                "`/admin_broadcast_resume` — استئنافه\n"
+                "`/admin_broadcast_resume discard` — تجاهله",
+                parse_mode=ParseMode.MARKDOWN,
+            )
+            return
+        total  = await asyncio.to_thread(self.broadcasts.count_recipients)
+        status = await update.message.reply_text(f"📤 جاري الإرسال لـ {total} مستخدم...")
+        self.broadcasts.start(context.bot, text, kind, status.chat_id, status.message_id, total)
 
-        await status.edit_text(
-            f"✅ *اكتمل الإرسال*\n\n"
-            f"📨 أُرسلت: {sent}\n"
-            f"🚫 حجبوا البوت: {blocked}\n"
-            f"❌ فشل: {failed}\n"
-            f"📊 الإجمالي: {total}",
-            parse_mode=ParseMode.MARKDOWN,
+    @admin_only
+    async def admin_broadcast_resume_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+        """▶️ /admin_broadcast_resume [discard] — استئناف بث توقف قبل اكتماله"""
+        job = self.broadcasts.pending_job()
+        if not job:
+            msg = "⏳ البث جارٍ بالفعل." if self.broadcasts.running else "✅ لا يوجد بث متوقف."
+            await update.message.reply_text(msg)
+            return
+        if context.args and context.args[0].lower() == "discard":
+            self.broadcasts.discard()
+            await update.message.reply_text("🗑️ تم تجاهل البث المتوقف.")
+            return
+        status = await update.message.reply_text(
+            self.broadcasts.format_progress(job), parse_mode=ParseMode.MARKDOWN
         )
+        self.broadcasts.resume(context.bot, status.message_id)
 
     @admin_only
     async def admin_ban_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
@@ -2787,33 +4854,65 @@ class BotHandlers:
 
     @admin_only
     async def admin_export_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-        import csv, io
-        users = self.user_data.get_all_users()
-        if not users:
-            await update.message.reply_text("📋 لا يوجد بيانات للتصدير.")
+        """📋 /admin_export [csv|jsonl|parquet] [gz] [cols=a,b,c] — تصدير بيانات المستخدمين"""
+        import tempfile
+        fmt, compress, columns = "csv", False, list(_EXPORT_DEFAULT_COLUMNS)
+        for arg in context.args or []:
+            a = arg.lower()
+            if a in ("csv", "jsonl", "parquet"):
+                fmt = a
+            elif a in ("gz", "gzip"):
+                compress = True
+            elif a.startswith("cols="):
+                columns = [c.strip() for c in a[5:].split(",") if c.strip()]
+            else:
+                await update.message.reply_text(
+                    "📋 *تصدير المستخدمين*\n\n"
+                    "الاستخدام:\n`/admin_export [csv|jsonl|parquet] [gz] [cols=a,b,c]`\n\n"
+                    f"الأعمدة المتاحة:\n`{', '.join(_EXPORT_COLUMNS)}`",
+                    parse_mode=ParseMode.MARKDOWN,
+                )
+                return
+
+        unknown = [c for c in columns if c not in _EXPORT_COLUMNS]
+        if unknown or not columns:
+            await update.message.reply_text(
+                f"❌ أعمدة غير معروفة: `{', '.join(unknown) or '—'}`",
+                parse_mode=ParseMode.MARKDOWN,
+            )
             return
-        output = io.StringIO()
-        writer = csv.writer(output)
-        writer.writerow(["user_id", "read_hadiths", "interaction_count",
-                         "streak_count", "badges", "reminder_enabled", "banned"])
-        for uid, data in users:
-            writer.writerow([
-                uid,
-                len(data.get("read_hadiths", [])),
-                data.get("interaction_count", 0),
-                data.get("streak_count", 0),
-                len(data.get("badges", [])),
-                data.get("reminder_enabled", False),
-                data.get("banned", False),
-            ])
-        output.seek(0)
-        csv_bytes = output.getvalue().encode("utf-8-sig")
-        await update.message.reply_document(
-            document=csv_bytes,
-            filename="nibras_users.csv",
-            caption=f"📋 *بيانات {len(users)} مستخدم*",
-            parse_mode=ParseMode.MARKDOWN,
-        )
+        if fmt == "parquet":
+            if not _PARQUET_AVAILABLE:
+                await update.message.reply_text("⚠️ تصدير Parquet يحتاج مكتبة pyarrow على الخادم.")
+                return
+            compress = False  # Parquet مضغوط داخلياً
+
+        filename = f"nibras_users.{fmt}" + (".gz" if compress else "")
+        status   = await update.message.reply_text("📋 جاري التصدير...")
+        tmp_dir  = Path(tempfile.mkdtemp(prefix="nibras_export_"))
+        path     = tmp_dir / filename
+        try:
+            # الكتابة متزامنة (Supabase/ملفات) — تُنفَّذ خارج حلقة asyncio
+            rows = await asyncio.to_thread(
+                _write_user_export, self.user_data, path, columns, fmt, compress
+            )
+            if rows == 0:
+                await status.edit_text("📋 لا يوجد بيانات للتصدير.")
+                return
+            with open(path, "rb") as f:
+                await update.message.reply_document(
+                    document=f,
+                    filename=filename,
+                    caption=f"📋 *بيانات {rows} مستخدم*",
+                    parse_mode=ParseMode.MARKDOWN,
+                )
+            await status.delete()
+        except Exception as exc:
+            logger.error(f"خطأ في admin_export: {exc}", exc_info=True)
+            await status.edit_text(f"❌ فشل التصدير: {exc}")
+        finally:
+            path.unlink(missing_ok=True)
+            tmp_dir.rmdir()
 
 
     @admin_only
@@ -2859,48 +4958,115 @@ class BotHandlers:
     @admin_only
     async def admin_cache_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
         """📦 /admin_cache — إحصائيات الكاش وإعادة ضبطه"""
-        global _hadith_cache, _cache_hits
         action = context.args[0].lower() if context.args else ""
+        if action == "refresh":
+            await self._refresh_explanation(update, context.args[1:])
+            return
         if action == "clear":
-            size = len(_hadith_cache)
-            _hadith_cache.clear()
-            _cache_hits = 0
+            target = context.args[1].lower() if len(context.args) > 1 else None
+            if target == "ai":
+                size = self.ai.response_cache.clear() if self.ai.response_cache else 0
+                await update.message.reply_text(f"✅ تم مسح كاش شروحات AI ({size} شرح).")
+                return
+            if target and target not in _caches:
+                await update.message.reply_text(f"❌ مساحة غير معروفة. المتاح: {', '.join(_caches)}, ai")
+                return
+            size = sum(c.clear() for name, c in _caches.items() if target in (None, name))
             await update.message.reply_text(f"✅ تم مسح الكاش ({size} عنصر).")
             return
-        webhook_status = "نعم" if WEBHOOK_URL else "لا (Polling)"
-        await update.message.reply_text(
-            "📦 *إحصائيات الكاش والأداء*\n\n"
-            f"🗂️ عناصر الكاش: *{len(_hadith_cache)}*/500\n"
-            f"✅ Cache hits: *{_cache_hits}*\n"
-            f"🔗 Webhook: *{webhook_status}*\n"
-            f"🛡️ Rate limit: *{RATE_LIMIT_MAX} رسالة/{RATE_LIMIT_WINDOW}ث*\n\n"
-            "لمسح الكاش: `/admin_cache clear`",
-            parse_mode=ParseMode.MARKDOWN,
+        webhook_status = "نعم" if BOT_MODE == "webhook" else "لا (Polling)"
+        lines = ["📦 *إحصائيات الكاش والأداء*\n"]
+        for name, cache in _caches.items():
+            st = cache.stats()
+            lines.append(
+                f"🗂️ *{name}:* {st['size']}/{st['maxsize']} | "
+                f"✅ {st['hits']} | ❌ {st['misses']} | "
+                f"🎯 {st['hit_rate']:.0%} | ♻️ {st['evictions'] + st['expired']}"
+            )
+        ai_cache = self.ai.response_cache
+        if ai_cache is not None:
+            state = "مفعّل" if AI_CACHE_ENABLED else "متجاوَز"
+            lines.append(
+                f"🤖 *شروحات AI ({state}):* {len(ai_cache)} | ✅ {ai_cache.hits} | ❌ {ai_cache.misses}"
+            )
+        for name, st in self.ai.router.stats().items():
+            lines.append(
+                f"🛰️ *{name}:* {st['latency']:.2f}ث | أخطاء {st['errors']:.0%} | "
+                f"فوز {st['wins']}/{st['calls']} | تحوّط بعد {st['hedge']:.1f}ث"
+            )
+        sched = self.ai.scheduler.stats()
+        lines.append(
+            f"🚦 *طابور AI:* جارٍ {sched['active']}/{sched['limit']} | منتظر {sched['queued']} "
+            f"(+{sched['background']} خلفي) | انتظار p50 {sched['wait_p50']:.1f}ث / p95 {sched['wait_p95']:.1f}ث"
+        )
+        lines.append(
+            f"   خُدم {sched['served']} | دُمج {sched['merged']} | رُفض {sched['rejected']}"
+        )
+        ctx = self.ai.context.stats()
+        lines.append(
+            f"🧮 *سياق AI:* {ctx['built']} طلب | متوسط ~{ctx['avg_sent']:.0f} توكن | وُفّر {ctx['saved']:.0%}"
+        )
+        ttft = self.ai.ttft_stats()
+        if ttft["count"]:
+            lines.append(f"⚡ *أول توكن (TTFT):* p50 {ttft['p50']:.2f}ث | p95 {ttft['p95']:.2f}ث ({ttft['count']})")
+        lines.append("")
+        lines.append("🧠 *الجلسات:*")
+        for ns, (count, size) in _session_store.stats().items():
+            lines.append(f"• {MessageFormatter.esc(ns)}: {count} | ~{size / 1024:.1f} KB")
+        persisted = "SQLite" if SESSION_DB_PATH else "ذاكرة فقط"
+        lines.append(
+            f"الإجمالي: ~{_session_store.total_bytes / 1024:.1f}/{_session_store.max_bytes / 1024:.0f} KB"
+            f" ({persisted}) | ♻️ {_session_store.evictions + _session_store.expired}"
         )
+        lines.append("")
+        lines.append(f"🔗 Webhook: *{webhook_status}*")
+        lines.append("")
+        lines.append("🛡️ *Rate limit:*")
+        for tier, limiter in _rate_limiters.items():
+            lines.append(
+                f"• {tier}: {limiter.limit}/{limiter.period:g}ث | "
+                f"محجوب: {limiter.throttled} | مستخدمون: {len(limiter)}"
+            )
+        lines.append("")
+        lines.append("لمسح الكاش: `/admin_cache clear [namespace]`")
+        lines.append("لتحديث شرح: `/admin_cache refresh [id] [simple|compare]`")
+        await update.message.reply_text("\n".join(lines), parse_mode=ParseMode.MARKDOWN)
+
+    async def _refresh_explanation(self, update: Update, args: List[str]) -> None:
+        """إعادة توليد شرح حديث متجاوزاً الكاش (bypass_cache) وتحديثه بالنتيجة"""
+        hadith = self.db.get_by_id(int(args[0])) if args and args[0].isdigit() else None
+        if not hadith:
+            await update.message.reply_text("❌ الاستخدام: `/admin_cache refresh [id] [simple|compare]`", parse_mode=ParseMode.MARKDOWN)
+            return
+        modes = [args[1].lower()] if len(args) > 1 else list(NibrasAI._EXPLAIN_PROMPTS)
+        if any(m not in NibrasAI._EXPLAIN_PROMPTS for m in modes):
+            await update.message.reply_text(f"❌ نوع غير معروف. المتاح: {', '.join(NibrasAI._EXPLAIN_PROMPTS)}")
+            return
+        status = await update.message.reply_text(f"🔄 جاري إعادة توليد شرح الحديث {hadith['id']}...")
+        failed = [
+            mode for mode in modes
+            if await self.ai.explain_hadith(update.effective_user.id, hadith, mode=mode, bypass_cache=True)
+            == self.ai._fallback()
+        ]
+        done = [m for m in modes if m not in failed]
+        text = f"✅ حُدّث شرح الحديث {hadith['id']} ({', '.join(done)})." if done else ""
+        if failed:
+            text += f"\n❌ فشل التوليد: {', '.join(failed)} — بقي الشرح المخزَّن كما هو."
+        await status.edit_text(text.strip())
 
     @admin_only
     async def admin_top_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
         """📈 /admin_top — أكثر 10 مستخدمين نشاطاً"""
-        users = self.user_data.get_all_users()
-        if not users:
+        index = self.user_data.get_activity_index()
+        if not len(index):
             await update.message.reply_text("لا يوجد مستخدمون بعد.")
             return
-        # ترتيب حسب القراءات ثم التفاعلات
-        ranked = sorted(
-            users,
-            key=lambda x: (
-                len(x[1].get("read_hadiths", [])),
-                x[1].get("interaction_count", 0)
-            ),
-            reverse=True
-        )[:10]
+        # الفهرس مرتب مسبقاً حسب القراءات ثم التفاعلات
+        ranked = index.top(10)
 
         lines = ["🏆 *أكثر 10 مستخدمين نشاطاً*\n" "ـــــــــــــــ\n"]
         medals = ["🥇", "🥈", "🥉"] + ["🏅"] * 7
-        for i, (uid, data) in enumerate(ranked):
-            reads  = len(data.get("read_hadiths", []))
-            inter  = data.get("interaction_count", 0)
-            streak = data.get("streak_count", 0)
+        for i, (uid, (reads, inter, streak, _, _)) in enumerate(ranked):
             lines.append(
                 f"{medals[i]} `{uid}`\n"
                 f"   📖 {reads}/42 قراءة  •  💬 {inter} تفاعل  •  🔥 {streak}د"
@@ -2909,31 +5075,10 @@ class BotHandlers:
 
     @admin_only
     async def admin_inactive_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-        """😴 /admin_inactive — مستخدمون غير نشطين منذ أسبوع"""
-        from datetime import timezone as dt_tz
-        now   = datetime.now(dt_tz.utc)
-        users = self.user_data.get_all_users()
-        inactive = []
-        for uid, data in users:
-            if data.get("banned"):
-                continue
-            last = data.get("streak_last_date")
-            if not last:
-                # لم يتفاعل أبداً بعد التسجيل
-                inactive.append((uid, data, 999))
-                continue
-            try:
-                last_dt = datetime.fromisoformat(last)
-                if last_dt.tzinfo is None:
-                    last_dt = last_dt.replace(tzinfo=dt_tz.utc)
-                days = (now.date() - last_dt.date()).days
-                if days >= 7:
-                    inactive.append((uid, data, days))
-            except Exception:
-                pass
-
-        inactive.sort(key=lambda x: x[2], reverse=True)
-        total = len(inactive)
+        """😴 /admin_inactive [cursor] — مستخدمون غير نشطين منذ أسبوع"""
+        cursor = int(context.args[0]) if context.args and context.args[0].isdigit() else 0
+        index  = self.user_data.get_activity_index()
+        inactive, total, next_cursor = index.inactive(min_days=7, offset=cursor, limit=15)
 
         if total == 0:
             await update.message.reply_text("✅ لا يوجد مستخدمون غير نشطين منذ أسبوع!")
@@ -2943,13 +5088,12 @@ class BotHandlers:
             f"😴 *المستخدمون غير النشطين (≥7 أيام)*\n"
             f"العدد: {total} مستخدم\nـــــــ\n"
         ]
-        for uid, data, days in inactive[:15]:
-            reads = len(data.get("read_hadiths", []))
+        for uid, days, (reads, _, _, _, _) in inactive:
             day_str = "لم يتفاعل أبداً" if days == 999 else f"منذ {days} يوم"
             lines.append(f"• `{uid}` — {day_str} — {reads}/42 قراءة")
 
-        if total > 15:
-            lines.append(f"\n_...و {total-15} آخرون_")
+        if next_cursor is not None:
+            lines.append(f"\n_...و {total - next_cursor} آخرون_ — التالي: `/admin_inactive {next_cursor}`")
 
         lines.append(
             f"\n💡 يمكنك استخدام `/admin_broadcast` لإرسال رسالة تشجيعية لهم."
@@ -2969,10 +5113,6 @@ class BotHandlers:
             return
 
         msg_text = " ".join(context.args)
-        users    = self.user_data.get_all_users()
-        total    = len(users)
-        status   = await update.message.reply_text(f"📣 جاري إرسال الإعلان لـ {total} مستخدم...")
-
         announce_text = (
             "╔══════════════════╗\n"
             "║  📣 *إعلان نبراس*  ║\n"
@@ -2981,33 +5121,7 @@ class BotHandlers:
             "─────────────────\n"
             "🌿 _فريق نبراس — الأربعون النووية_"
         )
-
-        sent = failed = blocked = 0
-        for uid, data in users:
-            if data.get("banned"):
-                continue
-            try:
-                await context.bot.send_message(
-                    chat_id=uid,
-                    text=announce_text,
-                    parse_mode=ParseMode.MARKDOWN,
-                )
-                sent += 1
-                await asyncio.sleep(0.05)
-            except Exception as e:
-                err = str(e).lower()
-                if "blocked" in err or "forbidden" in err:
-                    blocked += 1
-                else:
-                    failed += 1
-
-        await status.edit_text(
-            f"✅ *اكتمل الإعلان*\n\n"
-            f"📨 أُرسل لـ: {sent}\n"
-            f"🚫 حجبوا البوت: {blocked}\n"
-            f"❌ فشل: {failed}",
-            parse_mode=ParseMode.MARKDOWN,
-        )
+        await self._start_broadcast(update, context, kind="announce", text=announce_text)
 
     @admin_only
     async def admin_maintenance_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
@@ -3155,9 +5269,12 @@ class BotHandlers:
 
     async def button_handler(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
         query   = update.callback_query
+        user_id = update.effective_user.id
+        if not is_admin(user_id) and not check_rate_limit(user_id, "button"):
+            await query.answer("⏳ ضغطات كثيرة جداً، انتظر قليلاً.")
+            return
         await query.answer()
         data    = query.data
-        user_id = update.effective_user.id
 
         try:
             # ── الحديث ──────────────────────────────────────────────
@@ -3324,8 +5441,9 @@ class BotHandlers:
                 hadith = self.db.get_by_id(hid)
                 if hadith:
                     status   = await query.message.reply_text("💬 جاري تحضير الشرح...")
-                    prompt   = f"اشرح الحديث التالي بطريقة بسيطة:\n\n{hadith['text']}"
-                    response = await self.ai.generate_response(user_id, prompt, mode="simple", active_hadith=hadith)
+                    response = await self.ai.explain_hadith(
+                        user_id, hadith, mode="simple", on_wait=self._queue_notifier(status),
+                    )
                     kb = InlineKeyboardMarkup([[SupportSystem.get_button()]])
                     await status.edit_text(
                         f"💬 *شرح — الحديث {hid}*\n\n{self.fmt.format_response(response)}",
@@ -3497,9 +5615,7 @@ class BotHandlers:
             await query.answer("⭐ تمت الإضافة للمفضلة")
         is_fav  = self.user_data.is_favorite(user_id, hadith_id)
         has_note = self.user_data.get_note(user_id, hadith_id) is not None
-        _, new_kb = self.fmt.build_hadith_display(
-            self.db.get_by_id(hadith_id), include_actions=True, is_favorite=is_fav, has_note=has_note
-        )
+        new_kb = self.fmt.build_hadith_keyboard(hadith_id, is_favorite=is_fav, has_note=has_note)
         try:
             await query.message.edit_reply_markup(reply_markup=new_kb)
         except Exception:
@@ -3616,8 +5732,7 @@ class BotHandlers:
         if not hadith:
             return
         status   = await query.message.reply_text("💬 جاري تحضير الشرح المبسط...")
-        prompt   = f"اشرح الحديث التالي بطريقة بسيطة للأطفال والمبتدئين:\n\n{hadith['text']}"
-        response = await self.ai.generate_response(user_id, prompt, mode="simple", active_hadith=hadith)
+        response = await self.ai.explain_hadith(user_id, hadith, mode="simple", on_wait=self._queue_notifier(status))
         keyboard = InlineKeyboardMarkup([[SupportSystem.get_button()]])
         await status.edit_text(
             f"💬 *شرح مبسط — الحديث {hadith_id}*\n\n{self.fmt.format_response(response)}",
@@ -3632,8 +5747,9 @@ class BotHandlers:
             return
         try:
             status   = await query.message.reply_text("📖 جاري تحضير الشروحات...")
-            prompt   = f"قدم شرحاً مقارناً متعمقاً للحديث التالي:\n\n{hadith['text']}"
-            response = await self.ai.generate_response(user_id, prompt, mode="compare", active_hadith=hadith)
+            response = await self.ai.explain_hadith(
+                user_id, hadith, mode="compare", on_wait=self._queue_notifier(status),
+            )
             formatted = self.fmt.format_response(response)
             full      = f"📖 *شرح متعمق — الحديث {hadith_id}*\n\n{formatted}"
             keyboard  = InlineKeyboardMarkup([[SupportSystem.get_button()]])
@@ -3682,9 +5798,7 @@ class BotHandlers:
         if not question:
             await self._finish_quiz(message, user_id, is_callback=False)
             return
-        quiz    = QuizSystem.active_quizzes[user_id]
-        current = quiz["current_index"] + 1
-        total   = len(quiz["questions"])
+        current, total = QuizSystem.progress(user_id)
         emoji   = QuizSystem._TYPE_EMOJI.get(question["type"], "❓")
         text    = f"{emoji} *سؤال {current} من {total}*\n\n{question['question']}"
         buttons = []
@@ -3754,11 +5868,9 @@ class BotHandlers:
         if QuizSystem.is_active(user_id):
             await query.answer("⚠️ لديك اختبار نشط!", show_alert=True)
             return
-        questions = QuizSystem.generate_quiz(self.db, question_count=5)
-        if not questions:
+        if not QuizSystem.start(user_id, question_count=5):
             await query.answer("❌ تعذّر إنشاء الاختبار", show_alert=True)
             return
-        QuizSystem.start(user_id, questions)
         await query.message.edit_text("🎓 جاري تحضير الاختبار...")
         await self._show_quiz_question(query.message, user_id)
 
@@ -3774,7 +5886,7 @@ class BotHandlers:
             FlashcardSystem.advance(user_id, False)
             await self._show_flashcard(message, user_id)
             return
-        session = FlashcardSystem._sessions.get(user_id, {})
+        session = FlashcardSystem.get_session(user_id)
         idx   = session.get("index", 0)
         total = session.get("total", 1)
         text, kb = self.fmt.build_flashcard(hadith)
@@ -4047,172 +6159,276 @@ async def error_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> N
         logger.error(f"خطأ في معالج الأخطاء: {exc}")
 
 
+# حدود أعمدة مدرج زمن التسليم (ثوانٍ منذ موعد التذكير)
+_REMINDER_LATENCY_BUCKETS: Tuple[float, ...] = (1, 5, 15, 30, 60, 120)
+REMINDER_CONCURRENCY: int = 16
+
+
+async def dispatch_reminder_wave(
+    bot,
+    user_data_mgr,
+    hadith_db,
+    due: List[Tuple[int, str, float]],
+    limiter: TelegramRateLimiter = _telegram_limiter,
+) -> None:
+    """
+    إرسال موجة تذكيرات بمجموعة عمّال محدودة العدد
+    - الإرسال عبر محدِّد المعدل المشترك (حد عام + لكل محادثة + 429)
+    - تحميل بيانات الموجة دفعة واحدة (للقراءة فقط)
+    - تحديث last_reminder_sent لكل مستخدم على الحلقة فور نجاح الإرسال: تحميل
+      وحفظ متتاليان بلا await بينهما، فلا يكتب فوق تعديل معالج آخر لنفس المستخدم
+    - تسجيل مدرج زمن التسليم مقارنةً بموعد التذكير
+    """
+    from datetime import timezone as dt_timezone
+    loaded = await asyncio.to_thread(
+        user_data_mgr.load_many, sorted({uid for uid, kind, _ in due if kind == "morning"})
+    )
+    total     = len(hadith_db)
+    queue: asyncio.Queue = asyncio.Queue()
+    for item in due:
+        queue.put_nowait(item)
+    failed:    List[Tuple[int, str, float]] = []
+    latencies: List[float] = []
+    counts = {"sent": 0, "blocked": 0, "failed": 0}
+
+    async def worker() -> None:
+        while True:
+            try:
+                user_id, kind, fire_ts = queue.get_nowait()
+            except asyncio.QueueEmpty:
+                return
+            try:
+                # ── التذكير الصباحي ──
+                if kind == "morning":
+                    read      = set(loaded.get(user_id, {}).get("read_hadiths", []))
+                    unread    = [i for i in range(1, total + 1) if i not in read]
+                    hadith_id = random.choice(unread) if unread else random.randint(1, total)
+                    hadith    = hadith_db.get_by_id(hadith_id)
+                    text      = ReminderSystem.build_message(hadith, len(unread)) if hadith else None
+                # ── التذكير المسائي ──
+                else:
+                    hadith = hadith_db.get_random()
+                    text   = ReminderSystem.build_evening_message(hadith) if hadith else None
+                if not text:
+                    continue
+                status = await limiter.send(bot, user_id, text, parse_mode=ParseMode.MARKDOWN)
+                counts[status] += 1
+                if status == "sent":
+                    user_data_mgr.update_last_reminder_sent(user_id, evening=kind == "evening")
+                    latencies.append(datetime.now(dt_timezone.utc).timestamp() - fire_ts)
+                elif status == "failed":
+                    failed.append((user_id, kind, fire_ts))
+            except Exception as exc:
+                counts["failed"] += 1
+                failed.append((user_id, kind, fire_ts))
+                logger.error(f"خطأ تذكير {user_id}: {exc}")
+
+    await asyncio.gather(*(worker() for _ in range(min(REMINDER_CONCURRENCY, len(due)))))
+    # الفشل المؤقت لا يؤجل المستخدم لليوم التالي: محاولة أخرى داخل النافذة
+    now = datetime.now(dt_timezone.utc)
+    retried = sum(user_data_mgr.reminder_scheduler.retry(uid, kind, ts, now) for uid, kind, ts in failed)
+
+    hist = [0] * (len(_REMINDER_LATENCY_BUCKETS) + 1)
+    for lat in latencies:
+        hist[bisect.bisect_left(_REMINDER_LATENCY_BUCKETS, lat)] += 1
+    labels = [f"≤{b:g}s" for b in _REMINDER_LATENCY_BUCKETS] + [f">{_REMINDER_LATENCY_BUCKETS[-1]:g}s"]
+    latencies.sort()
+    p50 = latencies[len(latencies) // 2] if latencies else 0.0
+    p95 = latencies[int(len(latencies) * 0.95)] if latencies else 0.0
+    logger.info(
+        f"📨 موجة تذكير: {counts['sent']} أُرسل | {counts['blocked']} محظور | {counts['failed']} فشل"
+        f" ({retried} يُعاد)"
+        f" | p50={p50:.1f}s p95={p95:.1f}s | "
+        + " ".join(f"{l}:{n}" for l, n in zip(labels, hist) if n)
+    )
+
+
 async def reminder_loop(bot, user_data_mgr, hadith_db) -> None:
-    """حلقة التذكير اليومي — تعمل في خلفية asyncio كل 60 ثانية"""
+    """حلقة التذكير اليومي — تستيقظ عند أقرب تذكير مستحق وترسل المستحقين كموجة"""
+    from datetime import timezone as dt_timezone
     logger.info("⏰ حلقة التذكير بدأت")
+    scheduler = user_data_mgr.reminder_scheduler
+    waves: set = set()
+    try:
+        scheduler.rebuild(await asyncio.to_thread(user_data_mgr.get_all_users_with_reminders))
+    except Exception as exc:
+        logger.error(f"خطأ في بناء جدولة التذكير: {exc}")
     while True:
         try:
-            await asyncio.sleep(55)  # 55 ثانية لتغطية أي تأخير
-            users = user_data_mgr.get_all_users_with_reminders()
-            logger.debug(f"⏰ التذكير: فحص {len(users)} مستخدم")
-            # ✅ إصلاح: استخدام UTC timezone-aware بدل naive datetime
-            from datetime import timezone as dt_timezone
-            now = datetime.now(dt_timezone.utc)
-            for user_id, settings in users:
-                tz_str = settings.get("timezone", DEFAULT_TIMEZONE)
-                try:
-                    tz     = ZoneInfo(tz_str)
-                    now_tz = now.astimezone(tz)
-                    cur_min = now_tz.hour * 60 + now_tz.minute
-
-                    # ── التذكير الصباحي ──
-                    time_str = settings.get("time", DEFAULT_REMINDER_TIME)
-                    rem_time = ReminderSystem.parse_time(time_str)
-                    if rem_time:
-                        rem_min = rem_time.hour * 60 + rem_time.minute
-                        # ✅ إصلاح: توسيع النافذة من 2 إلى 3 دقائق لتفادي التفويت
-                        if abs(cur_min - rem_min) < 5 and ReminderSystem.should_send(settings.get("last_sent"), tz_str):
-                            unread    = user_data_mgr.get_unread_hadiths(user_id, len(hadith_db))
-                            hadith_id = random.choice(unread) if unread else random.randint(1, len(hadith_db))
-                            hadith    = hadith_db.get_by_id(hadith_id)
-                            if hadith:
-                                await bot.send_message(
-                                    chat_id=user_id,
-                                    text=ReminderSystem.build_message(hadith, len(unread)),
-                                    parse_mode=ParseMode.MARKDOWN,
-                                )
-                                user_data_mgr.update_last_reminder_sent(user_id, evening=False)
-                                logger.info(f"📨 تذكير صباحي → {user_id}")
-
-                    # ── التذكير المسائي ──
-                    evening_str = settings.get("time_evening")
-                    if evening_str:
-                        ev_time = ReminderSystem.parse_time(evening_str)
-                        if ev_time:
-                            ev_min = ev_time.hour * 60 + ev_time.minute
-                            # ✅ إصلاح: توسيع النافذة من 2 إلى 3 دقائق
-                            if abs(cur_min - ev_min) < 5 and ReminderSystem.should_send(settings.get("last_evening"), tz_str):
-                                hadith = hadith_db.get_random()
-                                if hadith:
-                                    await bot.send_message(
-                                        chat_id=user_id,
-                                        text=ReminderSystem.build_evening_message(hadith),
-                                        parse_mode=ParseMode.MARKDOWN,
-                                    )
-                                    user_data_mgr.update_last_reminder_sent(user_id, evening=True)
-                                    logger.info(f"🌙 تذكير مسائي → {user_id}")
-                except Exception as exc:
-                    logger.error(f"خطأ تذكير {user_id}: {exc}")
+            await asyncio.sleep(scheduler.seconds_until_next(datetime.now(dt_timezone.utc)))
+            due = scheduler.pop_due(datetime.now(dt_timezone.utc))
+            if due:
+                # الموجة تعمل في الخلفية حتى لا تتأخر الموجة التالية
+                task = asyncio.create_task(dispatch_reminder_wave(bot, user_data_mgr, hadith_db, due))
+                waves.add(task)
+                task.add_done_callback(waves.discard)
         except asyncio.CancelledError:
+            for task in waves:
+                task.cancel()
             logger.info("⏰ حلقة التذكير أُوقفت")
             break
         except Exception as exc:
             logger.error(f"خطأ في حلقة التذكير: {exc}")
 
 
-async def _run_bot() -> None:
-    """تشغيل البوت مع حلقة التذكير في asyncio"""
-    validate_configuration()
-
-    logger.info("🔧 جاري تهيئة المكونات...")
-    hadith_db     = HadithDatabase(HADITH_FILE_PATH)
-    user_data_mgr = UserDataManager(USER_DATA_PATH)
-    memory        = ConversationMemory()
-    formatter     = MessageFormatter()
-    ai_engine     = NibrasAI(OPENROUTER_API_KEY, GOOGLE_API_KEY, memory)
-    handlers      = BotHandlers(hadith_db, user_data_mgr, ai_engine, formatter)
-
-    logger.info("🤖 جاري بناء البوت...")
-    app = ApplicationBuilder().token(TELEGRAM_TOKEN).build()
-
-    # ── تسجيل الأوامر ──
-    for cmd, fn in [
-        ("start",       handlers.start_command),
-        ("help",        handlers.help_command),
-        ("list",        handlers.list_command),
-        ("random",      handlers.random_command),
-        ("search",      handlers.search_command),
-        ("topics",      handlers.topics_command),
-        ("stats",       handlers.stats_command),
-        ("badges",      handlers.badges_command),
-        ("favorites",   handlers.favorites_command),
-        ("review",      handlers.review_command),
-        ("daily",       handlers.daily_command),
-        ("quiz",        handlers.quiz_command),
-        ("cancel_quiz", handlers.cancel_quiz_command),
-        ("flashcard",   handlers.flashcard_command),
-        ("selftest",    handlers.selftest_command),
-        ("plan",        handlers.plan_command),
-        ("note",        handlers.note_command),
-        ("feedback",    handlers.feedback_command),
-        ("reminder",    handlers.reminder_command),
-        ("cancel",      handlers.cancel_command),
-        # ── أوامر المشرف (مخفية) ──
-        ("admin_help",      handlers.admin_help_command),
-        ("admin_stats",     handlers.admin_stats_command),
-        ("admin_broadcast", handlers.admin_broadcast_command),
-        ("admin_ban",       handlers.admin_ban_command),
-        ("admin_unban",     handlers.admin_unban_command),
-        ("admin_export",    handlers.admin_export_command),
-        ("admin_user",      handlers.admin_user_command),
-        ("admin_top",        handlers.admin_top_command),
-        ("admin_inactive",   handlers.admin_inactive_command),
-        ("admin_announce",   handlers.admin_announce_command),
-        ("admin_maintenance",handlers.admin_maintenance_command),
-        ("admin_cache",          handlers.admin_cache_command),
-        ("admin_test_reminder",  handlers.admin_test_reminder_command),
-    ]:
-        app.add_handler(CommandHandler(cmd, fn))
-
-    app.add_handler(CallbackQueryHandler(handlers.button_handler))
-    app.add_handler(MessageHandler(filters.ALL, handlers.message_handler))
-    app.add_error_handler(error_handler)
-
-    print("\n" + "=" * 65)
-    print("🌟 بوت نبراس v3 — معلم الأربعين النووية")
-    print("=" * 65)
-    print(f"✅ يعمل بنجاح! | 📚 الأحاديث: {len(hadith_db)}")
-    print(f"🏷️ التصنيفات: {len(hadith_db.get_categories())}")
-    print("🆕 الميزات: بطاقة الراوي | الترجمة | البطاقات | الشارات | الموضوعات")
-    print("⏸️  اضغط Ctrl+C للإيقاف")
-    print("=" * 65 + "\n")
-    logger.info(f"🚀 نبراس v3 يعمل | {len(hadith_db)} حديث")
-
-    # ── تشغيل حلقة التذكير و البوت معاً ──
-    # Render Free يعمل مع Polling بشكل مستقر
-    # Webhook يحتاج إعداد SSL منفصل — يُفعَّل لاحقاً
-    use_webhook = False  # WEBHOOK_URL موجود للمستقبل فقط
-
-    async with app:
-        await app.start()
-
-        # ── Polling (مستقر على Render) ──
-        logger.info("📡 تشغيل Polling")
-        await app.updater.start_polling(
-            allowed_updates=Update.ALL_TYPES,
-            drop_pending_updates=True,
+class BotService:
+    """
+    دورة حياة البوت كاملة: المكونات + Application + المهام الخلفية
+    - Polling: _run_bot() في عملية مستقلة
+    - Webhook: main.py ينشئه داخل lifespan في نفس حلقة الأحداث ويمرّر
+      التحديثات الواردة عبر feed_update، ومعه سجلات الأحاديث التي قرأها
+      (hadith_records) فلا يُقرأ الملف مرة ثانية
+    """
+
+    def __init__(self, webhook: bool = False, hadith_records: Optional[List[Dict[str, Any]]] = None) -> None:
+        validate_configuration()
+        self.webhook = webhook
+
+        logger.info("🔧 جاري تهيئة المكونات...")
+        self.db       = HadithDatabase(HADITH_FILE_PATH, records=hadith_records)
+        MessageFormatter.prerender(self.db.get_all())
+        QuizSystem.hadith_db = self.db
+        self.users    = UserDataManager(USER_DATA_PATH)
+        # فهارس /admin_top و /admin_inactive — قراءة كاملة واحدة عند الإقلاع
+        self.users.get_activity_index()
+        self.ai       = NibrasAI(
+            OPENROUTER_API_KEY, GOOGLE_API_KEY, ConversationMemory(),
+            response_cache=AIResponseCache(USER_DATA_PATH / "ai_cache.sqlite"),
         )
-        print("📡 Polling mode")
+        self.handlers = BotHandlers(self.db, self.users, self.ai, MessageFormatter())
+        if self.handlers.broadcasts.pending_job():
+            logger.warning("📢 يوجد بث متوقف لم يكتمل — استخدم /admin_broadcast_resume")
+
+        logger.info("🤖 جاري بناء البوت...")
+        self.app    = self._build_application()
+        self._tasks: List[asyncio.Task] = []
+
+    def _build_application(self):
+        builder = ApplicationBuilder().token(TELEGRAM_TOKEN)
+        if self.webhook:
+            builder = builder.updater(None)   # التحديثات تأتي من FastAPI لا من getUpdates
+        app      = builder.build()
+        handlers = self.handlers
+
+        # ── تسجيل الأوامر ──
+        for cmd, fn in [
+            ("start",       handlers.start_command),
+            ("help",        handlers.help_command),
+            ("list",        handlers.list_command),
+            ("random",      handlers.random_command),
+            ("search",      handlers.search_command),
+            ("topics",      handlers.topics_command),
+            ("stats",       handlers.stats_command),
+            ("badges",      handlers.badges_command),
+            ("favorites",   handlers.favorites_command),
+            ("review",      handlers.review_command),
+            ("daily",       handlers.daily_command),
+            ("quiz",        handlers.quiz_command),
+            ("cancel_quiz", handlers.cancel_quiz_command),
+            ("flashcard",   handlers.flashcard_command),
+            ("selftest",    handlers.selftest_command),
+            ("plan",        handlers.plan_command),
+            ("note",        handlers.note_command),
+            ("feedback",    handlers.feedback_command),
+            ("reminder",    handlers.reminder_command),
+            ("cancel",      handlers.cancel_command),
+            # ── أوامر المشرف (مخفية) ──
+            ("admin_help",      handlers.admin_help_command),
+            ("admin_stats",     handlers.admin_stats_command),
+            ("admin_broadcast", handlers.admin_broadcast_command),
+            ("admin_broadcast_resume", handlers.admin_broadcast_resume_command),
+            ("admin_ban",       handlers.admin_ban_command),
+            ("admin_unban",     handlers.admin_unban_command),
+            ("admin_export",    handlers.admin_export_command),
+            ("admin_user",      handlers.admin_user_command),
+            ("admin_top",        handlers.admin_top_command),
+            ("admin_inactive",   handlers.admin_inactive_command),
+            ("admin_announce",   handlers.admin_announce_command),
+            ("admin_maintenance",handlers.admin_maintenance_command),
+            ("admin_cache",          handlers.admin_cache_command),
+            ("admin_test_reminder",  handlers.admin_test_reminder_command),
+        ]:
+            app.add_handler(CommandHandler(cmd, fn))
+
+        app.add_handler(CallbackQueryHandler(handlers.button_handler))
+        app.add_handler(MessageHandler(filters.ALL, handlers.message_handler))
+        app.add_error_handler(error_handler)
+
+        return app
+
+    async def start(self) -> None:
+        await self.app.initialize()
+        await self.app.start()
+        if self.webhook:
+            if WEBHOOK_URL:
+                await self.app.bot.set_webhook(
+                    url=WEBHOOK_URL + WEBHOOK_PATH,
+                    secret_token=WEBHOOK_SECRET,
+                    allowed_updates=Update.ALL_TYPES,
+                    drop_pending_updates=True,
+                )
+                logger.info(f"🔗 Webhook: {WEBHOOK_URL}{WEBHOOK_PATH}")
+            else:
+                # تجربة محلية: أرسل تحديثات مسجّلة إلى WEBHOOK_PATH بنفسك
+                logger.warning("⚠️ WEBHOOK_URL غير مُعيَّن — لم يُسجَّل الـ webhook لدى Telegram")
+        else:
+            logger.info("📡 تشغيل Polling")
+            await self.app.updater.start_polling(
+                allowed_updates=Update.ALL_TYPES,
+                drop_pending_updates=True,
+            )
+
+        print("\n" + "=" * 65)
+        print("🌟 بوت نبراس v3 — معلم الأربعين النووية")
+        print("=" * 65)
+        print(f"✅ يعمل بنجاح! | 📚 الأحاديث: {len(self.db)}")
+        print(f"🏷️ التصنيفات: {len(self.db.get_categories())}")
+        print("🆕 الميزات: بطاقة الراوي | الترجمة | البطاقات | الشارات | الموضوعات")
+        print("⏸️  اضغط Ctrl+C للإيقاف")
+        print("=" * 65 + "\n")
+        logger.info(f"🚀 نبراس v3 يعمل | {len(self.db)} حديث")
 
         # شغّل حلقة التذكير في الخلفية
-        reminder_task = asyncio.create_task(
-            reminder_loop(app.bot, user_data_mgr, hadith_db)
-        )
-        try:
-            await asyncio.Event().wait()
-        except (KeyboardInterrupt, asyncio.CancelledError):
-            pass
-        finally:
-            reminder_task.cancel()
-            try:
-                await reminder_task
-            except asyncio.CancelledError:
-                pass
-            await app.updater.stop()
-            await app.stop()
+        self._tasks.append(asyncio.create_task(reminder_loop(self.app.bot, self.users, self.db)))
+        # تعبئة كاش الشروحات الثابتة في الخلفية
+        if AI_CACHE_PREWARM:
+            self._tasks.append(asyncio.create_task(self.ai.prewarm(self.db.get_all())))
+
+    def check_secret(self, token: Optional[str]) -> bool:
+        return hmac.compare_digest((token or "").encode(), WEBHOOK_SECRET.encode())
+
+    async def feed_update(self, payload: Dict[str, Any]) -> None:
+        """تحديث وارد من الـ webhook — يُعالَج في الخلفية بنفس طابور Polling"""
+        await self.app.update_queue.put(Update.de_json(payload, self.app.bot))
+
+    async def stop(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        if self.app.updater and self.app.updater.running:
+            await self.app.updater.stop()
+        await self.app.stop()
+        await self.app.shutdown()
+        await self.ai.aclose()
+        _session_store.flush()
+
+
+async def _run_bot() -> None:
+    """تشغيل البوت بوضع Polling مع حلقة التذكير في asyncio"""
+    service = BotService()
+    await service.start()
+    try:
+        await asyncio.Event().wait()
+    except (KeyboardInterrupt, asyncio.CancelledError):
+        pass
+    finally:
+        await service.stop()
 
 
 def main() -> None:
+    if BOT_MODE == "webhook":
+        logger.info("🔗 BOT_MODE=webhook — البوت يعمل داخل تطبيق FastAPI (main.py)")
+        return
     try:
         asyncio.run(_run_bot())
     except KeyboardInterrupt:
@@ -2,7 +2,7 @@
 إعدادات التطبيق - متوافقة مع pydantic-settings 2.7.1
 """
 
-from pydantic import Field
+from pydantic import Field, field_validator
 from pydantic_settings import BaseSettings, SettingsConfigDict
 from typing import Optional
 
@@ -28,6 +28,9 @@ class Settings(BaseSettings):
 
     # Rate Limiting
     rate_limit_per_minute: int = 60
+    # memory:// لكل عملية على حدة | redis://host:6379 عدادات مشتركة بين كل الـ workers
+    rate_limit_storage_uri: str = "memory://"
+    rate_limit_strategy: str = "sliding-window-counter"
 
     # Cache
     cache_enabled: bool = True
@@ -44,6 +47,8 @@ class Settings(BaseSettings):
 
     # Telegram Bot (اختياري)
     telegram_bot_token: Optional[str] = None
+    # polling: bot.py عملية مستقلة | webhook: البوت يعمل داخل هذا التطبيق
+    bot_mode: str = "polling"
 
     # Google AdSense
     adsense_enabled: bool = False
@@ -75,5 +80,10 @@ class Settings(BaseSettings):
         extra="ignore",  # تجاهل الحقول غير المعرّفة في .env
     )
 
+    @field_validator("bot_mode")
+    @classmethod
+    def normalize_bot_mode(cls, v: str) -> str:
+        return v.strip().lower()
+
 
 settings = Settings()
@@ -0,0 +1,67 @@
+"""
+إعدادات gunicorn للإنتاج — عدة workers بذاكرة مشتركة
+======================================================
+preload_app: العملية الأم تحمّل main.py مرة واحدة (الأحاديث + الفهارس + القوالب
+المجمّعة) ثم تتفرع، فتتشارك الـ workers هذه الصفحات (copy-on-write) بدل أن يعيد
+كل worker قراءة JSON وبناء HADITHS_DATA / HADITHS_INDEX.
+
+التشغيل:  gunicorn main:app -c gunicorn.conf.py
+"""
+
+import gc
+import os
+
+from config import settings
+
+
+def _available_cores() -> int:
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+# ── العمال ──────────────────────────────────────────────────
+# الـ workers غير متزامنة (uvicorn) فعامل واحد لكل نواة يكفي؛ WEB_CONCURRENCY يتجاوز ذلك
+workers = int(os.getenv("WEB_CONCURRENCY", str(min(_available_cores(), 4))))
+# settings تقرأ .env أيضاً — نفس المصدر الذي يقرأ منه main.py وضع البوت
+if settings.bot_mode == "webhook" and workers > 1:
+    # البوت يعمل داخل worker واحد فقط — تحديثات Telegram يجب أن تصل إليه
+    workers = 1
+worker_class = "uvicorn.workers.UvicornWorker"
+preload_app  = True
+
+bind      = f"0.0.0.0:{os.getenv('PORT', '10000')}"
+timeout   = 60
+keepalive = 5
+graceful_timeout = 20
+accesslog = "-"
+
+
+def when_ready(server):
+    """في العملية الأم بعد تحميل التطبيق وقبل التفرع"""
+    import main
+    # العدد الفعلي بعد خيارات سطر الأوامر (-w) — يرثه كل worker ويتحقق منه lifespan
+    os.environ["WEB_WORKERS"] = str(server.cfg.workers)
+    compiled = main.preload_templates()
+    # نقل كل الكائنات الحالية إلى جيل دائم: جامع القمامة في الـ workers لن يلمسها
+    # فلا تُنسخ صفحاتها المشتركة بلا داعٍ
+    gc.freeze()
+    server.log.info(
+        f"📦 preload: {len(main.HADITHS_DATA)} حديث | {compiled} قالب | "
+        f"{gc.get_freeze_count()} كائن مجمَّد | {server.cfg.workers} worker"
+    )
+
+
+def post_worker_init(worker):
+    """تقرير ذاكرة كل worker: RSS يشمل الصفحات المشتركة، USS = الخاص بالعامل فقط"""
+    try:
+        import psutil
+        mem = psutil.Process(worker.pid).memory_full_info()
+        pss = getattr(mem, "pss", 0)
+        worker.log.info(
+            f"🧠 worker {worker.pid}: RSS {mem.rss / 2**20:.1f}MB | "
+            f"USS {mem.uss / 2**20:.1f}MB | PSS {pss / 2**20:.1f}MB"
+        )
+    except Exception as exc:
+        worker.log.debug(f"memory report unavailable: {exc}")
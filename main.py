@@ -12,21 +12,31 @@
 - معالجة شاملة واحترافية للأخطاء
 """
 
+import asyncio
 import json
 import os
+import gzip
+import hashlib
+import mimetypes
 import random
 import logging
 import traceback
+from collections import OrderedDict
 from contextlib import asynccontextmanager
-from datetime import datetime
-from typing import Optional, List, Dict, Any
+from datetime import datetime, timezone
+from email.utils import format_datetime, parsedate_to_datetime
+from functools import lru_cache
+from pathlib import Path
+from typing import Optional, List, Dict, Any, Iterable
+from urllib.parse import urlencode
 
 from fastapi import FastAPI, Request, HTTPException, status
 from fastapi.templating import Jinja2Templates
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, Response
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.middleware.gzip import GZipMiddleware
+from starlette.routing import Match
 
 from slowapi import Limiter, _rate_limit_exceeded_handler
 from slowapi.util import get_remote_address
@@ -34,6 +44,17 @@ from slowapi.errors import RateLimitExceeded
 
 from pydantic import BaseModel, EmailStr, Field, field_validator
 
+try:
+    import orjson
+    _ORJSON_AVAILABLE = True
+except ImportError:
+    _ORJSON_AVAILABLE = False
+try:
+    import brotli
+    _BROTLI_AVAILABLE = True
+except ImportError:
+    _BROTLI_AVAILABLE = False
+
 from config import settings
 from supabase_service import SupabaseService
 from email_service import EmailService
@@ -50,17 +71,34 @@ logging.basicConfig(
 logger = logging.getLogger("hadith_app")
 
 
+def dumps_json(obj: Any) -> bytes:
+    """JSON مضغوط بلا مسافات — orjson إن توفر (نفس مخرجات JSONResponse)"""
+    if _ORJSON_AVAILABLE:
+        return orjson.dumps(obj)
+    return json.dumps(obj, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
 # ============================================
 # RATE LIMITER SETUP
 # ============================================
-limiter = Limiter(key_func=get_remote_address, default_limits=["200/minute"])
+# التخزين قابل للتبديل عبر RATE_LIMIT_STORAGE_URI: مع عدة workers يجب أن يكون
+# مشتركاً (Redis) وإلا يُضاعَف الحد الفعلي بعدد العمليات
+limiter = Limiter(
+    key_func=get_remote_address,
+    default_limits=["200/minute"],
+    storage_uri=settings.rate_limit_storage_uri,
+    strategy=settings.rate_limit_strategy,
+)
 
 
 # ============================================
 # DATA LOADING
 # ============================================
-def load_hadiths() -> List[Dict]:
-    """تحميل بيانات الأحاديث من nawawi40_structured.json"""
+def read_hadith_records() -> List[Dict]:
+    """
+    قراءة السجلات الخام من nawawi40_structured.json — مرة واحدة للعملية كلها:
+    load_hadiths يبني منها صيغة الموقع، والبوت (وضع Webhook) يبني منها HadithDatabase
+    """
     possible_paths = [
         "nawawi40_structured.json",
         "./nawawi40_structured.json",
@@ -82,62 +120,10 @@ def load_hadiths() -> List[Dict]:
 
     try:
         with open(file_path, "r", encoding="utf-8") as f:
-            enriched_data = json.load(f)
-            hadiths_raw = enriched_data.get("hadiths", [])
-            
-            if not hadiths_raw:
-                logger.warning(f"⚠️ ملف {file_path} لا يحتوي على أحاديث!")
-                return []
-            
-            # استخراج الراوي من النص العربي
-            import re as _re
-            def extract_narrator(arabic_text):
-                m = _re.match(r'^عَنْ (.+?)(?:\s+رَضِيَ|\s+قَالَ|\s+أَنَّهُ|\s+أَنَّ)', arabic_text)
-                if m: return m.group(1).strip()
-                m2 = _re.match(r'^عن (.+?)(?:\s+رضي|\s+قال|\s+أنه|\s+أن)', arabic_text)
-                if m2: return m2.group(1).strip()
-                return ""
-
-            # تحويل البيانات إلى الصيغة المستخدمة في المشروع
-            data = []
-            for h in hadiths_raw:
-                hid = h.get("idInBook", h.get("id"))
-                arabic_text = h.get("arabic", "")
-                
-                # استخراج اسم الراوي - في الملف الجديد narrator هو dict
-                narrator_raw = h.get("narrator", "")
-                if isinstance(narrator_raw, dict):
-                    narrator_name = narrator_raw.get("arabic", "")
-                else:
-                    narrator_name = extract_narrator(arabic_text) or narrator_raw
-
-                # استخراج المصدر - في الملف الجديد source هو dict
-                source_raw = h.get("source", {})
-                if isinstance(source_raw, dict):
-                    source_text = source_raw.get("grade_arabic", "الأربعون النووية")
-                else:
-                    source_text = source_raw or "الأربعون النووية"
-
-                data.append({
-                    "id":              hid,
-                    "title":           h.get("arabic_title", f"الحديث {hid}"),
-                    "narrator":        narrator_name,
-                    "_raw_narrator":   narrator_raw if isinstance(narrator_raw, dict) else {},
-                    "narrator_dict":   narrator_raw if isinstance(narrator_raw, dict) else {},
-                    "source_dict":     source_raw if isinstance(source_raw, dict) else {},
-                    "text":            arabic_text,
-                    "source":          source_text,
-                    "arabic_hadith_text_plain": h.get("arabic_hadith_text_plain", ""),
-                    "vocabulary":      h.get("vocabulary", []),
-                    "benefits":        h.get("benefits", []),
-                    "topics":          h.get("topics", {}),
-                    "hadith_type":     h.get("hadith_type", ""),
-                    "related_hadiths": h.get("related_hadiths", []),
-                })
-            
-            logger.info(f"✅ تم تحميل {len(data)} حديث بنجاح من {file_path}")
-            return data
-            
+            hadiths_raw = json.load(f).get("hadiths", [])
+        if not hadiths_raw:
+            logger.warning(f"⚠️ ملف {file_path} لا يحتوي على أحاديث!")
+        return hadiths_raw
     except json.JSONDecodeError as e:
         logger.error(f"❌ خطأ في صيغة JSON في السطر {e.lineno}: {e.msg}")
         logger.error(f"الموضع: {e.pos}")
@@ -149,13 +135,69 @@ def load_hadiths() -> List[Dict]:
     except OSError as e:
         logger.error(f"❌ خطأ في قراءة الملف: {e}")
         return []
+
+
+def load_hadiths(hadiths_raw: List[Dict]) -> List[Dict]:
+    """تحويل السجلات الخام إلى الصيغة المستخدمة في الموقع"""
+    try:
+        # استخراج الراوي من النص العربي
+        import re as _re
+        def extract_narrator(arabic_text):
+            m = _re.match(r'^عَنْ (.+?)(?:\s+رَضِيَ|\s+قَالَ|\s+أَنَّهُ|\s+أَنَّ)', arabic_text)
+            if m: return m.group(1).strip()
+            m2 = _re.match(r'^عن (.+?)(?:\s+رضي|\s+قال|\s+أنه|\s+أن)', arabic_text)
+            if m2: return m2.group(1).strip()
+            return ""
+
+        # تحويل البيانات إلى الصيغة المستخدمة في المشروع
+        data = []
+        for h in hadiths_raw:
+            hid = h.get("idInBook", h.get("id"))
+            arabic_text = h.get("arabic", "")
+            
+            # استخراج اسم الراوي - في الملف الجديد narrator هو dict
+            narrator_raw = h.get("narrator", "")
+            if isinstance(narrator_raw, dict):
+                narrator_name = narrator_raw.get("arabic", "")
+            else:
+                narrator_name = extract_narrator(arabic_text) or narrator_raw
+
+            # استخراج المصدر - في الملف الجديد source هو dict
+            source_raw = h.get("source", {})
+            if isinstance(source_raw, dict):
+                source_text = source_raw.get("grade_arabic", "الأربعون النووية")
+            else:
+                source_text = source_raw or "الأربعون النووية"
+
+            data.append({
+                "id":              hid,
+                "title":           h.get("arabic_title", f"الحديث {hid}"),
+                "narrator":        narrator_name,
+                "_raw_narrator":   narrator_raw if isinstance(narrator_raw, dict) else {},
+                "narrator_dict":   narrator_raw if isinstance(narrator_raw, dict) else {},
+                "source_dict":     source_raw if isinstance(source_raw, dict) else {},
+                "text":            arabic_text,
+                "source":          source_text,
+                "arabic_hadith_text_plain": h.get("arabic_hadith_text_plain", ""),
+                "vocabulary":      h.get("vocabulary", []),
+                "benefits":        h.get("benefits", []),
+                "topics":          h.get("topics", {}),
+                "hadith_type":     h.get("hadith_type", ""),
+                "related_hadiths": h.get("related_hadiths", []),
+            })
+        
+        logger.info(f"✅ تم تحميل {len(data)} حديث بنجاح")
+        return data
+            
     except Exception as e:
         logger.error(f"❌ خطأ غير متوقع: {e}")
         logger.error(traceback.format_exc())
         return []
 
 
-HADITHS_DATA: List[Dict] = load_hadiths()
+# لقطة واحدة للأحاديث في العملية — يشترك فيها الموقع والبوت (BotService(hadith_records=...))
+HADITHS_RAW: List[Dict] = read_hadith_records()
+HADITHS_DATA: List[Dict] = load_hadiths(HADITHS_RAW)
 HADITHS_INDEX: Dict[int, Dict] = {h["id"]: h for h in HADITHS_DATA}
 
 # ============================================
@@ -163,6 +205,7 @@ HADITHS_INDEX: Dict[int, Dict] = {h["id"]: h for h in HADITHS_DATA}
 # ============================================
 supabase_service: Optional[SupabaseService] = None
 email_service: Optional[EmailService] = None
+bot_service = None  # BotService عند BOT_MODE=webhook
 
 
 # ============================================
@@ -171,7 +214,7 @@ email_service: Optional[EmailService] = None
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     """إدارة دورة حياة التطبيق بدلاً من @app.on_event"""
-    global supabase_service, email_service
+    global supabase_service, email_service, bot_service
 
     # ──── Startup ────
     logger.info("=" * 60)
@@ -207,12 +250,29 @@ async def lifespan(app: FastAPI):
     else:
         logger.warning("⚠️ RESEND_API_KEY أو CONTACT_EMAIL_TO غير مُعيَّن - نموذج التواصل معطّل")
 
-    logger.info("🤖 Telegram Bot: @NibrasNawawi_bot")
+    # تشغيل البوت داخل نفس العملية وحلقة الأحداث (بدل عملية Polling منفصلة)
+    web_workers = int(os.getenv("WEB_WORKERS", "1"))
+    if settings.bot_mode == "webhook" and web_workers > 1:
+        # كل worker سيشغّل بوتاً: set_webhook متكرر وتذكيرات وبث مكرر لكل عامل
+        logger.error(f"❌ وضع Webhook يتطلب worker واحداً (الحالي {web_workers}) — البوت لن يعمل")
+    elif settings.bot_mode == "webhook":
+        try:
+            from bot import BotService
+            bot_service = BotService(webhook=True, hadith_records=HADITHS_RAW)
+            await bot_service.start()
+            logger.info("🤖 Telegram Bot: @NibrasNawawi_bot (Webhook)")
+        except Exception as e:
+            logger.error(f"❌ فشل تشغيل البوت بوضع Webhook: {e}")
+            bot_service = None
+    else:
+        logger.info("🤖 Telegram Bot: @NibrasNawawi_bot")
     logger.info("=" * 60)
 
     yield  # التطبيق يعمل هنا
 
     # ──── Shutdown ────
+    if bot_service is not None:
+        await bot_service.stop()
     logger.info("=" * 60)
     logger.info("👋 إيقاف التطبيق بشكل نظيف...")
     logger.info("=" * 60)
@@ -237,6 +297,240 @@ app.add_exception_handler(RateLimitExceeded, _rate_limit_exceeded_handler)
 # ============================================
 # MIDDLEWARE
 # ============================================
+app.add_middleware(GZipMiddleware, minimum_size=1000)
+
+
+# ── التخزين الشرطي (ETag / Last-Modified / Cache-Control) ──
+# المحتوى لا يتغير إلا مع النشر: ETag = نسخة المحتوى + الرابط، فيُجاب If-None-Match
+# بـ 304 قبل أي عرض قالب أو تسلسل. (مسار البادئة، Cache-Control، ETag؟)
+_CACHE_POLICIES = [
+    ("/api/hadiths/random", "no-store", False),
+    ("/api/quiz/bundle",    "public, max-age=300, stale-while-revalidate=86400", True),
+    ("/api/quiz",           "no-store", False),
+    ("/quiz/start",         "public, no-cache", True),
+    ("/api/hadiths",        "public, max-age=300, stale-while-revalidate=86400", True),
+    ("/api/search",         "public, max-age=300, stale-while-revalidate=86400", True),
+    ("/api/hadith/",        "public, max-age=300, stale-while-revalidate=86400", True),
+    ("/api/corpus",         "public, max-age=3600, stale-while-revalidate=86400", True),
+    ("/narrators",          "public, max-age=3600", True),
+    ("/narrator/",          "public, max-age=3600", True),
+    ("/sitemap.xml",        "public, max-age=3600", True),
+    ("/robots.txt",         "public, max-age=86400", True),
+]
+# صفحات ثابتة المحتوى: تُعاد المصادقة كل مرة لكنها تكلّف 304 فقط
+_CACHE_PAGES = {"/", "/quiz", "/about", "/privacy", "/terms", "/api-docs"}
+
+
+def _cache_policy(path: str):
+    if path in _CACHE_PAGES:
+        return "public, no-cache", True
+    for prefix, cache_control, versioned in _CACHE_POLICIES:
+        if path.startswith(prefix):
+            return cache_control, versioned
+    return None
+
+
+def _etag_matches(header: str, etag: str) -> bool:
+    if header.strip() == "*":
+        return True
+    bare = etag.removeprefix("W/")
+    return any(tag.strip().removeprefix("W/") == bare for tag in header.split(","))
+
+
+def _not_modified(request: Request, etag: str, modified_at: datetime) -> bool:
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        return _etag_matches(if_none_match, etag)
+    if "if-modified-since" in request.headers:
+        try:
+            return parsedate_to_datetime(request.headers["if-modified-since"]) >= modified_at
+        except (TypeError, ValueError):
+            pass
+    return False
+
+
+# ── الضغط المسبق ────────────────────────────────────────────
+# الردود ذات الإصدار وملفات static النصية تُضغط مرة واحدة (gzip + brotli إن توفر)
+# وتُخدم النسخة الأنسب حسب Accept-Encoding. GZipMiddleware يبقى للمحتوى الديناميكي فقط.
+PRECOMPRESS_MIN_SIZE = 512
+PRECOMPRESS_MAX_ENTRIES = 512
+_COMPRESSIBLE_SUFFIXES = {".css", ".js", ".json", ".svg", ".txt", ".xml", ".html", ".webmanifest"}
+# key → (content-type, variants, ترويسات المسار نفسه)
+_precompressed: "OrderedDict[str, tuple]" = OrderedDict()
+# ترويسات تخص التمثيل أو التحقق — يعيد الـ middleware بناءها، والباقي يُحفظ مع النسخ
+_REPRESENTATION_HEADERS = {"content-length", "content-type", "content-encoding", "vary",
+                           "etag", "last-modified", "cache-control"}
+
+
+def compress_variants(body: bytes, best: bool = True) -> Dict[str, bytes]:
+    """best: أقصى ضغط (عند التحميل) | غير ذلك: مستوى سريع لردود تُضغط أثناء الطلب"""
+    variants = {"identity": body}
+    if len(body) >= PRECOMPRESS_MIN_SIZE:
+        variants["gzip"] = gzip.compress(body, compresslevel=9 if best else 6, mtime=0)
+        if _BROTLI_AVAILABLE:
+            variants["br"] = brotli.compress(body, quality=11 if best else 5)
+    return variants
+
+
+def pick_encoding(accept_encoding: str, variants: Dict[str, bytes]) -> str:
+    """أصغر نسخة يقبلها العميل (q > 0)"""
+    accepted = set()
+    for part in accept_encoding.lower().split(","):
+        name, *params = part.split(";")
+        q = 1.0
+        for param in params:
+            key, _, value = param.strip().partition("=")
+            if key == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        if q > 0:
+            accepted.add(name.strip())
+    for encoding in ("br", "gzip"):
+        if encoding in variants and (encoding in accepted or "*" in accepted):
+            return encoding
+    return "identity"
+
+
+def _variant_response(accept_encoding: str, content_type: str, variants: Dict[str, bytes], headers: Dict[str, str]) -> Response:
+    encoding = pick_encoding(accept_encoding, variants)
+    headers  = {**headers, "Vary": "Accept-Encoding"}
+    if encoding != "identity":
+        headers["Content-Encoding"] = encoding
+    return Response(variants[encoding], media_type=content_type, headers=headers)
+
+
+# ── الأصول ذات البصمة ───────────────────────────────────────
+# كل ملف static يُخدم أيضاً باسم يتضمن بصمة محتواه (main.3f2a1b9c04.css) مع
+# Cache-Control: immutable لسنة كاملة — القوالب تستخدم asset_url() فيتغير الرابط
+# تلقائياً عند تغيّر الملف. الخريطة تُنشر في /static/asset-manifest.json للـ service worker.
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+# روابط يجب أن تبقى ثابتة: الـ service worker ونطاقه، وملف manifest للتطبيق
+_UNVERSIONED_ASSETS = {"sw.js", "manifest.json", "favicon.ico"}
+
+
+def _static_entry(path: Path, body: bytes, cache_control: str) -> tuple:
+    content_type = mimetypes.guess_type(path.name)[0] or "application/octet-stream"
+    if content_type.startswith("text/") or content_type.endswith(("javascript", "json", "xml")):
+        content_type += "; charset=utf-8"
+    variants = compress_variants(body) if path.suffix in _COMPRESSIBLE_SUFFIXES else {"identity": body}
+    etag     = f'"{hashlib.sha1(body).hexdigest()[:20]}"'
+    modified = datetime.fromtimestamp(int(path.stat().st_mtime), tz=timezone.utc)
+    return content_type, variants, etag, modified, cache_control
+
+
+def _load_static_assets() -> tuple:
+    """/static/... → (content-type, variants, etag, modified_at, cache-control) + خريطة البصمات"""
+    table: Dict[str, tuple] = {}
+    manifest: Dict[str, str] = {}
+    root = Path("static")
+    for path in sorted(root.rglob("*")):
+        if not path.is_file():
+            continue
+        body = path.read_bytes()
+        rel  = path.relative_to(root).as_posix()
+        table[f"/static/{rel}"] = _static_entry(path, body, "public, no-cache")
+        if rel == "sw.js":
+            table["/sw.js"] = table["/static/sw.js"]
+        if path.name not in _UNVERSIONED_ASSETS:
+            digest = hashlib.sha1(body).hexdigest()[:10]
+            hashed = path.relative_to(root).with_name(f"{path.stem}.{digest}{path.suffix}").as_posix()
+            table[f"/static/{hashed}"] = _static_entry(path, body, IMMUTABLE_CACHE_CONTROL)
+            manifest[rel] = f"/static/{hashed}"
+    version = hashlib.sha1("".join(sorted(manifest.values())).encode()).hexdigest()[:12]
+    body = dumps_json({"version": version, "assets": manifest})
+    table["/static/asset-manifest.json"] = (
+        "application/json; charset=utf-8", compress_variants(body),
+        f'"{version}"', datetime.now(timezone.utc).replace(microsecond=0), "public, no-cache",
+    )
+    return table, manifest, version
+
+
+_STATIC_VARIANTS, ASSET_MANIFEST, ASSET_VERSION = _load_static_assets()
+
+
+def asset_url(path: str) -> str:
+    """رابط الأصل ذي البصمة للاستخدام في القوالب: {{ asset_url('css/main.css') }}"""
+    return ASSET_MANIFEST.get(path, f"/static/{path}")
+
+
+@lru_cache(maxsize=1024)
+def _route_query_params(path: str) -> frozenset:
+    """معاملات الاستعلام التي يعرّفها المسار المطابق — ما عداها لا يغيّر الرد"""
+    scope = {"type": "http", "path": path, "root_path": "", "method": "GET"}
+    for route in app.router.routes:
+        match, _ = route.matches(scope)
+        if match is Match.FULL:
+            dependant = getattr(route, "dependant", None)
+            return frozenset(p.alias for p in dependant.query_params) if dependant else frozenset()
+    return frozenset()
+
+
+def _cache_key(request: Request) -> str:
+    """المفتاح من المعاملات المعروفة فقط (مرتبة): معاملات عشوائية لا تُنشئ نسخاً جديدة"""
+    known  = _route_query_params(request.url.path)
+    params = sorted((k, v) for k, v in request.query_params.multi_items() if k in known)
+    return f"{CONTENT_VERSION}:{request.url.path}?{urlencode(params)}"
+
+
+@app.middleware("http")
+async def conditional_cache_middleware(request: Request, call_next):
+    if request.method not in ("GET", "HEAD"):
+        return await call_next(request)
+    accept_encoding = request.headers.get("accept-encoding", "")
+
+    static = _STATIC_VARIANTS.get(request.url.path)
+    if static is not None:
+        content_type, variants, etag, modified_at, cache_control = static
+        headers = {
+            "ETag": etag,
+            "Last-Modified": format_datetime(modified_at, usegmt=True),
+            "Cache-Control": cache_control,
+        }
+        if _not_modified(request, etag, modified_at):
+            return Response(status_code=304, headers=headers)
+        return _variant_response(accept_encoding, content_type, variants, headers)
+
+    policy = _cache_policy(request.url.path)
+    if policy is None:
+        return await call_next(request)
+    cache_control, versioned = policy
+    if not versioned:
+        response = await call_next(request)
+        response.headers.setdefault("Cache-Control", cache_control)
+        return response
+
+    key  = _cache_key(request)
+    etag = f'W/"{hashlib.sha1(key.encode()).hexdigest()[:20]}"'
+    validators = {"ETag": etag, "Last-Modified": CONTENT_LAST_MODIFIED, "Cache-Control": cache_control}
+    if _not_modified(request, etag, CONTENT_MODIFIED_AT):
+        return Response(status_code=304, headers=validators)
+
+    entry = _precompressed.get(key)
+    if entry is None:
+        # الضغط هنا لا في GZipMiddleware: نطلب من الداخل النسخة الخام ونخزّن نسخها المضغوطة
+        request.scope["headers"] = [(k, v) for k, v in request.scope["headers"] if k != b"accept-encoding"]
+        response = await call_next(request)
+        if response.status_code != 200 or request.method != "GET":
+            if response.status_code == 200:
+                response.headers.update(validators)
+            return response
+        body  = b"".join([chunk async for chunk in response.body_iterator])
+        own_headers = {k: v for k, v in response.headers.items() if k not in _REPRESENTATION_HEADERS}
+        # الضغط خارج حلقة الأحداث وبمستوى سريع — لا يوقف الطلبات الأخرى
+        variants = await asyncio.to_thread(compress_variants, body, False)
+        entry = (response.headers.get("content-type", "application/octet-stream"), variants, own_headers)
+        _precompressed[key] = entry
+        while len(_precompressed) > PRECOMPRESS_MAX_ENTRIES:
+            _precompressed.popitem(last=False)
+    else:
+        _precompressed.move_to_end(key)
+    content_type, variants, own_headers = entry
+    return _variant_response(accept_encoding, content_type, variants, {**own_headers, **validators})
+
+
+# CORS آخر ما يُضاف = الطبقة الخارجية: يشمل الردود المبنية من النسخ المضغوطة و 304
 origins = settings.allowed_origins.split(",") if settings.allowed_origins != "*" else ["*"]
 app.add_middleware(
     CORSMiddleware,
@@ -245,21 +539,30 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
-app.add_middleware(GZipMiddleware, minimum_size=1000)
 
 # ============================================
 # TEMPLATES & STATIC FILES
 # ============================================
 templates = Jinja2Templates(directory="templates")
 templates.env.globals["now"] = datetime.now
+templates.env.globals["asset_url"] = asset_url
+
+
+def preload_templates() -> int:
+    """تجميع كل القوالب مسبقاً — مع gunicorn (preload_app) يتم مرة واحدة في العملية الأم"""
+    names = templates.env.list_templates()
+    for name in names:
+        templates.get_template(name)
+    return len(names)
 
 app.mount("/static", StaticFiles(directory="static"), name="static")
 
-# إصلاح مسار sw.js ليكون متاحاً من الجذر (مهم لـ PWA)
+# sw.js من الجذر (/sw.js) ليكون نطاقه الموقع كله لا /static/ فقط (مهم لـ PWA)
+@app.get("/sw.js")
 @app.get("/static/sw.js")
 async def get_sw():
     from fastapi.responses import FileResponse
-    return FileResponse("static/sw.js")
+    return FileResponse("static/sw.js", headers={"Cache-Control": "no-cache"})
 
 # Favicon route
 @app.get("/favicon.ico")
@@ -350,6 +653,115 @@ class HadithResponse(BaseModel):
     model_config = {"from_attributes": True}
 
 
+# ============================================
+# PRE-SERIALIZED API JSON
+# ============================================
+# الأحاديث ثابتة حتى إعادة النشر: تُتحقق عبر HadithResponse وتُحوَّل إلى JSON مرة
+# واحدة عند التحميل، ثم تُرسل البايتات كما هي بلا تحقق/تسلسل لكل طلب
+class FastJSONResponse(JSONResponse):
+    """JSONResponse عبر orjson — ويمرّر البايتات الجاهزة كما هي"""
+
+    def render(self, content: Any) -> bytes:
+        if isinstance(content, bytes):
+            return content
+        return dumps_json(content)
+
+
+def _build_api_records() -> Dict[int, Dict]:
+    records: Dict[int, Dict] = {}
+    for h in HADITHS_DATA:
+        try:
+            records[h["id"]] = HadithResponse.model_validate(h).model_dump(mode="json")
+        except Exception as e:
+            logger.warning(f"⚠️ الحديث {h.get('id')} لا يطابق HadithResponse: {e}")
+    return records
+
+
+HADITH_API_RECORDS: Dict[int, Dict] = _build_api_records()
+HADITH_API_JSON: Dict[int, bytes] = {i: dumps_json(r) for i, r in HADITH_API_RECORDS.items()}
+HADITH_FIELDS: tuple = tuple(HadithResponse.model_fields)
+CORPUS_MAX_BATCH = 100
+
+
+def parse_fields(fields: Optional[str]) -> Optional[tuple]:
+    """?fields=id,title → ("id", "title") بترتيب النموذج؛ None = السجل كاملاً"""
+    requested = {f.strip() for f in (fields or "").split(",") if f.strip()}
+    unknown = requested - set(HADITH_FIELDS)
+    if unknown:
+        raise HTTPException(
+            status_code=400,
+            detail=f"حقول غير معروفة: {', '.join(sorted(unknown))} — المتاح: {', '.join(HADITH_FIELDS)}",
+        )
+    if not requested or len(requested) == len(HADITH_FIELDS):
+        return None
+    return tuple(f for f in HADITH_FIELDS if f in requested)
+
+
+def parse_ids(ids: str) -> List[int]:
+    """?ids=1,5,9 → [1, 5, 9] بترتيب الطلب ودون تكرار"""
+    try:
+        parsed = [int(i) for i in ids.split(",") if i.strip()]
+    except ValueError:
+        raise HTTPException(status_code=400, detail="ids يجب أن تكون أرقاماً مفصولة بفواصل")
+    if not 1 <= len(parsed) <= CORPUS_MAX_BATCH:
+        raise HTTPException(status_code=400, detail=f"ids يجب أن تحتوي بين 1 و {CORPUS_MAX_BATCH} رقماً")
+    return list(dict.fromkeys(parsed))
+
+
+@lru_cache(maxsize=64)
+def _projected_json(fields: tuple) -> Dict[int, bytes]:
+    """السجلات الجاهزة مقصورة على حقول معينة — تُبنى مرة لكل مجموعة حقول"""
+    return {i: dumps_json({f: r[f] for f in fields}) for i, r in HADITH_API_RECORDS.items()}
+
+
+def hadith_records(fields: Optional[tuple] = None) -> Dict[int, bytes]:
+    return HADITH_API_JSON if fields is None else _projected_json(fields)
+
+
+def hadiths_json(ids: Iterable[int], fields: Optional[tuple] = None) -> bytes:
+    """مصفوفة JSON من السجلات الجاهزة — دمج بايتات بلا أي تسلسل"""
+    records = hadith_records(fields)
+    return b"[" + b",".join(records[i] for i in ids if i in records) + b"]"
+
+
+def hadiths_ndjson(ids: Iterable[int], fields: Optional[tuple] = None) -> bytes:
+    """سجل JSON في كل سطر (NDJSON) — للمعالجة المتدفقة سطراً بسطر"""
+    records = hadith_records(fields)
+    return b"".join(records[i] + b"\n" for i in ids if i in records)
+
+
+@lru_cache(maxsize=256)
+def hadiths_page_json(skip: int, limit: int, fields: Optional[tuple] = None) -> bytes:
+    return hadiths_json((h["id"] for h in HADITHS_DATA[skip: skip + limit]), fields)
+
+
+@lru_cache(maxsize=64)
+def corpus_body(fmt: str, fields: Optional[tuple] = None) -> bytes:
+    ids = [h["id"] for h in HADITHS_DATA]
+    return hadiths_ndjson(ids, fields) if fmt == "ndjson" else hadiths_json(ids, fields)
+
+
+def _content_version() -> tuple:
+    """بصمة المحتوى (الأحاديث + القوالب + الأصول + الإصدار) وآخر تعديل لها — تتغير مع النشر فقط"""
+    digest = hashlib.sha256(dumps_json(HADITHS_DATA))
+    digest.update(settings.app_version.encode())
+    digest.update(ASSET_VERSION.encode())   # الصفحات تتضمن روابط الأصول ذات البصمة
+    files = [Path(__file__).with_name("nawawi40_structured.json"), *sorted(Path("templates").glob("*.html"))]
+    mtime = 0.0
+    for path in files:
+        if path.exists():
+            digest.update(path.read_bytes())
+            mtime = max(mtime, path.stat().st_mtime)
+    modified = datetime.fromtimestamp(int(mtime), tz=timezone.utc)
+    return digest.hexdigest()[:16], modified
+
+
+CONTENT_VERSION, CONTENT_MODIFIED_AT = _content_version()
+CONTENT_LAST_MODIFIED: str = format_datetime(CONTENT_MODIFIED_AT, usegmt=True)
+# يُمرَّر للـ service worker في رابط التسجيل: نسخة كاش جديدة مع كل تغيير في المحتوى
+templates.env.globals["content_version"] = CONTENT_VERSION
+
+
 class ContactForm(BaseModel):
     """نموذج التواصل"""
     name: str = Field(..., min_length=2, max_length=100)
@@ -460,44 +872,65 @@ async def hadith_detail(request: Request, hadith_id: int):
 # ============================================
 # API ENDPOINTS
 # ============================================
-# ⚠️ يجب أن يكون /random قبل /{hadith_id} لتجنب تعارض المسارات
+# ⚠️ يجب أن يكون /random و /batch قبل /{hadith_id} لتجنب تعارض المسارات
+# كل نقاط القراءة تقبل ?fields=id,title,... لإرجاع حقول محددة فقط
 @app.get("/api/hadiths/random", response_model=HadithResponse)
 @limiter.limit("100/minute")
-async def get_random_hadith_api(request: Request):
+async def get_random_hadith_api(request: Request, fields: Optional[str] = None):
+    projection = parse_fields(fields)
     if not HADITHS_DATA:
         raise HTTPException(status_code=404, detail="لا توجد أحاديث متاحة")
-    return random.choice(HADITHS_DATA)
+    return FastJSONResponse(hadith_records(projection)[random.choice(HADITHS_DATA)["id"]])
 
 
 @app.get("/api/hadiths", response_model=List[HadithResponse])
 @limiter.limit("100/minute")
-async def get_all_hadiths(request: Request, skip: int = 0, limit: int = 20):
+async def get_all_hadiths(request: Request, skip: int = 0, limit: int = 20, fields: Optional[str] = None):
     if skip < 0:
         raise HTTPException(status_code=400, detail="skip يجب أن يكون 0 أو أكبر")
     if not 1 <= limit <= 100:
         raise HTTPException(status_code=400, detail="limit يجب أن يكون بين 1 و 100")
-    return HADITHS_DATA[skip: skip + limit]
+    return FastJSONResponse(hadiths_page_json(skip, limit, parse_fields(fields)))
+
+
+@app.get("/api/hadiths/batch", response_model=List[HadithResponse])
+@limiter.limit("100/minute")
+async def get_hadiths_batch(request: Request, ids: str, fields: Optional[str] = None):
+    """عدة أحاديث في طلب واحد بترتيب ids — الأرقام غير الموجودة تُتجاهل"""
+    return FastJSONResponse(hadiths_json(parse_ids(ids), parse_fields(fields)))
 
 
 @app.get("/api/hadiths/{hadith_id}", response_model=HadithResponse)
 @limiter.limit("100/minute")
-async def get_hadith_api(request: Request, hadith_id: int):
+async def get_hadith_api(request: Request, hadith_id: int, fields: Optional[str] = None):
+    projection = parse_fields(fields)
     if hadith_id < 1:
         raise HTTPException(status_code=400, detail="رقم الحديث يجب أن يكون موجباً")
-    hadith = get_hadith_by_id(hadith_id)
-    if not hadith:
+    if hadith_id not in HADITH_API_JSON:
         raise HTTPException(status_code=404, detail="الحديث غير موجود")
-    return hadith
+    return FastJSONResponse(hadith_records(projection)[hadith_id])
+
+
+@app.get("/api/corpus", response_model=List[HadithResponse])
+@limiter.limit("30/minute")
+async def get_corpus(request: Request, format: str = "json", fields: Optional[str] = None):
+    """كل الأحاديث دفعة واحدة (JSON أو NDJSON) — مضغوطة مسبقاً وبـ ETag عبر الـ middleware"""
+    if format not in ("json", "ndjson"):
+        raise HTTPException(status_code=400, detail="format يجب أن يكون json أو ndjson")
+    body = corpus_body(format, parse_fields(fields))
+    if format == "ndjson":
+        return Response(body, media_type="application/x-ndjson")
+    return FastJSONResponse(body)
 
 
 @app.get("/api/search", response_model=List[HadithResponse])
 @limiter.limit("50/minute")
-async def search_api(request: Request, q: str, limit: int = 10):
+async def search_api(request: Request, q: str, limit: int = 10, fields: Optional[str] = None):
     if not q or not q.strip():
         raise HTTPException(status_code=400, detail="الرجاء إدخال كلمة للبحث")
     if not 1 <= limit <= 50:
         raise HTTPException(status_code=400, detail="limit يجب أن يكون بين 1 و 50")
-    return search_hadiths(q)[:limit]
+    return FastJSONResponse(hadiths_json((h["id"] for h in search_hadiths(q)[:limit]), parse_fields(fields)))
 
 
 # ============================================
@@ -586,6 +1019,16 @@ async def create_general_comment(request: Request, comment_data: Dict[str, Any])
 # ============================================
 @app.post("/api/telegram/webhook")
 async def telegram_webhook(request: Request):
+    """يستقبل تحديثات Telegram ويمررها للبوت العامل في نفس العملية (BOT_MODE=webhook)"""
+    if bot_service is None:
+        return api_error(503, "البوت لا يعمل بوضع Webhook")
+    if not bot_service.check_secret(request.headers.get("X-Telegram-Bot-Api-Secret-Token")):
+        return api_error(403, "رمز التحقق غير صحيح")
+    try:
+        payload = await request.json()
+    except ValueError:
+        return api_error(400, "JSON غير صالح")
+    await bot_service.feed_update(payload)
     return {"status": "ok"}
 
 
@@ -601,11 +1044,14 @@ async def quiz_list_page(request: Request):
 @app.get("/quiz/start")
 @limiter.limit(f"{settings.rate_limit_per_minute}/minute")
 async def quiz_start_page(request: Request, type: str = "first-10"):
+    # الأسئلة تُولَّد في المتصفح من /api/quiz/bundle — الصفحة هنا ثابتة لكل نوع
+    if type not in QUIZ_CONFIG:
+        type = "narrator"
     try:
-        questions, quiz_title, time_limit = generate_quiz_questions(type)
+        quiz_title, question_count, time_limit, _ = QUIZ_CONFIG[type]
         return templates.TemplateResponse("quiz_test.html", {
             "request": request,
-            "questions": questions,
+            "question_count": question_count,
             "quiz_title": quiz_title,
             "time_limit": time_limit,
             "quiz_type": type,
@@ -628,6 +1074,10 @@ def _get_source_books(hadith: Dict) -> list:
     src = hadith.get("source_dict") or {}
     return src.get("books_arabic", [])
 
+def _format_narrations_count(count) -> str:
+    """«5374» أو «281 (أبو ذر) + 157 (معاذ)» → «5,374 حديث» (الرقم الأول فقط)"""
+    return f"{int(str(count).split()[0].replace(',', '')):,} حديث"
+
 def _build_options(correct: str, pool: list, count: int = 3) -> list:
     """بناء 4 خيارات: 1 صحيح + 3 خاطئة"""
     wrong_pool = [x for x in pool if x and x != correct]
@@ -854,9 +1304,9 @@ def _make_narrations_count_q(hadith: Dict, all_hadiths: List[Dict]) -> Optional[
     narrator = _get_narrator_field(hadith, "arabic", "الراوي")
     if count is None:
         return None
-    correct = f"{int(str(count).split()[0].replace(",","")):,} حديث"
+    correct = _format_narrations_count(count)
     pool = list(set(
-        f"{int(str(_get_narrator_field(h, 'narrations_count') or 0).split()[0].replace(",","")):,} حديث"
+        _format_narrations_count(_get_narrator_field(h, 'narrations_count') or 0)
         for h in all_hadiths
         if _get_narrator_field(h, 'narrations_count') and _get_narrator_field(h, 'narrations_count') != count
     ))
@@ -880,30 +1330,49 @@ def _make_speed_q(hadith: Dict, all_hadiths: List[Dict]) -> Optional[Dict]:
             return q
     return None
 
-def generate_quiz_questions(quiz_type: str):
-    """توليد أسئلة حقيقية لكل نوع اختبار"""
-
-    # ── تحديد الأحاديث والعنوان والوقت ──
-    CONFIG = {
-        "narrator":          ("من الراوي؟",                  10, 8,  _make_narrator_q),
-        "complete":          ("أكمل الحديث",                 10, 10, _make_complete_q),
-        "which-hadith":      ("من أي حديث؟",                 10, 10, _make_which_hadith_q),
-        "vocabulary":        ("معاني المفردات",               10, 8,  _make_vocabulary_q),
-        "benefit":           ("فوائد الأحاديث",               10, 8,  _make_benefit_q),
-        "topic":             ("تصنيف الأحاديث",               10, 8,  _make_topic_q),
-        "source":            ("مصادر الأحاديث",               10, 8,  _make_source_q),
-        "narrator-tribe":    ("قبائل الرواة",                 10, 8,  _make_narrator_tribe_q),
-        "narrator-died":     ("تاريخ وفاة الراوي",            10, 8,  _make_narrator_died_q),
-        "narrations-count":  ("عدد الروايات",                 10, 8,  _make_narrations_count_q),
-        "speed":             ("السباق ضد الوقت ⚡",           10, 1,  _make_speed_q),
-        "random-20":         ("الاختبار الشامل 🎲",           20, 10, None),
-        "first-10":          ("اختبار الأحاديث العشرة الأولى", 10, 5, None),
-    }
+_QUIZ_MAKERS = {
+    "narrator":         _make_narrator_q,
+    "complete":         _make_complete_q,
+    "which-hadith":     _make_which_hadith_q,
+    "vocabulary":       _make_vocabulary_q,
+    "benefit":          _make_benefit_q,
+    "topic":            _make_topic_q,
+    "source":           _make_source_q,
+    "narrator-tribe":   _make_narrator_tribe_q,
+    "narrator-died":    _make_narrator_died_q,
+    "narrations-count": _make_narrations_count_q,
+    "speed":            _make_speed_q,
+}
+# مزيج الاختبارين الشامل والعشرة الأولى
+_MIXED_MAKERS = [
+    "narrator", "complete", "which-hadith", "vocabulary",
+    "benefit", "topic", "source", "narrator-tribe",
+]
+
+# ── تحديد الأحاديث والعنوان والوقت ── (العنوان، عدد الأسئلة، الدقائق، المولّد)
+QUIZ_CONFIG = {
+    "narrator":          ("من الراوي؟",                  10, 8,  "narrator"),
+    "complete":          ("أكمل الحديث",                 10, 10, "complete"),
+    "which-hadith":      ("من أي حديث؟",                 10, 10, "which-hadith"),
+    "vocabulary":        ("معاني المفردات",               10, 8,  "vocabulary"),
+    "benefit":           ("فوائد الأحاديث",               10, 8,  "benefit"),
+    "topic":             ("تصنيف الأحاديث",               10, 8,  "topic"),
+    "source":            ("مصادر الأحاديث",               10, 8,  "source"),
+    "narrator-tribe":    ("قبائل الرواة",                 10, 8,  "narrator-tribe"),
+    "narrator-died":     ("تاريخ وفاة الراوي",            10, 8,  "narrator-died"),
+    "narrations-count":  ("عدد الروايات",                 10, 8,  "narrations-count"),
+    "speed":             ("السباق ضد الوقت ⚡",           10, 1,  "speed"),
+    "random-20":         ("الاختبار الشامل 🎲",           20, 10, None),
+    "first-10":          ("اختبار الأحاديث العشرة الأولى", 10, 5, None),
+}
+
 
-    if quiz_type not in CONFIG:
+def generate_quiz_questions(quiz_type: str):
+    """توليد أسئلة حقيقية لكل نوع اختبار — المرجع لمولّد المتصفح في static/js/quiz.js"""
+    if quiz_type not in QUIZ_CONFIG:
         quiz_type = "narrator"
 
-    quiz_title, target_count, time_limit, maker = CONFIG[quiz_type]
+    quiz_title, target_count, time_limit, maker_name = QUIZ_CONFIG[quiz_type]
 
     # ── اختيار مجموعة الأحاديث ──
     if quiz_type == "first-10":
@@ -917,32 +1386,79 @@ def generate_quiz_questions(quiz_type: str):
     # ── توليد الأسئلة ──
     questions = []
 
-    if quiz_type in ("random-20", "first-10"):
+    for hadith in pool:
+        if len(questions) >= target_count:
+            break
         # مزيج من كل الأنواع
-        all_makers = [
-            _make_narrator_q, _make_complete_q, _make_which_hadith_q,
-            _make_vocabulary_q, _make_benefit_q, _make_topic_q,
-            _make_source_q, _make_narrator_tribe_q,
-        ]
-        for hadith in pool:
-            if len(questions) >= target_count:
-                break
-            mk = random.choice(all_makers)
-            q = mk(hadith, HADITHS_DATA)
-            if q:
-                questions.append(q)
-    else:
-        for hadith in pool:
-            if len(questions) >= target_count:
-                break
-            q = maker(hadith, HADITHS_DATA)
-            if q:
-                questions.append(q)
+        maker = _QUIZ_MAKERS[maker_name or random.choice(_MIXED_MAKERS)]
+        q = maker(hadith, HADITHS_DATA)
+        if q:
+            questions.append(q)
 
     random.shuffle(questions)
     return questions, quiz_title, time_limit
 
 
+# ============================================
+# QUIZ BUNDLE (توليد الاختبارات في المتصفح)
+# ============================================
+# كل ما تحتاجه المولّدات من الأحاديث في حزمة واحدة صغيرة ذات إصدار: المتصفح يولّد
+# الأسئلة بنفسه (static/js/quiz.js) ويخزّنها الـ service worker فتعمل الاختبارات دون اتصال.
+# الحقول الفارغة تُحذف لتصغير الحزمة.
+def _quiz_record(hadith: Dict) -> Dict:
+    src = hadith.get("source_dict") or {}
+    record = {
+        "id":       hadith["id"],
+        "title":    hadith.get("title", ""),
+        "text":     hadith.get("arabic_hadith_text_plain", ""),
+        "narrator": _get_narrator_field(hadith, "arabic", ""),
+        "bio":      _get_narrator_field(hadith, "bio_arabic", ""),
+        "tribe":    _get_narrator_field(hadith, "tribe_arabic", ""),
+        "died":     _get_narrator_field(hadith, "died_ah", None),
+        "topic":    (hadith.get("topics") or {}).get("category_arabic", ""),
+        "books":    _get_source_books(hadith),
+        "grade":    src.get("grade_arabic", ""),
+        "vocab":    hadith.get("vocabulary", []),
+        "benefits": hadith.get("benefits", []),
+    }
+    count = _get_narrator_field(hadith, "narrations_count", None)
+    if count:
+        try:
+            record["narrations"] = _format_narrations_count(count)
+        except ValueError:
+            logger.warning(f"⚠️ عدد روايات غير مفهوم في الحديث {hadith['id']}: {count}")
+    return {k: v for k, v in record.items() if v not in (None, "", [])}
+
+
+def _build_quiz_bundle() -> bytes:
+    return dumps_json({
+        "version": CONTENT_VERSION,
+        "quizzes": {
+            name: {"title": title, "count": count, "time_limit": minutes, "maker": maker}
+            for name, (title, count, minutes, maker) in QUIZ_CONFIG.items()
+        },
+        "mixed":   _MIXED_MAKERS,
+        "hadiths": [_quiz_record(h) for h in HADITHS_DATA],
+    })
+
+
+QUIZ_BUNDLE_JSON: bytes = _build_quiz_bundle()
+
+
+@app.get("/api/quiz/bundle")
+@limiter.limit("100/minute")
+async def quiz_bundle_api(request: Request):
+    return FastJSONResponse(QUIZ_BUNDLE_JSON)
+
+
+@app.get("/api/quiz")
+@limiter.limit(f"{settings.rate_limit_per_minute}/minute")
+async def quiz_questions_api(request: Request, type: str = "first-10"):
+    """أسئلة مولّدة على الخادم — احتياط للمتصفح إن تعذّر تحميل الحزمة"""
+    questions, quiz_title, time_limit = generate_quiz_questions(type)
+    return FastJSONResponse({"questions": questions, "quiz_title": quiz_title, "time_limit": time_limit})
+
+
 
 
 # ============================================
@@ -1123,9 +1639,8 @@ async def terms(request: Request):
 @app.get("/sitemap.xml")
 async def sitemap_xml(request: Request):
     """Sitemap ديناميكي يتحدث تلقائياً مع كل حديث جديد"""
-    from fastapi.responses import Response
-
-    today = datetime.now().strftime("%Y-%m-%d")
+    # lastmod = آخر تعديل فعلي للمحتوى (يتسق مع ETag/Last-Modified)
+    today = CONTENT_MODIFIED_AT.strftime("%Y-%m-%d")
     base = settings.site_url.rstrip("/")
 
     # الصفحات الثابتة مع أولوياتها
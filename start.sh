@@ -1,2 +1,8 @@
-python3 bot.py &
-python3 -m uvicorn main:app --host 0.0.0.0 --port ${PORT:-10000}
\ No newline at end of file
+# BOT_MODE=webhook: البوت يعمل داخل تطبيق FastAPI نفسه (عملية واحدة بدل اثنتين)
+# يُقرأ عبر config.settings (البيئة + .env) كما يقرؤه main.py و gunicorn.conf.py
+BOT_MODE=$(python3 -c "from config import settings; print(settings.bot_mode)")
+if [ "$BOT_MODE" != "webhook" ]; then
+    python3 bot.py &
+fi
+# gunicorn يحمّل التطبيق مرة واحدة ثم يتفرع إلى WEB_CONCURRENCY worker (انظر gunicorn.conf.py)
+exec gunicorn main:app -c gunicorn.conf.py
@@ -0,0 +1,263 @@
+/**
+ * ╔═══════════════════════════════════════════════════════════════╗
+ * ║         HADITH APP - QUIZ GENERATOR                           ║
+ * ║         Client-side port of generate_quiz_questions()         ║
+ * ╚═══════════════════════════════════════════════════════════════╝
+ *
+ * Builds quizzes in the browser from /api/quiz/bundle. Every maker mirrors its
+ * Python twin in main.py (_make_*_q); tests/test_quiz_parity.py checks they agree.
+ */
+
+// ============================================
+// 🎲 RANDOM HELPERS (random.choice / sample / shuffle)
+// ============================================
+function quizChoice(items) {
+    return items[Math.floor(Math.random() * items.length)];
+}
+
+function quizShuffle(items) {
+    for (let i = items.length - 1; i > 0; i--) {
+        const j = Math.floor(Math.random() * (i + 1));
+        [items[i], items[j]] = [items[j], items[i]];
+    }
+    return items;
+}
+
+function quizSample(items, count) {
+    return quizShuffle([...items]).slice(0, count);
+}
+
+// str.strip(chars) for a single character
+function quizStrip(text, ch) {
+    let start = 0;
+    let end = text.length;
+    while (start < end && text[start] === ch) start++;
+    while (end > start && text[end - 1] === ch) end--;
+    return text.slice(start, end);
+}
+
+function quizWords(text) {
+    return text.split(/\s+/).filter(Boolean);
+}
+
+// ============================================
+// 🧩 QUESTION MAKERS
+// ============================================
+function buildOptions(correct, pool, count = 3) {
+    const wrongPool = [...new Set(pool.filter(x => x && x !== correct))];
+    if (wrongPool.length < count) return [];
+    return quizShuffle([...quizSample(wrongPool, count), correct]);
+}
+
+function question(fields, options, correct) {
+    return { ...fields, options, correctAnswer: options.indexOf(correct) };
+}
+
+const QUIZ_MAKERS = {
+    'narrator'(h, all) {
+        const correct = h.narrator || '';
+        if (!correct) return null;
+        const options = buildOptions(correct, all.map(x => x.narrator));
+        if (!options.length) return null;
+        return question({
+            question: `من روى الحديث المعروف بـ «${h.title || ''}»؟`,
+            hadith_text: h.text || '',
+            explanation: `رواه ${correct} رضي الله عنه. ${h.bio || ''}`,
+        }, options, correct);
+    },
+
+    'complete'(h, all) {
+        const text = quizStrip(quizStrip(quizStrip((h.text || '').trim(), '"'), '«'), '»');
+        if (!text) return null;
+        const words = quizWords(text);
+        if (words.length < 8) return null;
+        const split = Math.floor(words.length / 2);
+        const firstHalf = words.slice(0, split).join(' ');
+        const correct = words.slice(split, split + 4).join(' ');
+        const pool = [];
+        for (const x of all) {
+            const w = quizWords(quizStrip((x.text || '').trim(), '"'));
+            if (w.length > split + 4 && x.id !== h.id) {
+                pool.push(w.slice(split, split + 4).join(' '));
+            }
+        }
+        const options = buildOptions(correct, pool);
+        if (!options.length) return null;
+        return question({
+            question: `أكمل الحديث: «${firstHalf} ...»`,
+            explanation: `النص الكامل: «${text}»`,
+        }, options, correct);
+    },
+
+    'which-hadith'(h, all) {
+        const text = quizStrip((h.text || '').trim(), '"');
+        if (!text) return null;
+        const words = quizWords(text);
+        if (words.length < 5) return null;
+        const mid = Math.floor(words.length / 3);
+        const snippet = words.slice(mid, mid + 6).join(' ');
+        const correct = h.title || '';
+        const options = buildOptions(correct, all.filter(x => x.id !== h.id).map(x => x.title || ''));
+        if (!options.length) return null;
+        return question({
+            question: `من أي حديث هذا المقطع؟\n«...${snippet}...»`,
+            explanation: `هذا مقطع من حديث «${correct}».`,
+        }, options, correct);
+    },
+
+    'vocabulary'(h, all) {
+        const vocab = h.vocab || [];
+        if (!vocab.length) return null;
+        const entry = quizChoice(vocab);
+        const sep = entry.indexOf(':');
+        if (sep === -1) return null;
+        const word = entry.slice(0, sep).trim();
+        const correct = entry.slice(sep + 1).trim();
+        const pool = [];
+        for (const x of all) {
+            for (const v of x.vocab || []) {
+                const i = v.indexOf(':');
+                if (i === -1) continue;
+                const meaning = v.slice(i + 1).trim();
+                if (meaning !== correct && v.slice(0, i).trim() !== word) pool.push(meaning);
+            }
+        }
+        const options = buildOptions(correct, pool);
+        if (!options.length) return null;
+        return question({
+            question: `ما معنى كلمة «${word}» في قول النبي ﷺ؟`,
+            hadith_text: h.text || '',
+            explanation: `«${word}»: ${correct}`,
+        }, options, correct);
+    },
+
+    'benefit'(h, all) {
+        const benefits = h.benefits || [];
+        if (!benefits.length) return null;
+        const correct = quizChoice(benefits);
+        const pool = all.flatMap(x => x.benefits || []).filter(b => b !== correct);
+        const options = buildOptions(correct, pool);
+        if (!options.length) return null;
+        return question({
+            question: `ما إحدى فوائد حديث «${h.title || ''}»؟`,
+            explanation: `من فوائد هذا الحديث: ${correct}`,
+        }, options, correct);
+    },
+
+    'topic'(h, all) {
+        const correct = h.topic || '';
+        if (!correct) return null;
+        const pool = all.filter(x => x.topic && x.id !== h.id).map(x => x.topic);
+        const options = buildOptions(correct, pool);
+        if (!options.length) return null;
+        return question({
+            question: `ما التصنيف الرئيسي لحديث «${h.title || ''}»؟`,
+            hadith_text: h.text || '',
+            explanation: `حديث «${h.title || ''}» يندرج تحت تصنيف: ${correct}`,
+        }, options, correct);
+    },
+
+    'source'(h, all) {
+        const books = h.books || [];
+        if (!books.length) return null;
+        const correct = books[0];
+        const pool = all.flatMap(x => x.books || []).filter(b => b !== correct);
+        const options = buildOptions(correct, pool);
+        if (!options.length) return null;
+        return question({
+            question: `في أي كتاب ورد حديث «${h.title || ''}»?`,
+            explanation: `رواه ${correct}. درجته: ${h.grade || ''}`,
+        }, options, correct);
+    },
+
+    'narrator-tribe'(h, all) {
+        const correct = h.tribe || '';
+        const narrator = h.narrator || 'الراوي';
+        if (!correct) return null;
+        const pool = all.filter(x => x.tribe && x.tribe !== correct).map(x => x.tribe);
+        const options = buildOptions(correct, pool);
+        if (!options.length) return null;
+        return question({
+            question: `من أي قبيلة ينتسب ${narrator} راوي حديث «${h.title || ''}»؟`,
+            explanation: `${narrator} ينتسب إلى قبيلة ${correct}.`,
+        }, options, correct);
+    },
+
+    'narrator-died'(h, all) {
+        const died = h.died;
+        const narrator = h.narrator || 'الراوي';
+        if (died === undefined || died === null) return null;
+        const correct = `${died} هـ`;
+        const pool = all.filter(x => x.died && x.died !== died).map(x => `${x.died} هـ`);
+        const options = buildOptions(correct, pool);
+        if (!options.length) return null;
+        return question({
+            question: `متى توفي ${narrator} راوي حديث «${h.title || ''}»؟`,
+            explanation: `توفي ${narrator} سنة ${correct}.`,
+        }, options, correct);
+    },
+
+    'narrations-count'(h, all) {
+        // Pre-formatted server-side by _format_narrations_count()
+        const correct = h.narrations;
+        const narrator = h.narrator || 'الراوي';
+        if (!correct) return null;
+        const pool = all.filter(x => x.narrations).map(x => x.narrations);
+        const options = buildOptions(correct, pool);
+        if (!options.length) return null;
+        return question({
+            question: `كم عدد روايات ${narrator} في كتب السنة؟`,
+            explanation: `روى ${narrator} ما مجموعه ${correct} في كتب السنة النبوية.`,
+        }, options, correct);
+    },
+
+    'speed'(h, all) {
+        const makers = quizShuffle(['narrator', 'which-hadith', 'source', 'topic']);
+        for (const name of makers) {
+            const q = QUIZ_MAKERS[name](h, all);
+            if (q) return q;
+        }
+        return null;
+    },
+};
+
+// ============================================
+// 📝 QUIZ GENERATOR
+// ============================================
+class QuizGenerator {
+    constructor(bundle) {
+        this.bundle = bundle;
+        this.hadiths = bundle.hadiths || [];
+    }
+
+    config(quizType) {
+        return this.bundle.quizzes[quizType] || this.bundle.quizzes['narrator'];
+    }
+
+    generate(quizType) {
+        if (!this.bundle.quizzes[quizType]) quizType = 'narrator';
+        const { title, count, time_limit: timeLimit, maker } = this.config(quizType);
+
+        let pool;
+        if (quizType === 'first-10') {
+            pool = this.hadiths.slice(0, 10);
+        } else if (quizType === 'random-20') {
+            pool = quizSample(this.hadiths, Math.min(20, this.hadiths.length));
+        } else {
+            pool = quizShuffle([...this.hadiths]);
+        }
+
+        const questions = [];
+        for (const hadith of pool) {
+            if (questions.length >= count) break;
+            const q = QUIZ_MAKERS[maker || quizChoice(this.bundle.mixed)](hadith, this.hadiths);
+            if (q) questions.push(q);
+        }
+
+        return { questions: quizShuffle(questions), title, timeLimit };
+    }
+}
+
+if (typeof module !== 'undefined') {
+    module.exports = { QuizGenerator, QUIZ_MAKERS, buildOptions };
+}
@@ -1,86 +1,143 @@
 // Service Worker for نبراس - الأربعون النووية
-const CACHE_NAME = 'nabras-hadith-v1';
+// Offline-first: every hadith page, every quiz (with its question bundle) and all
+// static assets are precached.
+// The cache version comes from the content hash in the registration URL
+// (/sw.js?v=<CONTENT_VERSION>), so a deploy that changes the corpus, templates
+// or assets installs a fresh cache and drops the old one.
+const VERSION = new URL(self.location).searchParams.get('v') || 'dev';
+const CACHE_PREFIX = 'nabras-hadith-';
+const CACHE_NAME = `${CACHE_PREFIX}${VERSION}`;
 const OFFLINE_URL = '/';
+const ASSET_MANIFEST_URL = '/static/asset-manifest.json';
+const CORPUS_URL = '/api/corpus';
+// Same version as the link in quiz_test.html: quizzes are generated offline from it
+const QUIZ_BUNDLE_URL = `/api/quiz/bundle?v=${VERSION}`;
 
 const STATIC_CACHE_URLS = [
   '/',
-  '/static/icons/icon-192x192.png',
-  '/static/icons/icon-180x180.png',
-  '/static/icons/icon-512x512.png',
-  '/static/icons/icon-152x152.png',
-  '/static/icons/icon-144x144.png',
-  '/static/icons/icon-128x128.png',
-  '/static/icons/icon-96x96.png',
-  '/static/icons/icon-72x72.png',
-  '/static/icons/icon-384x384.png',
+  '/quiz',
+  '/narrators',
+  '/about',
+  CORPUS_URL,
+  QUIZ_BUNDLE_URL,
 ];
 
+// Fingerprinted assets (/static/css/main.<hash>.css) never change: cache-first
+const FINGERPRINTED = /\/static\/.+\.[0-9a-f]{10}\.[a-z0-9]+$/;
+// Corpus-derived content: served from cache instantly, refreshed in the background
+const CONTENT = [/^\/hadith\/\d+$/, /^\/narrators?(\/|$)/, /^\/api\/hadiths(\/\d+|\/batch)?$/, /^\/api\/hadith\//, /^\/api\/corpus$/, /^\/api\/quiz\/bundle$/, /^\/quiz$/, /^\/quiz\/start$/, /^\/$/];
+// Query strings that select a page rather than a search
+const CACHEABLE_QUERY = /^\/(api|quiz\/start)(\/|$)/;
+
+const PRECACHE_CONCURRENCY = 6;
+
+// Add URLs a few at a time; one failing page must not abort the install
+async function addAllSettled(cache, urls) {
+  const queue = [...urls];
+  const workers = Array.from({ length: PRECACHE_CONCURRENCY }, async () => {
+    while (queue.length) {
+      const url = queue.shift();
+      try {
+        await cache.add(url);
+      } catch (err) {
+        console.warn('SW: precache failed', url, err);
+      }
+    }
+  });
+  await Promise.all(workers);
+}
+
+async function precache() {
+  const cache = await caches.open(CACHE_NAME);
+  const manifest = await fetch(ASSET_MANIFEST_URL, { cache: 'no-cache' })
+    .then(res => res.json())
+    .catch(() => ({ assets: {} }));
+  // The shell and assets are required; the hadith pages are best-effort
+  await cache.addAll([...STATIC_CACHE_URLS, ...Object.values(manifest.assets)]);
+  const corpus = await cache.match(CORPUS_URL).then(res => (res ? res.json() : []));
+  const bundle = await cache.match(QUIZ_BUNDLE_URL).then(res => (res ? res.json() : { quizzes: {} }));
+  await addAllSettled(cache, [
+    ...corpus.map(h => `/hadith/${h.id}`),
+    ...Object.keys(bundle.quizzes).map(type => `/quiz/start?type=${encodeURIComponent(type)}`),
+  ]);
+}
+
 // Install event
 self.addEventListener('install', event => {
-  event.waitUntil(
-    caches.open(CACHE_NAME)
-      .then(cache => cache.addAll(STATIC_CACHE_URLS))
-      .then(() => self.skipWaiting())
-  );
+  event.waitUntil(precache().then(() => self.skipWaiting()));
 });
 
-// Activate event
+// Activate event - drop caches from previous versions
 self.addEventListener('activate', event => {
   event.waitUntil(
     caches.keys().then(cacheNames => {
       return Promise.all(
         cacheNames
-          .filter(name => name !== CACHE_NAME)
+          .filter(name => name.startsWith(CACHE_PREFIX) && name !== CACHE_NAME)
           .map(name => caches.delete(name))
       );
     }).then(() => self.clients.claim())
   );
 });
 
-// Fetch event - Network first, fallback to cache
+function putInCache(request, response) {
+  if (response.status === 200) {
+    const responseToCache = response.clone();
+    caches.open(CACHE_NAME).then(cache => cache.put(request, responseToCache));
+  }
+  return response;
+}
+
+function offlineResponse(request) {
+  if (request.mode === 'navigate') {
+    return caches.match(OFFLINE_URL);
+  }
+  return new Response('Offline - المحتوى غير متوفر', {
+    status: 503,
+    statusText: 'Service Unavailable',
+    headers: new Headers({
+      'Content-Type': 'text/plain; charset=utf-8'
+    })
+  });
+}
+
 self.addEventListener('fetch', event => {
-  // Skip cross-origin requests
-  if (!event.request.url.startsWith(self.location.origin)) {
+  const request = event.request;
+  // Skip cross-origin and non-GET requests
+  if (request.method !== 'GET' || !request.url.startsWith(self.location.origin)) {
     return;
   }
+  const url = new URL(request.url);
 
-  event.respondWith(
-    fetch(event.request)
-      .then(response => {
-        // Clone the response before caching
-        const responseToCache = response.clone();
-        
-        // Cache successful responses
-        if (response.status === 200) {
-          caches.open(CACHE_NAME).then(cache => {
-            cache.put(event.request, responseToCache);
-          });
+  // Cache first
+  if (FINGERPRINTED.test(url.pathname)) {
+    event.respondWith(
+      caches.match(request).then(cached => cached || fetch(request).then(res => putInCache(request, res)))
+    );
+    return;
+  }
+
+  // Stale-while-revalidate (searches with a query string stay network-first)
+  if (CONTENT.some(re => re.test(url.pathname)) && (!url.search || CACHEABLE_QUERY.test(url.pathname))) {
+    event.respondWith(
+      caches.match(request).then(cached => {
+        const network = fetch(request)
+          .then(res => putInCache(request, res))
+          .catch(() => cached || offlineResponse(request));
+        if (cached) {
+          event.waitUntil(network);
+          return cached;
         }
-        
-        return response;
-      })
-      .catch(() => {
-        // Network failed, try cache
-        return caches.match(event.request)
-          .then(cachedResponse => {
-            if (cachedResponse) {
-              return cachedResponse;
-            }
-            
-            // If no cache, return offline page for navigation requests
-            if (event.request.mode === 'navigate') {
-              return caches.match(OFFLINE_URL);
-            }
-            
-            // For other requests, return a basic error response
-            return new Response('Offline - المحتوى غير متوفر', {
-              status: 503,
-              statusText: 'Service Unavailable',
-              headers: new Headers({
-                'Content-Type': 'text/plain; charset=utf-8'
-              })
-            });
-          });
+        return network;
       })
+    );
+    return;
+  }
+
+  // Network first, fallback to cache
+  event.respondWith(
+    fetch(request)
+      .then(res => putInCache(request, res))
+      .catch(() => caches.match(request).then(cached => cached || offlineResponse(request)))
   );
 });
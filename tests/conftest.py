@@ -0,0 +1,23 @@
+"""
+إعداد الاختبارات: main.py يقرأ templates/ و static/ بمسارات نسبية،
+فنشغّل الاختبارات من جذر المشروع مهما كان مجلد pytest الحالي.
+"""
+
+import os
+import sys
+from pathlib import Path
+
+import pytest
+
+ROOT = Path(__file__).resolve().parents[1]
+os.chdir(ROOT)
+sys.path.insert(0, str(ROOT))
+
+
+@pytest.fixture(scope="session")
+def client():
+    from fastapi.testclient import TestClient
+    import main
+
+    with TestClient(main.app) as c:
+        yield c
@@ -0,0 +1,69 @@
+"""UserActivityIndex يُحدَّث من حلقة الأحداث ومن خيوط to_thread معاً"""
+
+import threading
+
+import bot
+
+
+def _user(reads, last_active, banned=False):
+    return {
+        "read_hadiths":     list(range(reads)),
+        "interaction_count": reads,
+        "streak_last_date": last_active,
+        "banned":           banned,
+    }
+
+
+def test_concurrent_updates_keep_index_consistent():
+    index = bot.UserActivityIndex()
+    index.build([(uid, _user(0, "2026-01-01")) for uid in range(200)])
+
+    def writer(seed):
+        for step in range(300):
+            uid = (seed * 7 + step) % 200
+            index.update(uid, _user((seed + step) % 40, f"2026-01-{1 + step % 28:02d}", banned=step % 11 == 0))
+
+    threads = [threading.Thread(target=writer, args=(seed,)) for seed in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    # كل مستخدم مرة واحدة في الترتيب، وفي دلو تاريخه الحالي فقط (إن لم يكن محظوراً)
+    assert sorted(uid for _, _, uid in index._ranked) == list(range(200))
+    assert index._ranked == sorted((-s[0], -s[1], uid) for uid, s in index._summary.items())
+    bucketed = sorted(uid for bucket in index._buckets.values() for uid in bucket)
+    assert bucketed == sorted(uid for uid, s in index._summary.items() if not s[4])
+    for key, bucket in index._buckets.items():
+        assert all(index._summary[uid][3] == key for uid in bucket)
+    assert index.recipients() == sum(not s[4] for s in index._summary.values())
+
+
+def test_broadcast_reaches_every_recipient(tmp_path, monkeypatch):
+    import asyncio
+
+    monkeypatch.setattr(bot, "_supabase_client", None)
+    users = bot.UserDataManager(tmp_path)
+    for uid in range(1, 91):
+        users._save(uid, {**bot._USER_DEFAULTS, "banned": uid % 10 == 0})
+    users.get_activity_index()
+
+    class Limiter:
+        async def send(self, _bot, uid, text, **kwargs):
+            return "sent"
+
+    class Bot:
+        async def edit_message_text(self, **kwargs):
+            pass
+
+    async def run():
+        manager = bot.BroadcastManager(users, tmp_path / "broadcast.json", limiter=Limiter())
+        manager.BATCH, manager.PAGE = 7, 20
+        total = manager.count_recipients()
+        job = manager.start(Bot(), "نص", "broadcast", chat_id=1, status_message_id=1, total=total)
+        await manager._task
+        return job
+
+    job = asyncio.run(run())
+    assert job["total"] == 81
+    assert job["sent"] == job["total"]
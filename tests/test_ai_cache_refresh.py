@@ -0,0 +1,77 @@
+"""bypass_cache يتجاوز كاش الشروحات ويحدّثه — ومتاح للمشرف عبر /admin_cache refresh"""
+
+import asyncio
+from types import SimpleNamespace
+
+import httpx
+import pytest
+
+import bot
+
+
+@pytest.fixture
+def ai(tmp_path, monkeypatch):
+    monkeypatch.setattr(bot, "AI_CACHE_ENABLED", True)
+    calls = []
+
+    def handler(request):
+        calls.append(request)
+        return httpx.Response(200, json={"choices": [{"message": {"content": f"شرح {len(calls)}"}}]})
+
+    engine = bot.NibrasAI(
+        "key", None, bot.ConversationMemory(),
+        response_cache=bot.AIResponseCache(tmp_path / "ai_cache.sqlite"),
+        transport=httpx.MockTransport(handler),
+    )
+    engine.calls = calls
+    yield engine
+    asyncio.run(engine.aclose())
+
+
+HADITH = {"id": 1, "text": "إنما الأعمال بالنيات", "title": "النية", "narrator": "عمر بن الخطاب"}
+
+
+def test_bypass_cache_regenerates_and_overwrites(ai, monkeypatch):
+    monkeypatch.setattr(bot, "check_rate_limit", lambda *a, **k: True)
+
+    async def run():
+        first  = await ai.explain_hadith(10, HADITH, mode="simple")
+        cached = await ai.explain_hadith(11, HADITH, mode="simple")
+        fresh  = await ai.explain_hadith(12, HADITH, mode="simple", bypass_cache=True)
+        after  = await ai.explain_hadith(13, HADITH, mode="simple")
+        return first, cached, fresh, after
+
+    first, cached, fresh, after = asyncio.run(run())
+    assert (first, cached) == ("شرح 1", "شرح 1")
+    assert fresh == after == "شرح 2"
+    assert len(ai.calls) == 2
+
+
+class _Message:
+    def __init__(self):
+        self.replies = []
+
+    async def reply_text(self, text, **kwargs):
+        self.replies.append(text)
+        return self
+
+    async def edit_text(self, text, **kwargs):
+        self.replies.append(text)
+
+
+def test_admin_cache_refresh_bypasses_cache(ai, monkeypatch):
+    monkeypatch.setenv("DEVELOPER_TELEGRAM_ID", "99")
+    db = bot.HadithDatabase(bot.HADITH_FILE_PATH)
+    handlers = object.__new__(bot.BotHandlers)
+    handlers.db, handlers.ai = db, ai
+    hadith = db.get_by_id(1)
+    ai.response_cache.set("simple", 1, ai.OPENROUTER_MODEL, "شرح قديم")
+
+    message = _Message()
+    update  = SimpleNamespace(effective_user=SimpleNamespace(id=99), message=message)
+    context = SimpleNamespace(args=["refresh", "1", "simple"])
+    asyncio.run(handlers.admin_cache_command(update, context))
+
+    assert len(ai.calls) == 1
+    assert message.replies[-1].startswith("✅")
+    assert ai.response_cache.get("simple", hadith["id"], ai.model_tags) == "شرح 1"
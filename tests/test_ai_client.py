@@ -0,0 +1,99 @@
+"""NibrasAI يستخدم عميل httpx واحداً واتصالاً واحداً محفوظاً عبر الطلبات، ويُغلقه BotService.stop"""
+
+import asyncio
+import json
+import statistics
+import time
+from types import SimpleNamespace
+
+import httpx
+
+import bot
+
+_REPLY = {"choices": [{"message": {"content": "شرح"}}]}
+_MESSAGES = [{"role": "user", "content": "ما معنى النية؟"}]
+
+
+def _make_ai(**kwargs):
+    return bot.NibrasAI("key", None, bot.ConversationMemory(), **kwargs)
+
+
+def test_mock_llm_calls_share_one_client():
+    seen = []
+
+    async def handler(request):
+        seen.append(request)
+        await asyncio.sleep(0.005)   # زمن المزوّد الوهمي
+        return httpx.Response(200, json=_REPLY)
+
+    async def run():
+        ai = _make_ai(transport=httpx.MockTransport(handler))
+        client = ai._client
+        latencies = []
+        for _ in range(20):
+            started = time.perf_counter()
+            assert await ai._complete(_MESSAGES) == (ai.OPENROUTER_MODEL, "شرح")
+            latencies.append(time.perf_counter() - started)
+        assert ai._client is client
+        await ai.aclose()
+        return latencies
+
+    latencies = asyncio.run(run())
+    print(f"\nLLM وهمي (5ms): p50={statistics.median(latencies) * 1e3:.1f}ms max={max(latencies) * 1e3:.1f}ms")
+    assert len(seen) == 20
+    assert all(json.loads(r.content)["model"] == bot.NibrasAI.OPENROUTER_MODEL for r in seen)
+
+
+def test_keepalive_reuses_one_connection(monkeypatch):
+    """خادم محلي يعدّ الاتصالات المفتوحة: 10 طلبات متتالية = اتصال واحد"""
+    connections = 0
+    body = json.dumps(_REPLY).encode()
+
+    async def serve(reader, writer):
+        nonlocal connections
+        connections += 1
+        try:
+            while True:
+                head = await reader.readuntil(b"\r\n\r\n")
+                length = next(
+                    int(line.split(b":", 1)[1]) for line in head.split(b"\r\n")
+                    if line.lower().startswith(b"content-length:")
+                )
+                await reader.readexactly(length)
+                writer.write(
+                    b"HTTP/1.1 200 OK\r\nContent-Type: application/json\r\n"
+                    b"Content-Length: " + str(len(body)).encode() + b"\r\n\r\n" + body
+                )
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            writer.close()
+
+    async def run():
+        server = await asyncio.start_server(serve, "127.0.0.1", 0)
+        port = server.sockets[0].getsockname()[1]
+        monkeypatch.setattr(bot.NibrasAI, "OPENROUTER_URL", f"http://127.0.0.1:{port}/v1/chat/completions")
+        ai = _make_ai()
+        for _ in range(10):
+            assert await ai._complete(_MESSAGES) == (ai.OPENROUTER_MODEL, "شرح")
+        await ai.aclose()
+        server.close()
+        await server.wait_closed()
+
+    asyncio.run(run())
+    assert connections == 1
+
+
+def test_bot_service_stop_closes_client():
+    async def noop():
+        pass
+
+    async def run():
+        service = object.__new__(bot.BotService)
+        service._tasks = []
+        service.app = SimpleNamespace(updater=None, stop=noop, shutdown=noop)
+        service.ai = _make_ai(transport=httpx.MockTransport(lambda r: httpx.Response(200, json=_REPLY)))
+        assert not service.ai._client.is_closed
+        await service.stop()
+        return service.ai._client
+
+    assert asyncio.run(run()).is_closed
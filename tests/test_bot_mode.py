@@ -0,0 +1,17 @@
+"""bot.py و main.py يقرآن BOT_MODE من نفس المصدر (config.settings)"""
+
+import subprocess
+import sys
+
+
+def _bot_mode(env_value, cwd):
+    code = "import bot, main; print(bot.BOT_MODE, main.settings.bot_mode)"
+    env = {"PATH": "/usr/bin:/bin", "BOT_MODE": env_value} if env_value is not None else {"PATH": "/usr/bin:/bin"}
+    out = subprocess.run([sys.executable, "-c", code], cwd=cwd, env=env, capture_output=True, text=True, check=True)
+    return out.stdout.split()[-2:]
+
+
+def test_bot_and_web_agree_on_bot_mode():
+    from conftest import ROOT
+    assert _bot_mode(" Webhook ", ROOT) == ["webhook", "webhook"]
+    assert _bot_mode("polling", ROOT) == ["polling", "polling"]
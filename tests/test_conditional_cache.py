@@ -0,0 +1,46 @@
+"""الزيارة المتكررة لمسار ذي إصدار = 304 بلا أي بايتات في الجسم"""
+
+import pytest
+
+
+@pytest.mark.parametrize("path", ["/api/hadiths/1", "/api/hadiths?skip=0&limit=5", "/"])
+def test_repeat_visit_transfers_no_body(client, path):
+    first = client.get(path)
+    assert first.status_code == 200
+    assert first.content
+    etag = first.headers["etag"]
+
+    repeat = client.get(path, headers={"If-None-Match": etag})
+    assert repeat.status_code == 304
+    assert repeat.content == b""
+    assert repeat.headers["etag"] == etag
+
+
+def test_if_modified_since_returns_304(client):
+    first = client.get("/api/hadiths/1")
+    repeat = client.get("/api/hadiths/1", headers={"If-Modified-Since": first.headers["last-modified"]})
+    assert repeat.status_code == 304
+    assert repeat.content == b""
+
+
+def test_stale_etag_gets_full_body(client):
+    response = client.get("/api/hadiths/1", headers={"If-None-Match": 'W/"stale"'})
+    assert response.status_code == 200
+    assert response.content
+
+
+@pytest.mark.parametrize("path", ["/api/hadiths/1", "/api/hadiths?skip=0&limit=50", "/api/corpus"])
+def test_cors_headers_survive_precompression(client, path):
+    origin = {"Origin": "https://client.example"}
+    first = client.get(path, headers=origin)
+    cached = client.get(path, headers=origin)
+    repeat = client.get(path, headers={**origin, "If-None-Match": first.headers["etag"]})
+    for response in (first, cached, repeat):
+        assert "access-control-allow-origin" in response.headers
+
+
+def test_unknown_query_params_share_cache_entry(client):
+    base = client.get("/api/hadiths?skip=0&limit=5")
+    junk = client.get("/api/hadiths?limit=5&skip=0&cachebuster=123")
+    assert junk.headers["etag"] == base.headers["etag"]
+    assert junk.content == base.content
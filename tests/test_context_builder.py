@@ -0,0 +1,62 @@
+"""ContextBuilder على محادثة مسجّلة: ضمن الميزانية، مع رسالة النظام والأدوار الأحدث، وبدون الأقدم"""
+
+import json
+from pathlib import Path
+
+import pytest
+
+import bot
+
+FIXTURE = Path(__file__).parent / "fixtures" / "conversation_hadith1.json"
+PROMPT  = bot.NibrasAI._PROMPTS["normal"]
+
+
+@pytest.fixture(scope="module")
+def conversation():
+    return json.loads(FIXTURE.read_text(encoding="utf-8"))
+
+
+@pytest.fixture(scope="module")
+def hadith(conversation):
+    return bot.HadithDatabase(bot.HADITH_FILE_PATH).get_by_id(conversation["active_hadith"])
+
+
+def _cost(message):
+    return bot.estimate_tokens(message["content"]) + bot.ContextBuilder.MESSAGE_OVERHEAD
+
+
+@pytest.mark.parametrize("budget", [200, 500, 900])
+def test_recorded_conversation_fits_budget(conversation, hadith, budget):
+    history  = conversation["history"]
+    builder  = bot.ContextBuilder(history_budget=budget)
+    messages = builder.build(PROMPT, history, conversation["question"], hadith)
+
+    system, *kept, question = messages
+    assert sum(_cost(m) for m in history) > budget          # المحادثة أطول من الميزانية فعلاً
+    assert sum(_cost(m) for m in kept) <= budget
+
+    # رسالة النظام كاملة (مع الحديث المناقَش) والسؤال الحالي كما هو
+    assert system["role"] == "system" and system["content"].startswith(PROMPT)
+    assert f"الرقم: {hadith['id']}" in system["content"]
+    assert question == {"role": "user", "content": conversation["question"]}
+
+    # الأحدث محفوظ بترتيبه، والمقتطع (إن وُجد) هو الأقدم بين المحفوظين فقط
+    whole = kept[1:] if kept and kept[0] not in history else kept
+    assert whole == history[len(history) - len(whole):]
+    assert kept, "أحدث دور يجب أن يبقى"
+    if kept[0] not in history:
+        truncated = history[len(history) - len(whole) - 1]["content"]
+        assert truncated.endswith(kept[0]["content"].lstrip("…"))
+
+    # الأقدم خرج من الرسائل، وأسئلته ملخّصة في سطر النظام
+    assert history[1] not in kept
+    assert history[0]["content"] in system["content"]
+
+
+def test_recorded_conversation_savings(conversation, hadith):
+    """قياس: التوكنات المُرسلة مقابل إرسال السجل كاملاً"""
+    builder = bot.ContextBuilder(history_budget=bot.AI_HISTORY_TOKEN_BUDGET)
+    builder.build(PROMPT, conversation["history"], conversation["question"], hadith)
+    stats = builder.stats()
+    print(f"\nمحادثة مسجّلة: ~{stats['avg_sent']:.0f} توكن مُرسل | وُفّر {stats['saved']:.0%}")
+    assert stats["saved"] > 0.3
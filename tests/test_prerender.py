@@ -0,0 +1,50 @@
+"""النصوص المجهّزة عند الإقلاع تطابق المسار غير المخزَّن بايتاً ببايت، وأسرع منه"""
+
+import timeit
+
+import pytest
+
+import bot
+
+Formatter = bot.MessageFormatter
+
+
+@pytest.fixture(scope="module")
+def hadiths():
+    for cache in bot._caches.values():
+        cache.clear()
+    data = bot.HadithDatabase(bot.HADITH_FILE_PATH).get_all()
+    Formatter.prerender(data)
+    return data
+
+
+def test_prerendered_text_is_byte_identical(hadiths):
+    for h in hadiths:
+        assert Formatter.build_hadith_display(h)[0].encode() == Formatter._render_hadith_body(h).encode()
+        assert Formatter.build_share_text(h).encode() == Formatter._render_share_text(h).encode()
+        if h.get("english_text"):
+            assert Formatter.build_english_display(h).encode() == Formatter._render_english_display(h).encode()
+        if h.get("narrator_full"):
+            narrator = h["narrator_full"]
+            assert Formatter.build_narrator_card(narrator).encode() == Formatter._render_narrator_card(narrator).encode()
+
+
+@pytest.mark.parametrize("is_favorite,has_note", [(False, False), (False, True), (True, False), (True, True)])
+def test_prerendered_keyboard_matches_fresh(hadiths, is_favorite, has_note):
+    for h in hadiths:
+        cached = Formatter.build_hadith_keyboard(h["id"], is_favorite, has_note)
+        fresh  = Formatter._render_hadith_keyboard(h["id"], is_favorite, has_note)
+        assert cached.to_json().encode() == fresh.to_json().encode()
+
+
+def test_prerendered_display_is_faster_than_rendering(hadiths):
+    """قياس مصغّر: عرض الحديث مع أزراره من الكاش مقابل بنائهما من الصفر"""
+    def bench(fn):
+        return min(timeit.repeat(lambda: [fn(h) for h in hadiths], number=50, repeat=5))
+
+    cached_s   = bench(lambda h: Formatter.build_hadith_display(h, include_actions=True))
+    uncached_s = bench(lambda h: (
+        Formatter._render_hadith_body(h), Formatter._render_hadith_keyboard(h["id"], False, False)
+    ))
+    print(f"\nعرض {len(hadiths)} حديث مع الأزرار ×50: مجهّز {cached_s * 1e3:.2f}ms | من الصفر {uncached_s * 1e3:.2f}ms")
+    assert cached_s * 3 < uncached_s
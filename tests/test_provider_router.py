@@ -0,0 +1,73 @@
+"""ProviderRouter بمزوّدين وهميين وأزمنة asyncio.sleep مضبوطة"""
+
+import asyncio
+
+import pytest
+
+import bot
+
+
+def _provider(delay, reply=None, error=None):
+    async def call(messages):
+        await asyncio.sleep(delay)
+        if error:
+            raise error
+        return reply
+    return call
+
+
+def _router(monkeypatch, **providers):
+    router = bot.ProviderRouter(providers)
+    monkeypatch.setattr(router, "MIN_HEDGE", 0.01)
+    return router
+
+
+def _seed(router, name, latency, count=5):
+    for _ in range(count):
+        router.record(name, True, latency)
+
+
+def test_cancelled_loser_is_not_a_latency_sample(monkeypatch):
+    # الأول يتأخر قليلاً بعد مهلة التحوّط ثم يفوز؛ الثاني يُلغى بعد ~0.03ث
+    router = _router(monkeypatch, a=_provider(0.08, "أ"), b=_provider(1.0, "ب"))
+    _seed(router, "a", 0.05)
+    _seed(router, "b", 0.5)
+
+    assert asyncio.run(router.call([])) == ("a", "أ")
+    assert router.hedged == 1
+    assert router._stats["b"]["latency"] == pytest.approx(0.5)
+    assert list(router._stats["b"]["samples"]) == [0.5] * 5
+    assert router.order() == ["a", "b"]
+
+
+def test_unsampled_loser_stays_unknown(monkeypatch):
+    router = _router(monkeypatch, a=_provider(0.08, "أ"), b=_provider(1.0, "ب"))
+    _seed(router, "a", 0.05)
+
+    asyncio.run(router.call([]))
+    assert router._stats["b"]["latency"] is None
+    assert not router._stats["b"]["samples"]
+
+
+def test_slow_primary_loses_to_hedge_and_its_estimate_rises(monkeypatch):
+    router = _router(monkeypatch, a=_provider(1.0, "أ"), b=_provider(0.02, "ب"))
+    _seed(router, "a", 0.05)
+    _seed(router, "b", 0.2)
+
+    assert asyncio.run(router.call([])) == ("b", "ب")
+    # أُلغي بعد ~0.07ث > تقديره 0.05 — حدّ أدنى يرفع التقدير، ولا يُضاف لعينات p95
+    assert router._stats["a"]["latency"] > 0.05
+    assert len(router._stats["a"]["samples"]) == 5
+
+
+def test_provider_without_samples_does_not_sort_first(monkeypatch):
+    router = _router(monkeypatch, new=_provider(0.01, "ج"), known=_provider(0.01, "د"))
+    _seed(router, "known", 0.8)
+    assert router.order() == ["known", "new"]
+
+
+def test_failed_primary_falls_over_immediately(monkeypatch):
+    router = _router(monkeypatch, a=_provider(0.01, error=RuntimeError("down")), b=_provider(0.01, "ب"))
+    assert asyncio.run(router.call([])) == ("b", "ب")
+    assert router.hedged == 0
+    assert router._stats["a"]["errors"] > 0
@@ -0,0 +1,93 @@
+"""
+تطابق مولّد الاختبارات في المتصفح (static/js/quiz.js) مع generate_quiz_questions
+──────────────────────────────────────────────────────────────────────────
+العشوائية مثبّتة في الطرفين: Math.random = () => 0 في JS، ومقابلها في Python
+(choice = الأول، shuffle/sample بنفس تبديلات Fisher–Yates عند r = 0).
+تُقارن السؤال ونص الحديث والشرح والإجابة الصحيحة — ترتيب الخيارات الخاطئة
+يعتمد على ترتيب set في Python فلا يُقارن.
+"""
+
+import json
+import shutil
+import subprocess
+
+import pytest
+
+import main
+
+NODE = shutil.which("node")
+pytestmark = pytest.mark.skipif(NODE is None, reason="node غير متوفر")
+
+_NODE_SCRIPT = r"""
+Math.random = () => 0;
+const { QuizGenerator, QUIZ_MAKERS } = require(process.argv[1]);
+const bundle = JSON.parse(require('fs').readFileSync(0, 'utf8'));
+const makers = {};
+for (const [name, make] of Object.entries(QUIZ_MAKERS)) {
+    makers[name] = {};
+    for (const h of bundle.hadiths) makers[name][h.id] = make(h, bundle.hadiths);
+}
+const quizzes = {};
+const generator = new QuizGenerator(bundle);
+for (const type of Object.keys(bundle.quizzes)) quizzes[type] = generator.generate(type).questions;
+process.stdout.write(JSON.stringify({ makers, quizzes }));
+"""
+
+
+def _js_shuffle(items: list) -> None:
+    """quizShuffle عند Math.random() = 0: العنصر i يُبدَّل مع الأول"""
+    for i in range(len(items) - 1, 0, -1):
+        items[i], items[0] = items[0], items[i]
+
+
+def _js_sample(items, count: int) -> list:
+    pool = list(items)
+    _js_shuffle(pool)
+    return pool[:count]
+
+
+@pytest.fixture(scope="module")
+def client_output():
+    result = subprocess.run(
+        [NODE, "-e", _NODE_SCRIPT, str(main.Path("static/js/quiz.js").resolve())],
+        input=main.QUIZ_BUNDLE_JSON, capture_output=True, check=True, timeout=60,
+    )
+    return json.loads(result.stdout)
+
+
+@pytest.fixture
+def pinned_random(monkeypatch):
+    monkeypatch.setattr(main.random, "choice", lambda seq: seq[0])
+    monkeypatch.setattr(main.random, "shuffle", _js_shuffle)
+    monkeypatch.setattr(main.random, "sample", _js_sample)
+
+
+def _summary(question):
+    if question is None:
+        return None
+    return {
+        "question":    question["question"],
+        "hadith_text": question.get("hadith_text"),
+        "explanation": question["explanation"],
+        "answer":      question["options"][question["correctAnswer"]],
+        "options":     len(question["options"]),
+    }
+
+
+@pytest.mark.parametrize("maker", sorted(main._QUIZ_MAKERS))
+def test_makers_match(client_output, pinned_random, maker):
+    server = {h["id"]: _summary(main._QUIZ_MAKERS[maker](h, main.HADITHS_DATA)) for h in main.HADITHS_DATA}
+    client = {int(hid): _summary(q) for hid, q in client_output["makers"][maker].items()}
+    assert client == server
+
+
+@pytest.mark.parametrize("quiz_type", sorted(main.QUIZ_CONFIG))
+def test_generated_quizzes_match(client_output, pinned_random, quiz_type):
+    questions, _, _ = main.generate_quiz_questions(quiz_type)
+    assert [_summary(q) for q in client_output["quizzes"][quiz_type]] == [_summary(q) for q in questions]
+
+
+def test_bundle_covers_every_quiz_type():
+    bundle = json.loads(main.QUIZ_BUNDLE_JSON)
+    assert set(bundle["quizzes"]) == set(main.QUIZ_CONFIG)
+    assert bundle["version"] == main.CONTENT_VERSION
@@ -0,0 +1,103 @@
+"""الخلفيتان (GCRA في الذاكرة وSQLite المشترك) تتصرفان بالمثل، وكلفة SQLite تحت 4 عمليات"""
+
+import multiprocessing
+import sqlite3
+import time
+
+import pytest
+
+import bot
+
+
+class Clock:
+    def __init__(self, now):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock(1_700_000_000.0)
+    monkeypatch.setattr(bot.time, "time", clock)
+    monkeypatch.setattr(bot.time, "monotonic", clock)
+    return clock
+
+
+def _limiters(tmp_path, **kwargs):
+    conn = bot._open_rate_limit_db(str(tmp_path / "rate.sqlite"))
+    return bot.GCRALimiter(**kwargs), bot.SQLiteWindowLimiter(conn, "ai", **kwargs)
+
+
+def test_ai_burst_is_the_same_on_both_backends(tmp_path, clock):
+    gcra, window = _limiters(tmp_path, limit=8, period=60, burst=3)
+    assert sum(gcra.allow(1) for _ in range(10)) == 3
+    assert sum(window.allow(1) for _ in range(10)) == 3
+
+
+def test_sustained_rate_is_the_same_on_both_backends(tmp_path, clock):
+    gcra, window = _limiters(tmp_path, limit=8, period=60, burst=3)
+    allowed = {"gcra": 0, "sqlite": 0}
+    for _ in range(600):                 # طلب كل ثانية لعشر دقائق
+        allowed["gcra"]   += gcra.allow(1)
+        allowed["sqlite"] += window.allow(1)
+        clock.now += 1
+    # 8/دقيقة × 10 دقائق (+ الدفعة الأولى)
+    assert 78 <= allowed["gcra"] <= 83
+    assert 70 <= allowed["sqlite"] <= 83
+
+
+def test_no_burst_means_full_limit_at_once(tmp_path, clock):
+    gcra, window = _limiters(tmp_path, limit=20, period=60)
+    assert sum(gcra.allow(1) for _ in range(30)) == 20
+    assert sum(window.allow(1) for _ in range(30)) == 20
+
+
+def _worker(path, key, count, limit, out):
+    conn = bot._open_rate_limit_db(path)
+    limiter = bot.SQLiteWindowLimiter(conn, "message", limit, 60)
+    started = time.perf_counter()
+    for i in range(count):
+        limiter.allow(key if key is not None else i)
+    out.put((time.perf_counter() - started, limiter.allowed, limiter.failed_open))
+
+
+def _run_workers(path, key, count, limit, workers=4):
+    ctx = multiprocessing.get_context("fork")
+    out = ctx.Queue()
+    procs = [
+        ctx.Process(target=_worker, args=(path, key if key is not None else None, count, limit, out))
+        for _ in range(workers)
+    ]
+    for p in procs:
+        p.start()
+    results = [out.get(timeout=60) for _ in procs]
+    for p in procs:
+        p.join()
+    return results
+
+
+def test_overhead_under_four_workers(tmp_path):
+    """قياس: كلفة allow() لكل طلب مع 4 عمليات تكتب في نفس الملف"""
+    path = str(tmp_path / "rate.sqlite")
+    bot._open_rate_limit_db(path).close()
+    results = _run_workers(path, key=None, count=500, limit=1_000_000)
+    per_request = sorted(elapsed / 500 for elapsed, _, _ in results)
+    failed_open = sum(f for _, _, f in results)
+    print(
+        f"\nSQLite limiter ×4 workers: {per_request[0] * 1e6:.0f}–{per_request[-1] * 1e6:.0f}µs/طلب"
+        f" | fail-open {failed_open}/{4 * 500}"
+    )
+    assert per_request[-1] < 0.01
+
+
+def test_shared_key_is_limited_across_workers(tmp_path):
+    path = str(tmp_path / "rate.sqlite")
+    bot._open_rate_limit_db(path).close()
+    results = _run_workers(path, key=42, count=100, limit=50)
+    # allowed لا يشمل fail-open (يُسمح به بلا عدّ عند التزاحم على القفل)
+    allowed = sum(a for _, a, _ in results)
+    count = sqlite3.connect(path).execute("SELECT SUM(count) FROM rate_windows WHERE key = 42").fetchone()[0]
+    assert allowed == count
+    assert 45 <= count <= 50
@@ -0,0 +1,48 @@
+"""وقت الاستخدام في SessionStore.get يُحفظ، فالجلسة النشطة تبقى بعد إعادة التشغيل"""
+
+import bot
+
+
+class Clock:
+    def __init__(self, now):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+def test_touch_survives_restart(tmp_path, monkeypatch):
+    clock = Clock(1_000_000.0)
+    monkeypatch.setattr(bot.time, "time", clock)
+    db = str(tmp_path / "sessions.sqlite")
+    ttl = bot.SessionStore.TTL["note"]
+
+    store = bot.SessionStore(db_path=db)
+    store.set("note", 7, {"hadith_id": 1})
+    # استخدام متكرر قبل انتهاء المهلة بقليل — آخره يُحفظ عند الإيقاف
+    for _ in range(3):
+        clock.now += ttl - 60
+        assert store.get("note", 7) == {"hadith_id": 1}
+    store.flush()
+
+    clock.now += 60
+    restarted = bot.SessionStore(db_path=db)
+    assert restarted.get("note", 7) == {"hadith_id": 1}
+
+
+def test_touches_flush_in_batches(tmp_path, monkeypatch):
+    clock = Clock(1_000_000.0)
+    monkeypatch.setattr(bot.time, "time", clock)
+    db = str(tmp_path / "sessions.sqlite")
+
+    store = bot.SessionStore(db_path=db)
+    store.set("quiz", 1, [1])
+    store.set("quiz", 2, [2])
+    clock.now += 1
+    store.get("quiz", 1)
+    assert store._touched                       # لم يحن موعد الحفظ بعد
+    clock.now += store.TOUCH_FLUSH_EVERY
+    store.get("quiz", 2)
+    assert not store._touched                   # حُفظ الاثنان معاً
+    rows = dict(store._db.execute("SELECT user_id, touched FROM sessions").fetchall())
+    assert rows == {1: 1_000_001.0, 2: 1_000_001.0 + store.TOUCH_FLUSH_EVERY}
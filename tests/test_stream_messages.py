@@ -0,0 +1,61 @@
+"""_stream_to_messages لا يترك رسائل زائدة بمحتوى قديم إذا قلّت الأجزاء بعد التنسيق"""
+
+import asyncio
+
+import bot
+
+
+class _Message:
+    def __init__(self, sent):
+        self.sent = sent
+        self.text = ""
+        self.deleted = False
+        sent.append(self)
+
+    async def edit_text(self, text, **kwargs):
+        self.text = text
+
+    async def reply_text(self, text, **kwargs):
+        reply = _Message(self.sent)
+        reply.text = text
+        return reply
+
+    async def delete(self):
+        self.deleted = True
+
+
+def _handlers(monkeypatch):
+    monkeypatch.setattr(bot.BotHandlers, "STREAM_EDIT_INTERVAL", 0.0)
+    handlers = object.__new__(bot.BotHandlers)
+    handlers.fmt = bot.MessageFormatter()
+    return handlers
+
+
+async def _chunks(*parts):
+    for part in parts:
+        yield part
+
+
+def test_extra_streamed_messages_are_deleted(monkeypatch):
+    handlers = _handlers(monkeypatch)
+    sent = []
+    status = _Message(sent)
+    # أثناء البث: 4090 حرفاً + اقتراح قصير يُحذف عند التنسيق + " ▌" → جزآن؛ النهائي جزء واحد
+    body = " ".join(["كلمة"] * 818)[:4090]
+    asyncio.run(handlers._stream_to_messages(status, _chunks(body, "##abc##")))
+
+    assert len(sent) == 2
+    assert status.text == body
+    assert sent[1].deleted
+
+
+def test_all_parts_kept_when_count_matches(monkeypatch):
+    handlers = _handlers(monkeypatch)
+    sent = []
+    status = _Message(sent)
+    paragraph = ("سطر " * 300).strip()
+    asyncio.run(handlers._stream_to_messages(status, _chunks(*[paragraph + "\n\n"] * 6)))
+
+    assert len(sent) > 1
+    assert not any(m.deleted for m in sent)
+    assert "".join(m.text for m in sent).replace("\n", "").replace(" ", "") == (paragraph * 6).replace(" ", "")
@@ -0,0 +1,44 @@
+"""وضع Webhook: البوت يبني HadithDatabase من لقطة main.py نفسها بدل قراءة الملف مرة ثانية"""
+
+import asyncio
+from pathlib import Path
+
+import bot
+import main
+
+
+def test_database_built_from_shared_records_does_not_read_file():
+    db = bot.HadithDatabase(Path("/nonexistent/nawawi40.json"), records=main.HADITHS_RAW)
+    assert len(db) == len(main.HADITHS_DATA)
+    for hid, record in main.HADITHS_INDEX.items():
+        # نفس الكائنات المتداخلة، لا نسخة ثانية منها
+        assert db.get_by_id(hid)["narrator_full"] is record["narrator_dict"]
+        assert db.get_by_id(hid)["vocabulary"] is record["vocabulary"]
+
+
+def test_webhook_lifespan_passes_snapshot_to_bot(monkeypatch):
+    created = {}
+
+    class FakeService:
+        def __init__(self, webhook=False, hadith_records=None):
+            created.update(webhook=webhook, hadith_records=hadith_records)
+
+        async def start(self):
+            pass
+
+        async def stop(self):
+            created["stopped"] = True
+
+    monkeypatch.setattr(bot, "BotService", FakeService)
+    monkeypatch.setattr(main.settings, "bot_mode", "webhook")
+    monkeypatch.setenv("WEB_WORKERS", "1")
+    monkeypatch.setattr(main, "bot_service", None)   # lifespan يضبطه؛ يُعاد بعد الاختبار
+
+    async def run():
+        async with main.lifespan(main.app):
+            pass
+
+    asyncio.run(run())
+    assert created["webhook"] is True
+    assert created["hadith_records"] is main.HADITHS_RAW
+    assert created["stopped"]